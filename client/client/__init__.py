@@ -4,6 +4,7 @@ import argparse
 import os.path
 import pathlib
 import subprocess
+from typing import Optional
 
 import requests
 from lxml import etree as ET
@@ -13,6 +14,10 @@ from core import get_available_versions, namespace, dependencies_are_equal, get_
 RANGE_CONVERSION_SCRIPT = pathlib.Path(__file__).parent.resolve() / "range_converter.py"
 SERVER_URL = "http://127.0.0.1:5000"
 
+# Ranges and compatible versions prefetched with a single batch request, consulted before querying per GAV
+prefetched_ranges: dict[str, Optional[str]] = {}
+prefetched_compatible_versions: dict[str, Optional[list[str]]] = {}
+
 
 def convert_compat_list_to_range(g: str, a: str, compatible_versions: list[str], use_remote=False):
     """Calls the range converter which uses Maven's ComparableVersion via Jython."""
@@ -101,9 +106,40 @@ def replace_dep(soft_dep: ET.Element, range: str, pom: ET.Element, properties: d
     return replaced
 
 
+def get_compatible_version_lists(gavs: list[str]) -> dict[str, Optional[list[str]]]:
+    """Query server once for, and return, the pre-calculated compatible versions (or None) of all the given GAVs"""
+    query = f"{SERVER_URL}/compatibilities"
+    try:
+        response = requests.post(query, json=gavs)
+    except requests.ConnectionError as e:
+        print(e)
+        return {}
+    if response.status_code == 200:
+        return response.json()['compatible_versions']
+    else:
+        return {}
+
+
+def get_compatible_version_ranges(gavs: list[str]) -> dict[str, Optional[str]]:
+    """Query server once for, and return, the range specs (or None) of all the given GAVs, computed by the server"""
+    query = f"{SERVER_URL}/ranges"
+    try:
+        response = requests.post(query, json=gavs)
+    except requests.ConnectionError as e:
+        print(e)
+        return {}
+    if response.status_code == 200:
+        return response.json()['ranges']
+    else:
+        return {}
+
+
 def get_compatible_version_list(g: str, a: str, v: str):
     """Query server for, and return, the pre-calculated compatible versions of GAV"""
-    query = f"{SERVER_URL}/compatibilities/{g}:{a}:{v}"
+    gav = f"{g}:{a}:{v}"
+    if gav in prefetched_compatible_versions:
+        return prefetched_compatible_versions[gav]
+    query = f"{SERVER_URL}/compatibilities/{gav}"
     response = requests.get(query)
     if response.status_code == 200:
         return response.json()['compatible_versions']
@@ -121,12 +157,44 @@ def get_compatible_version_range(dep: ET.Element, properties: dict):
         v = properties.get(v, "")
     if not v:
         return None
+    gav = f"{g}:{a}:{v}"
+    if gav in prefetched_ranges:
+        return prefetched_ranges[gav]
     compatible_versions = get_compatible_version_list(g, a, v)
     if not compatible_versions:
         return None
     return convert_compat_list_to_range(g, a, compatible_versions).decode('utf-8')
 
 
+def prefetch_compatible_version_ranges(deps: list[ET.Element], properties: dict):
+    """
+    Fetches the ranges of all the given <dependency>-elements with a single request to the server. Falls back to
+    prefetching their compatible versions, to be converted locally, if the server cannot compute ranges.
+    """
+    gavs = get_gavs_of_deps(deps, properties)
+    prefetched_ranges.clear()
+    prefetched_compatible_versions.clear()
+    if not gavs:
+        return
+    prefetched_ranges.update(get_compatible_version_ranges(gavs))
+    if not prefetched_ranges:
+        prefetched_compatible_versions.update(get_compatible_version_lists(gavs))
+
+
+def get_gavs_of_deps(deps: list[ET.Element], properties: dict) -> list[str]:
+    """Returns the GAV strings of the given <dependency>-elements, resolving version properties."""
+    gavs = []
+    for dep in deps:
+        g = get_text_of_child(dep, "groupId")
+        a = get_text_of_child(dep, "artifactId")
+        v = get_text_of_child(dep, "version")
+        if version_is_property(v) and properties:
+            v = properties.get(v, "")
+        if v:
+            gavs.append(f"{g}:{a}:{v}")
+    return gavs
+
+
 def get_softver_deps(pom: ET.Element, effective_pom: ET.Element) -> (list[ET.Element], dict):
     """Returns a list of <dependency>-elements which have a <version>-tag that is a soft constraint."""
     dependencies = pom.findall(".//maven:dependency", namespace)
@@ -148,6 +216,7 @@ def get_softver_deps(pom: ET.Element, effective_pom: ET.Element) -> (list[ET.Ele
 def replace_softvers(pom: ET.Element, effective_pom: ET.Element, write_to=None):
     """Replaces all declared soft version constraints with their compatible ranges."""
     soft_deps, properties = get_softver_deps(pom, effective_pom)
+    prefetch_compatible_version_ranges(soft_deps, properties)
     num_replaced = 0
     for dep in soft_deps:
         range = get_compatible_version_range(dep, properties)
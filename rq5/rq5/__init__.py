@@ -23,13 +23,14 @@ from rq4.non_breaking.utils import repo_has_pom, get_file
 from rq5 import utils
 from rq5.models import engine, set_up_db
 from rq5.models.compatibility import add_compatibility, get_compatibilities_of_base
-from rq5.models.dependency import (add_dependency, get_dependencies, update_dependency_err,
+from rq5.models.dependency import (add_dependency, get_dependencies, update_dependency_err, get_dependency,
                                    update_dependency_evaluated_with_date, get_dependencies_that_are_processed)
 from rq5.models.project import add_project, project_exists, get_projects_that_compile_and_has_tests
 from server import find_compatibility_results
 from server import repo_utils, save_compatibility_store
 from server.config import download_repo_by_name, path_to_repos, COMPATIBILITY_STORE
-from server.exceptions import (MavenSurefireTestFailedException, MavenNoPomInDirectoryException,
+from server.work_queue import WorkQueue, Task, run_worker
+from server.exceptions import (get_error_code, MavenSurefireTestFailedException, MavenNoPomInDirectoryException,
                                GithubRepoNotFoundException, BaseMavenTestTimeout, BaseMavenCompileTimeout,
                                GithubTagNotFoundException, MavenResolutionFailedException, MavenCompileFailedException)
 from core import MavenMetadataNotFound
@@ -227,8 +228,8 @@ def collect_compatibilities():
                 print(f"something illegal happened: {dependency.group_id}:{dependency.artifact_id}:{dependency.version}")
             assert dependency.is_new  # Remove if recomputing
             try:
-                compatibility_results = find_compatibility_results(dependency.group_id, dependency.artifact_id,
-                                                                   dependency.version)
+                compatibility_results, _ = find_compatibility_results(dependency.group_id, dependency.artifact_id,
+                                                                      dependency.version)
                 for result in compatibility_results:
                     add_compatibility(result.group_id, result.artifact_id, result.v_base, result.v_cand, db,
                                       result.statically_compatible, result.dynamically_compatible, result.err)
@@ -272,6 +273,44 @@ def collect_compatibilities():
                   + utils.bcolors.ENDC)
 
 
+def enqueue_compatibilities(queue="rq5-compatibilities"):
+    """Adds the dependencies that were not evaluated yet to the shared work queue, see work_on_compatibilities."""
+    with Session(engine) as db:
+        tasks = {f"{d.group_id}:{d.artifact_id}:{d.version}": {'g': d.group_id, 'a': d.artifact_id, 'v': d.version}
+                 for d in get_dependencies(db) if d.err is None and d.evaluated is None}
+    added = WorkQueue().enqueue_many(queue, tasks)
+    print(f"Enqueued {added} of {len(tasks)} unevaluated dependencies")
+
+
+def evaluate_dependency(task: Task):
+    g, a, v = task.payload['g'], task.payload['a'], task.payload['v']
+    with Session(engine) as db:
+        dependency = get_dependency(g, a, v, db)
+        try:
+            compatibility_results, policy_stats = find_compatibility_results(g, a, v)
+        except Exception as e:
+            update_dependency_err(dependency, get_error_code(e), db)
+            raise
+        for result in compatibility_results:
+            add_compatibility(result.group_id, result.artifact_id, result.v_base, result.v_cand, db,
+                              result.statically_compatible, result.dynamically_compatible, result.err)
+        update_dependency_evaluated_with_date(dependency, db)
+        return {'compatible_versions': [result.v_cand for result in compatibility_results
+                                        if result.statically_compatible and result.dynamically_compatible],
+                'candidate_policies': policy_stats}
+
+
+def work_on_compatibilities(queue="rq5-compatibilities"):
+    """
+    Same as collect_compatibilities, but claims the dependencies from the shared work queue, so that any number of
+    workers on machines sharing the resources directories can process one sweep.
+    """
+    work_queue = WorkQueue()
+    handled = run_worker(work_queue, queue, evaluate_dependency)
+    print(f"Evaluated {handled} dependencies, queue is now {work_queue.counts(queue)}")
+    pprint(work_queue.outcomes(queue))
+
+
 def collect_dependencies(use_original_pom=False):
     save_tree_as = "original_dep.tree" if use_original_pom else "new_dep.tree"
     save_log_as = "original_build.log" if use_original_pom else "new_build.log"
@@ -607,6 +646,7 @@ def confirm(step: str, recompute: bool):
 def main():
     parser = argparse.ArgumentParser(description='Script that collects the datapoints used to evaluate RQ5.')
     parser.add_argument('-s', '--step', choices=['projects', 'dependencies', 'compatibilities',
+                                                 'enqueue_compatibilities', 'work_on_compatibilities',
                                                  'generate_compatibility_store', 'expand_projects',
                                                  'extract_library_jars', 'expand_library_poms', 'clean_projects',
                                                  'generate_test_reports', 'create_project_resources',
@@ -636,6 +676,10 @@ def main():
         collect_dependencies(use_original_pom=original)
     elif collection_step == 'compatibilities':
         collect_compatibilities()
+    elif collection_step == 'enqueue_compatibilities':
+        enqueue_compatibilities()
+    elif collection_step == 'work_on_compatibilities':
+        work_on_compatibilities()
     elif collection_step == 'generate_compatibility_store':
         generate_compatibility_store()
     elif collection_step == 'expand_projects':
@@ -121,7 +121,7 @@ def evaluate_manually_adjusted():
             if to_evaluate:
                 print(f"Getting result of row {index}: {g}:{a}:{v}")
                 try:
-                    compat_result = find_compatibility_results(g, a, v, silent=True, github_link=github_link)
+                    compat_result, _ = find_compatibility_results(g, a, v, silent=True, github_link=github_link)
                     result = [x.v_cand for x in compat_result if x.dynamically_compatible and x.statically_compatible]
                     print(bcolors.OKGREEN + f"Result={result}" + bcolors.ENDC)
                     df.at[index, 'compatible_versions (ours)'] = str(result)
@@ -189,7 +189,7 @@ def evaluate():
             if not evaluated:
                 print(f"Getting result of row {index}: {g}:{a}:{v}")
                 try:
-                    compat_result = find_compatibility_results(g, a, v, silent=True)
+                    compat_result, _ = find_compatibility_results(g, a, v, silent=True)
                     result = [x.v_cand for x in compat_result if x.dynamically_compatible and x.statically_compatible]
                     print(bcolors.OKGREEN + f"Result={result}" + bcolors.ENDC)
                     df.at[index, 'compatible_versions (ours)'] = str(result)
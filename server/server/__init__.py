@@ -1,23 +1,32 @@
 """Given a Maven coordinate, generate its compatible versions and store them in the compatibility store."""
 import argparse
-import json
 from collections import defaultdict
+from concurrent.futures import Future
+from contextlib import closing
 from typing import Optional
 
 from core import get_available_versions, scrape_available_versions, MavenMetadataNotFound
-from server.config import COMPATIBILITY_STORE
 from server.dynamic import dynamically_compatible
 from server.exceptions import (BaseJarNotFoundException, CandidateJarNotFoundException,
                                CandidateMavenCompileTimeout, CandidateMavenTestTimeout, MavenNoPomInDirectoryException,
                                MavenResolutionFailedException, MavenCompileFailedException,
                                MavenSurefireTestFailedException, GithubRepoNotFoundException,
                                GithubTagNotFoundException)
+from server.candidate_policy import apply_candidate_policies
+from server.config import SEARCH_STRATEGY, SEARCH_SAMPLES, BUILD_WORKERS, TEST_WORKERS
+from server.jar_fetcher import prefetch_jars
+from server.maven_version import get_major_version
+from server.pipeline import CandidatePipeline
 from server.static import statically_compatible
+from server.storage import get_storage_manager
+from server.store import get_compatibility_store
 from server.template.base_template import BaseTemplate
+from server.template.candidate_template import CandidateTemplate
 
 
 class CompatibilityResult:
-    def __init__(self, group_id, artifact_id, v_base, v_cand, statically_compatible, dynamically_compatible, err=""):
+    def __init__(self, group_id, artifact_id, v_base, v_cand, statically_compatible, dynamically_compatible, err="",
+                 inferred=False):
         self.group_id = group_id
         self.artifact_id = artifact_id
         self.v_base = v_base
@@ -25,23 +34,27 @@ class CompatibilityResult:
         self.statically_compatible = statically_compatible
         self.dynamically_compatible = dynamically_compatible
         self.err = err
+        self.inferred = inferred  # True if the result was inferred from neighbouring versions instead of checked
 
     def __repr__(self):
         return f"CompatibilityResult({self.group_id}:{self.artifact_id}:{self.v_base} => {self.v_cand}," \
-               f" static={self.statically_compatible}, dynamic={self.dynamically_compatible}, err={self.err}"
+               f" static={self.statically_compatible}, dynamic={self.dynamically_compatible}, err={self.err}" \
+               f"{', inferred' if self.inferred else ''}"
+
+    def is_compatible(self) -> bool:
+        return self.statically_compatible and self.dynamically_compatible
 
 
 def load_compatibility_store() -> defaultdict[str, set]:
-    try:
-        with open(COMPATIBILITY_STORE, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return defaultdict(set)
+    """Returns the full content of the compatibility store, prefer get_compatibility_store().get(gav) for lookups."""
+    compatibility_store = defaultdict(set)
+    compatibility_store.update(get_compatibility_store().items())
+    return compatibility_store
 
 
 def save_compatibility_store(compatibility_store: dict[str, set]):
-    with open(COMPATIBILITY_STORE, 'w') as f:
-        return json.dump(compatibility_store, f, indent=4, default=set_default)
+    """Overwrites the compatibility store with the given compatibility mappings."""
+    get_compatibility_store().replace(compatibility_store)
 
 
 def set_default(obj):
@@ -59,8 +72,10 @@ def get_compatibility_set(g: str, a: str, v: str, cv_versions: list[str]):
     # target/test-classes, target/generates-test-sources and target/surefire-report_BASE
     base_template = BaseTemplate(g, a, v)
 
+    # Fetch the jars of all candidates up front so the static checks do not wait on them one by one
+    prefetch_jars(g, a, cv_versions)
+
     # Run static and dynamic compatibility checks
-    compat_store: defaultdict[str, set] = load_compatibility_store()
     for cv in cv_versions:
         if cv != v:  # Skip self
             try:
@@ -74,76 +89,158 @@ def get_compatibility_set(g: str, a: str, v: str, cv_versions: list[str]):
             except CandidateJarNotFoundException:
                 continue  # Move on to next available candidate version
 
-    # Add compatibility mapping to JSON store
-    stored_set = set(compat_store.get(gav, set()))
-    stored_set.update(compatibility_set)
-    compat_store[gav] = stored_set
-    save_compatibility_store(compat_store)
-    return stored_set
+    # Add compatibility mapping to the store
+    compat_store = get_compatibility_store()
+    compat_store.add(gav, compatibility_set)
+    return set(compat_store.get(gav))
+
+
+def build_candidate(g: str, a: str, v: str, cv: str) -> Optional[CandidateTemplate]:
+    """Runs the static check of candidate version cv and, if passed, builds its template. Returns None otherwise."""
+    if not statically_compatible(g, a, v, cv):
+        return None
+    return CandidateTemplate(g, a, cv)
+
+
+def check_candidate(g: str, a: str, v: str, cv: str, base_template: BaseTemplate,
+                    build: Optional[Future] = None) -> CompatibilityResult:
+    """
+    Runs the static and, if passed, the dynamic compatibility check of candidate version cv against base version v.
+    :param build: future of build_candidate(g, a, v, cv) if the candidate was built ahead, see server.pipeline
+    """
+    try:
+        candidate = build.result() if build is not None else build_candidate(g, a, v, cv)
+        if candidate is None:
+            return CompatibilityResult(g, a, v, cv, False, False)
+        return CompatibilityResult(g, a, v, cv, True, dynamically_compatible(base_template, cv, candidate=candidate))
+    except GithubRepoNotFoundException as e:
+        print(e)
+        return CompatibilityResult(g, a, v, cv, True, False, err="NO_GITHUB")
+    except GithubTagNotFoundException as e:
+        print(e)
+        return CompatibilityResult(g, a, v, cv, True, False, err="NO_TAG")
+    except CandidateMavenCompileTimeout as e:
+        print(e)
+        return CompatibilityResult(g, a, v, cv, True, False, err="CAND_COMPILE_TIMEOUT")
+    except CandidateMavenTestTimeout as e:
+        print(e)
+        return CompatibilityResult(g, a, v, cv, True, False, err="CAND_TEST_TIMEOUT")
+    except MavenNoPomInDirectoryException as e:
+        print(e)
+        return CompatibilityResult(g, a, v, cv, True, False, err="NO_POM")
+    except MavenResolutionFailedException as e:
+        print(e)
+        return CompatibilityResult(g, a, v, cv, True, False, err="NO_RESOLVE")
+    except MavenCompileFailedException as e:
+        print(e)
+        return CompatibilityResult(g, a, v, cv, True, False, err="NO_COMPILE")
+    except MavenSurefireTestFailedException as e:
+        print(e)
+        return CompatibilityResult(g, a, v, cv, True, False, err="NO_TEST")
+    except (BaseJarNotFoundException, CandidateJarNotFoundException):
+        # Quit comparison if the base version cannot be found
+        return CompatibilityResult(g, a, v, cv, False, False, err="NO_JAR")
+
+
+# Errors of candidates whose jar, sources or build could not be obtained, which say nothing about their compatibility
+UNDECIDED_ERRORS = {"NO_JAR", "NO_GITHUB", "NO_TAG", "NO_POM", "NO_RESOLVE", "CAND_COMPILE_TIMEOUT", "CAND_TEST_TIMEOUT"}
 
 
-def get_compatibility_results_helper(g: str, a: str, v: str, cv_versions: list[str],
-                                     base_template: BaseTemplate) -> list[CompatibilityResult]:
+def get_compatibility_results_helper(g: str, a: str, v: str, cv_versions: list[str], base_template: BaseTemplate,
+                                     build_workers: int = BUILD_WORKERS,
+                                     test_workers: int = TEST_WORKERS) -> list[CompatibilityResult]:
+    """
+    Checks the candidates in order until three in a row are incompatible. The templates of the next candidates are
+    built while the current candidate is tested, and the builds that have not started are cancelled once it stops.
+    """
     compatibility_results = []
     max_consecutive_fails = 3   # Give up search after a certain number of incompatible versions in a row
     fails = 0
+    pipeline = CandidatePipeline(lambda cv: build_candidate(g, a, v, cv),
+                                 lambda cv, build: check_candidate(g, a, v, cv, base_template, build=build),
+                                 build_workers=build_workers, test_workers=test_workers)
     # Run static and dynamic compatibility checks
-    for cv in cv_versions:
-        if fails < max_consecutive_fails:
-            try:
-                if statically_compatible(g, a, v, cv):
-                    try:
-                        if dynamically_compatible(base_template, cv):
-                            result = CompatibilityResult(g, a, v, cv, True, True)
-                            fails = 0
-                        else:
-                            result = CompatibilityResult(g, a, v, cv, True, False)
-                            fails += 1
-                    except GithubRepoNotFoundException as e:
-                        print(e)
-                        result = CompatibilityResult(g, a, v, cv, True, False, err="NO_GITHUB")
-                        fails += 1
-                    except GithubTagNotFoundException as e:
-                        print(e)
-                        result = CompatibilityResult(g, a, v, cv, True, False, err="NO_TAG")
-                        fails += 1
-                    except CandidateMavenCompileTimeout as e:
-                        print(e)
-                        result = CompatibilityResult(g, a, v, cv, True, False, err="CAND_COMPILE_TIMEOUT")
-                        fails += 1
-                    except CandidateMavenTestTimeout as e:
-                        print(e)
-                        result = CompatibilityResult(g, a, v, cv, True, False, err="CAND_TEST_TIMEOUT")
-                        fails += 1
-                    except MavenNoPomInDirectoryException as e:
-                        print(e)
-                        result = CompatibilityResult(g, a, v, cv, True, False, err="NO_POM")
-                        fails += 1
-                    except MavenResolutionFailedException as e:
-                        print(e)
-                        result = CompatibilityResult(g, a, v, cv, True, False, err="NO_RESOLVE")
-                        fails += 1
-                    except MavenCompileFailedException as e:
-                        print(e)
-                        result = CompatibilityResult(g, a, v, cv, True, False, err="NO_COMPILE")
-                        fails += 1
-                    except MavenSurefireTestFailedException as e:
-                        print(e)
-                        result = CompatibilityResult(g, a, v, cv, True, False, err="NO_TEST")
-                        fails += 1
-                else:
-                    result = CompatibilityResult(g, a, v, cv, False, False)
-                    fails += 1
-            except (BaseJarNotFoundException, CandidateJarNotFoundException):
-                # Quit comparison if the base version cannot be found
-                result = CompatibilityResult(g, a, v, cv, False, False, err="NO_JAR")
-            if result:
-                compatibility_results.append(result)
+    with closing(pipeline.run(cv_versions)) as results:
+        for cv, result in results:
+            if result.is_compatible():
+                fails = 0
+            elif result.err not in UNDECIDED_ERRORS:
+                fails += 1
+            compatibility_results.append(result)
+            if fails >= max_consecutive_fails:
+                break
     return compatibility_results
 
 
-def get_compatibility_results(g: str, a: str, v: str, cv_versions: list[str], github_link=None) -> list[CompatibilityResult]:
-    """Given a GAV and a set of candidate versions, it returns the list of compatible candidates."""
+def get_sample_indices(indices: list[int], samples: int) -> list[int]:
+    """Returns up to `samples` evenly spaced elements of indices."""
+    if samples <= 0 or not indices:
+        return []
+    step = len(indices) / min(samples, len(indices))
+    return sorted({indices[int(i * step + step / 2)] for i in range(min(samples, len(indices)))})
+
+
+def get_compatibility_results_bisect(g: str, a: str, v: str, cv_versions: list[str], base_template: BaseTemplate,
+                                     samples: int = SEARCH_SAMPLES) -> list[CompatibilityResult]:
+    """
+    Finds the compatibility boundary among cv_versions, ordered going away from v, with O(log n) checks by assuming
+    that compatibility is monotone within the major version of v: if a candidate is compatible, so are all candidates
+    between v and that candidate. The candidates up to the boundary that were not checked are reported as inferred
+    compatible, those beyond it and outside the major version are left out, like after the linear search gave up.
+    :param samples: number of inferred candidates to verify, if one of them turns out incompatible the assumption
+    does not hold and all inferred candidates are checked
+    """
+    major = get_major_version(v)
+    line = []
+    for cv in cv_versions:
+        if get_major_version(cv) != major:
+            break
+        line.append(cv)
+
+    tested: dict[int, CompatibilityResult] = {}
+    lo, hi = -1, len(line)  # The last known compatible index (v itself) and the first known incompatible index
+    candidates = list(range(len(line)))  # Indices of the candidates that may hold the boundary
+    while True:
+        remaining = [i for i in candidates if lo < i < hi]
+        if not remaining:
+            break
+        mid = remaining[len(remaining) // 2]
+        tested[mid] = check_candidate(g, a, v, line[mid], base_template)
+        if tested[mid].err in UNDECIDED_ERRORS:
+            candidates.remove(mid)
+        elif tested[mid].is_compatible():
+            lo = mid
+        else:
+            hi = mid
+    print(f"Compatibility boundary of {g}:{a}:{v} found after {len(tested)} checks: "
+          f"{line[lo] if lo >= 0 else 'none compatible'}")
+
+    inferred = [i for i in range(lo + 1) if i not in tested]
+    for i in get_sample_indices(inferred, samples):
+        tested[i] = check_candidate(g, a, v, line[i], base_template)
+        if not tested[i].is_compatible() and tested[i].err not in UNDECIDED_ERRORS:
+            print(f"{line[i]} is incompatible below the boundary, checking all {len(inferred)} inferred candidates")
+            for j in inferred:
+                if j not in tested:
+                    tested[j] = check_candidate(g, a, v, line[j], base_template)
+            break
+
+    results = []
+    for i in range(len(line)):
+        if i in tested:
+            results.append(tested[i])
+        elif i <= lo:
+            results.append(CompatibilityResult(g, a, v, line[i], True, True, inferred=True))
+    return results
+
+
+def get_compatibility_results(g: str, a: str, v: str, cv_versions: list[str], github_link=None,
+                              strategy: str = SEARCH_STRATEGY) -> list[CompatibilityResult]:
+    """
+    Given a GAV and a set of candidate versions, it returns the list of compatible candidates.
+    :param strategy: "linear" to check candidates going away from v until three in a row are incompatible, "bisect"
+    to search the compatibility boundaries within the major version of v, see get_compatibility_results_bisect
+    """
     idx_split = cv_versions.index(v)
     # Versions list should be ordered by newest first (as it appears on maven repo)
     cv_versions_upper = cv_versions[:idx_split]
@@ -154,15 +251,24 @@ def get_compatibility_results(g: str, a: str, v: str, cv_versions: list[str], gi
     # target/test-classes, target/generates-test-sources and target/surefire-report_BASE
     base_template = BaseTemplate(g, a, v, repo_name=github_link)
 
-    compatible_lower = get_compatibility_results_helper(g, a, v, cv_versions_lower, base_template)
-    compatible_upper = get_compatibility_results_helper(g, a, v, cv_versions_upper, base_template)
+    # Fetch the jars of all candidates up front so the static checks do not wait on them one by one
+    prefetch_jars(g, a, cv_versions)
+
+    helper = get_compatibility_results_bisect if strategy == "bisect" else get_compatibility_results_helper
+    with get_storage_manager().in_use(base_template.path):  # Keep the base from being evicted while it is tested
+        compatible_lower = helper(g, a, v, cv_versions_lower, base_template)
+        compatible_upper = helper(g, a, v, cv_versions_upper, base_template)
     compatibility_results = compatible_lower + compatible_upper
 
     return compatibility_results
 
 
-def find_compatibility_results(g: str, a: str, v: str,
-                               max_num=None, silent=False, github_link=None) -> Optional[list[CompatibilityResult]]:
+def find_compatibility_results(g: str, a: str, v: str, max_num=None, silent=False,
+                               github_link=None) -> tuple[list[CompatibilityResult], dict[str, int]]:
+    """
+    Checks the compatibility of GAV with its available versions, after pruning them with the candidate policies.
+    :return: the compatibility results, and the pruning statistics of the candidate policies
+    """
     try:
         candidate_versions = get_available_versions(g, a, max_num=max_num)
         if v not in candidate_versions:
@@ -177,6 +283,7 @@ def find_compatibility_results(g: str, a: str, v: str,
         if v not in candidate_versions:
             raise MavenMetadataNotFound(f"Could not find the base version for {g}:{a}:{v}")
 
+    candidate_versions, policy_stats = apply_candidate_policies(g, a, v, candidate_versions)
     if not silent:
         print(f"Calculating compatibility set for {g}:{a}:{v} with candidates: {candidate_versions}")
 
@@ -184,16 +291,18 @@ def find_compatibility_results(g: str, a: str, v: str,
 
     if not silent:
         print(f"Result:\n {g}:{a}:{v} has compatibility results {compatibility_results} "
-              f"out of candidate versions {candidate_versions}")
+              f"out of candidate versions {candidate_versions}, pruned by candidate policies: {policy_stats}")
 
-    return compatibility_results
+    return compatibility_results, policy_stats
 
 
 def find_compatible_versions(g: str, a: str, v: str, max_num=None, silent=False):
     candidate_versions = get_available_versions(g, a, max_num=max_num)
+    candidate_versions, policy_stats = apply_candidate_policies(g, a, v, candidate_versions)
 
     if not silent:
         print(f"Calculating compatibility set for {g}:{a}:{v} with candidates: {candidate_versions}")
+        print(f"Pruned by candidate policies: {policy_stats}")
         confirm = input('Confirm (y/n)?: ')
         if confirm != "y":
             print(f"Aborted.")
@@ -208,6 +317,21 @@ def find_compatible_versions(g: str, a: str, v: str, max_num=None, silent=False)
     return compatible_versions
 
 
+def compute_compatible_versions(gav: str) -> list[str]:
+    """Runs the static and dynamic checks for GAV without interaction and adds its compatible versions to the store."""
+    g, a, v = gav.split(":")
+    compatibility_results, policy_stats = find_compatibility_results(g, a, v, silent=True)
+    print(f"Candidate policies of {gav}: {policy_stats}")
+    if compatibility_results and all(result.err == "NO_JAR" for result in compatibility_results):
+        # Likely an outage of the repository rather than missing jars, fail the job so that it is retried later
+        raise CandidateJarNotFoundException(f"Could not fetch the jar of any candidate of {gav}")
+    compatible_versions = {v}  # A GAV is always compatible with itself
+    compatible_versions.update(result.v_cand for result in compatibility_results
+                               if result.statically_compatible and result.dynamically_compatible)
+    get_compatibility_store().add(gav, compatible_versions)
+    return sorted(compatible_versions)
+
+
 def main():
     """
     Example: server-example -g com.fasterxml.jackson.core -a jackson-databind -v 2.16.0 --max_candidates 5
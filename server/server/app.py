@@ -1,19 +1,87 @@
+import contextlib
+import gzip
+import multiprocessing
 import os
 import pathlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
 
-from flask import Flask, jsonify, send_from_directory, render_template, request
+from flask import Flask, Response, jsonify, make_response, send_from_directory, render_template, request
 
-from server import load_compatibility_store, find_compatible_versions
+from server import compute_compatible_versions
+from server.config import (MAVEN_REPOSITORY, MAVEN_UPSTREAM, METADATA_TTL, COMPUTE_ON_MISS, JOB_WORKERS,
+                           JOB_MAX_WAIT, TEMPLATE_REGISTRY_DIR)
+from server.jobs import JobQueue
+from server.maven_repository import DirectoryListingCache, UpstreamProxy, resolve, store_artifact
+from server.ranges import RangeCache
+from server.store import CompatibilityIndex, get_compatibility_store
 
-MAVEN_REPOSITORY = pathlib.Path(__file__).parent.parent.resolve() / "resources" / "maven_repository"
 LISTING_TEMPLATE = pathlib.Path(__file__).parent.resolve() / "templates" / "directory_listing.html"
 
+GZIP_MIN_SIZE = 1024  # Responses smaller than this are not worth compressing
+
 app = Flask(__name__, template_folder='templates')
 
+compatibility_index: Optional[CompatibilityIndex] = None
+range_cache = RangeCache()
+listing_cache = DirectoryListingCache(MAVEN_REPOSITORY)
+upstream_proxy = UpstreamProxy(MAVEN_REPOSITORY, MAVEN_UPSTREAM, METADATA_TTL) if MAVEN_UPSTREAM else None
+job_queue: Optional[JobQueue] = None
+process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_compatibility_index() -> CompatibilityIndex:
+    """Returns the in-memory index of the compatibility store, creating it on first use."""
+    global compatibility_index
+    if compatibility_index is None:
+        compatibility_index = CompatibilityIndex(get_compatibility_store())
+    return compatibility_index
+
+
+def compute_in_process(gav: str) -> list[str]:
+    """Computes the compatible versions of GAV in a worker process, as the templates change the working directory."""
+    global process_pool
+    if process_pool is None:
+        # The pool is created from a job thread, forking a threaded process could copy locks held by other threads
+        process_pool = ProcessPoolExecutor(max_workers=JOB_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return process_pool.submit(compute_compatible_versions, gav).result()
+
+
+def get_job_queue() -> Optional[JobQueue]:
+    """Returns the queue computing the compatible versions of GAVs missing from the store, None if disabled."""
+    global job_queue
+    if job_queue is None and COMPUTE_ON_MISS:
+        job_queue = JobQueue(compute_in_process, workers=JOB_WORKERS)
+    return job_queue
+
 
 def lookup(gav: str):
-    store = load_compatibility_store()
-    return store.get(gav, [])
+    return get_compatibility_index().get(gav)
+
+
+def lookup_range(gav: str) -> Optional[str]:
+    g, a, _ = gav.split(":")
+    return range_cache.get_range(g, a, lookup(gav))
+
+
+def parse_gavs(body) -> Optional[list[str]]:
+    """Returns the GAVs of a JSON list of GAVs (or {"gavs": [...]}), or None if the body is malformed."""
+    gavs = body.get("gavs") if isinstance(body, dict) else body
+    if not isinstance(gavs, list) or not all(isinstance(gav, str) and gav.count(":") == 2 for gav in gavs):
+        return None
+    return gavs
+
+
+def compressible_json_response(payload: dict) -> Response:
+    """Returns the payload as JSON with an ETag, gzip-compressed if the client accepts it and answering conditional
+    requests with 304 Not Modified."""
+    response = jsonify(payload)
+    response.vary.add("Accept-Encoding")
+    if "gzip" in request.accept_encodings and len(response.get_data()) >= GZIP_MIN_SIZE:
+        response.set_data(gzip.compress(response.get_data(), mtime=0))  # Fixed mtime keeps the ETag stable
+        response.headers["Content-Encoding"] = "gzip"
+    response.add_etag()
+    return response.make_conditional(request)
 
 
 @app.route("/")
@@ -24,35 +92,90 @@ def hello_world():
 @app.route('/compatibilities/<gav>', methods=['GET'])
 def compatibilities(gav: str):
     compatible_versions = lookup(gav)
-    # if not compatible_versions:
-    #     g, a, v = gav.split(":")
-    #     find_compatible_versions(g, a, v, max_num=5, silent=True)
-    #     compatible_versions = lookup(gav)
     if compatible_versions:
-        return jsonify({'compatible_versions': compatible_versions})
-    else:
-        return jsonify({'compatible_versions': None})
+        return compressible_json_response({'compatible_versions': compatible_versions})
+
+    queue = get_job_queue()
+    if queue is None or gav.count(":") != 2:
+        return compressible_json_response({'compatible_versions': None})
+
+    # Compute the compatible versions in the background instead of blocking the request
+    job = queue.submit(gav)
+    response = jsonify({'compatible_versions': None, 'job': job.to_dict()})
+    response.status_code = 202
+    response.headers["Location"] = f"/jobs/{job.id}"
+    return response
+
+
+@app.route('/compatibilities', methods=['POST'])
+def compatibilities_batch():
+    """Takes a JSON list of GAVs (or {"gavs": [...]}) and returns the compatible versions of each of them."""
+    gavs = parse_gavs(request.get_json(silent=True))
+    if gavs is None:
+        return jsonify({'error': "Expected a JSON list of GAVs"}), 400
+
+    compatible_versions = get_compatibility_index().get_many(gavs)
+    payload = {'compatible_versions': {gav: versions if versions else None
+                                       for gav, versions in compatible_versions.items()}}
+
+    queue = get_job_queue()
+    missing = [gav for gav, versions in compatible_versions.items() if not versions]
+    if queue is not None and missing:
+        payload['jobs'] = {gav: queue.submit(gav).id for gav in missing}
+    return compressible_json_response(payload)
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id: str):
+    """Returns the status of a job, waiting up to ?wait=<seconds> for it to finish."""
+    queue = get_job_queue()
+    if queue is None:
+        return "Not Found", 404
+    wait = min(request.args.get("wait", default=0, type=float), JOB_MAX_WAIT)
+    job = queue.wait(job_id, wait) if wait > 0 else queue.get(job_id)
+    if job is None:
+        return "Not Found", 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/ranges/<gav>', methods=['GET'])
+def ranges(gav: str):
+    """Returns the Maven range spec of the compatible versions of GAV."""
+    if gav.count(":") != 2:
+        return jsonify({'error': "Expected a GAV of the form groupId:artifactId:version"}), 400
+    return compressible_json_response({'range': lookup_range(gav)})
+
+
+@app.route('/ranges', methods=['POST'])
+def ranges_batch():
+    """Takes a JSON list of GAVs (or {"gavs": [...]}) and returns the Maven range spec of each of them."""
+    gavs = parse_gavs(request.get_json(silent=True))
+    if gavs is None:
+        return jsonify({'error': "Expected a JSON list of GAVs"}), 400
+    return compressible_json_response({'ranges': {gav: lookup_range(gav) for gav in gavs}})
 
 
 @app.route('/maven/', defaults={'filename': ""}, methods=['GET'])
 @app.route('/maven/<path:filename>', methods=['GET'])
 def maven_repository(filename):
-    path = pathlib.Path.joinpath(MAVEN_REPOSITORY, filename)
+    path = resolve(MAVEN_REPOSITORY, filename)
 
-    if pathlib.Path.is_file(path):
-        # If the requested path is a file, serve it
-        return send_from_directory(MAVEN_REPOSITORY, filename)
+    if upstream_proxy is not None and upstream_proxy.needs_fetch(filename):
+        # On a miss, fetch the file from the upstream (stale metadata is still served if the upstream is unavailable)
+        if upstream_proxy.fetch(filename):
+            listing_cache.invalidate(filename)
 
-    elif pathlib.Path.is_dir(path):
+    if path is not None and pathlib.Path.is_file(path):
+        # If the requested path is a file, serve it, answering conditional (ETag/Last-Modified) and Range requests
+        return send_from_directory(MAVEN_REPOSITORY, filename, conditional=True, etag=True)
+
+    elif path is not None and pathlib.Path.is_dir(path):
         # If the requested path is a directory, list its content
-        directory_content = []
-        for item in os.listdir(path):
-            if item.startswith("."):
-                continue
-            item_path = os.path.join(filename, item)
-            item_url = f'/maven/{item_path}'
-            directory_content.append({'name': item, 'url': item_url})
-        return render_template("directory_listing.html", directory_content=directory_content)
+        etag, listing = listing_cache.get(filename, lambda directory_content: render_template(
+            "directory_listing.html", directory_content=directory_content))
+        response = make_response(listing)
+        response.set_etag(etag)
+        return response.make_conditional(request)
 
     else:
         # Return a 404 response for non-existent paths
@@ -61,15 +184,38 @@ def maven_repository(filename):
 
 @app.route('/maven/<path:filename>', methods=['PUT'])
 def populate_repository(filename):
-    path = pathlib.Path.joinpath(MAVEN_REPOSITORY, filename)
-    os.makedirs(os.path.dirname(path), exist_ok=True)
+    path = resolve(MAVEN_REPOSITORY, filename)
+    if path is None or pathlib.Path.is_dir(path):
+        return "Bad Request", 400
 
-    # Save the incoming content to the specified file
-    with open(path, 'wb') as file:
-        file.write(request.data)
+    # Stream the incoming content into the specified file
+    store_artifact(request.stream, path)
+    listing_cache.invalidate(filename)
+    # Deployed files are no longer upstream copies, which the proxy would refetch over them once their TTL expires
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(UpstreamProxy.marker_path(path))
 
     return 'Artifact uploaded successfully', 201
 
 
+@app.route('/templates/<path:filename>', methods=['GET'])
+def template_registry(filename):
+    # Template bundles shared between nodes, see server.template_registry
+    path = resolve(TEMPLATE_REGISTRY_DIR, filename)
+    if path is None or not pathlib.Path.is_file(path):
+        return "Not Found", 404
+    return send_from_directory(TEMPLATE_REGISTRY_DIR, filename, conditional=True, etag=True)
+
+
+@app.route('/templates/<path:filename>', methods=['PUT'])
+def populate_template_registry(filename):
+    path = resolve(TEMPLATE_REGISTRY_DIR, filename)
+    if path is None or not filename.endswith(".tar.gz") or pathlib.Path.is_dir(path):
+        return "Bad Request", 400
+
+    store_artifact(request.stream, path, write_checksums=False)
+    return 'Template bundle uploaded successfully', 201
+
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,171 @@
+"""
+Module containing the content-addressed blob store, which stores every distinct file of the template directories once.
+A deduplicated directory has its files replaced by hard links to blobs named after their sha1, and a manifest next to
+it (e.g. target/classes.manifest.json) mapping its files to their sha1, so their hashes are known without reading them.
+Blobs no longer linked from any template are deleted by gc_blobs.
+"""
+import errno
+import hashlib
+import json
+import os
+import shutil
+import stat
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from server.persistence import atomic_write
+
+LINK_UNSUPPORTED = (errno.EXDEV, errno.EPERM)  # Errors of linking across file systems or on ones without hard links
+
+
+def get_blob_path(store_dir: Path, sha1: str) -> Path:
+    return Path(store_dir) / sha1[:2] / sha1[2:]
+
+
+def get_manifest_path(directory: Path) -> Path:
+    directory = Path(directory)
+    return directory.parent / f"{directory.name}.manifest.json"
+
+
+def hash_file(path: Path) -> str:
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def read_manifest(directory: Path) -> Optional[dict[str, str]]:
+    """Returns the sha1 of every file in the deduplicated directory, or None if it has no manifest."""
+    path = get_manifest_path(directory)
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_manifest(directory: Path, hashes: dict[str, str]):
+    with atomic_write(get_manifest_path(directory)) as f:
+        json.dump(hashes, f, indent=1, sort_keys=True)
+
+
+def replace_with_link(blob: Path, path: Path) -> bool:
+    """Atomically replaces path with a hard link to the blob. Returns False if the blob does not exist (anymore)."""
+    temp_path = path.with_name(f".{path.name}.link")
+    try:
+        os.link(blob, temp_path)
+    except FileNotFoundError:
+        return False
+    os.replace(temp_path, path)
+    return True
+
+
+def store_file(path: Path, store_dir: Path) -> str:
+    """
+    Replaces the file with a hard link to the blob of its content, adding the blob if the store does not have it.
+    Files that cannot be linked, e.g. because the store is on another file system, are left as they are.
+    :return: sha1 of the file
+    """
+    sha1 = hash_file(path)
+    blob = get_blob_path(store_dir, sha1)
+    try:
+        if os.path.samefile(blob, path):
+            return sha1
+    except FileNotFoundError:
+        pass
+    try:
+        while not replace_with_link(blob, path):
+            os.makedirs(blob.parent, exist_ok=True)
+            try:
+                # Blobs are shared by all templates containing the file, so they must never be written to
+                os.chmod(path, stat.S_IMODE(os.stat(path).st_mode) & ~0o222)
+                os.link(path, blob)
+                break
+            except FileExistsError:
+                continue  # Stored concurrently by another template, link to that blob instead
+    except OSError as e:
+        print(f"Could not store {path} in the blob store {store_dir}: {e}")
+    return sha1
+
+
+def deduplicate_directory(directory: Path, store_dir: Path) -> dict[str, str]:
+    """
+    Stores every file of the directory in the blob store and writes the directory's manifest.
+    :return: sha1 of every file, keyed by its path relative to the directory
+    """
+    hashes = {}
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = Path(dirpath) / filename
+            hashes[path.relative_to(directory).as_posix()] = store_file(path, store_dir)
+    write_manifest(directory, hashes)
+    return hashes
+
+
+def link_or_copy(src: str, dst: str, link: bool = True):
+    """
+    Copy function for shutil.copytree that hard links files instead, copying only if the file system does not support
+    linking them. An existing dst is replaced rather than written to, as it may itself be a link to a blob.
+    :param link: False to always copy
+    """
+    if link:
+        try:
+            os.link(src, dst)
+            return
+        except FileExistsError:
+            pass
+        except OSError as e:
+            if e.errno not in LINK_UNSUPPORTED:
+                raise
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(dst), prefix=".", suffix=".part")
+    os.close(fd)
+    try:
+        if link:
+            os.remove(temp_path)
+            try:
+                os.link(src, temp_path)
+            except OSError as e:
+                if e.errno not in LINK_UNSUPPORTED:
+                    raise
+                link = False
+        if not link:
+            shutil.copy2(src, temp_path)
+        os.replace(temp_path, dst)
+    finally:
+        if os.path.lexists(temp_path):  # Left behind if dst already was a link to src
+            os.remove(temp_path)
+
+
+def is_blob(path: str) -> bool:
+    """Checks whether the file is a link to a blob, which store_file made read-only."""
+    st = os.stat(path)
+    return st.st_nlink > 1 and not st.st_mode & 0o222
+
+
+def link_tree(src: Path, dst: Path):
+    """
+    Recreates the directory src at dst, merging it with dst if it exists. The files of deduplicated directories are
+    hard linked to their read-only blobs, all other files are copied so that writing to them leaves src unchanged.
+    Root ignores the read-only bit, so as root every file is copied to keep the blobs from being written through.
+    """
+    blobs = set()
+    if os.geteuid() != 0:
+        for dirpath, dirnames, _ in os.walk(src):
+            for dirname in dirnames:
+                for filename in read_manifest(Path(dirpath) / dirname) or {}:
+                    blobs.add(os.path.normpath(Path(dirpath) / dirname / filename))
+
+    def stage_file(file_src: str, file_dst: str):
+        link_or_copy(file_src, file_dst, link=os.path.normpath(file_src) in blobs and is_blob(file_src))
+    shutil.copytree(src, dst, copy_function=stage_file, dirs_exist_ok=True)
+
+
+def gc_blobs(store_dir: Path) -> int:
+    """Deletes the blobs that are no longer linked from any template. Returns the number of deleted blobs."""
+    deleted = 0
+    for blob in Path(store_dir).glob("*/*"):
+        if os.lstat(blob).st_nlink == 1:
+            os.remove(blob)
+            deleted += 1
+    return deleted
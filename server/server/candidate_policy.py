@@ -0,0 +1,122 @@
+"""
+Module containing the candidate policies, which prune candidate versions that are almost never compatible with the
+base version before any jar is fetched or template is built. A policy is a function taking the GA, the base version and
+the remaining candidates (newest first, including the base) and returning the candidates it keeps. Policies are
+registered by name in POLICIES and applied in the order given by CANDIDATE_POLICIES.
+"""
+import fnmatch
+import os
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+import requests
+
+from core import HTTP_headers
+from server.config import (CANDIDATE_POLICIES, MAX_CANDIDATE_DISTANCE, CANDIDATE_DATE_WINDOW,
+                           KNOWN_BROKEN_CANDIDATES, REMOTE_REPOSITORY)
+from server.jar_fetcher import get_artifact_path
+from server.maven_version import is_prerelease, get_major_version
+
+Policy = Callable[[str, str, str, list[str]], list[str]]
+release_dates: dict[str, Optional[datetime]] = {}
+
+
+def skip_prereleases(g: str, a: str, v: str, cv_versions: list[str]) -> list[str]:
+    """Prunes snapshots, milestones, release candidates and other pre-releases."""
+    return [cv for cv in cv_versions if cv == v or not is_prerelease(cv)]
+
+
+def major_version_fence(g: str, a: str, v: str, cv_versions: list[str]) -> list[str]:
+    """Prunes candidates with another major version than the base."""
+    major = get_major_version(v)
+    return [cv for cv in cv_versions if get_major_version(cv) == major]
+
+
+def max_distance(g: str, a: str, v: str, cv_versions: list[str], distance: int = MAX_CANDIDATE_DISTANCE) \
+        -> list[str]:
+    """Prunes candidates more than `distance` releases away from the base among the remaining candidates."""
+    if v not in cv_versions:
+        return cv_versions
+    idx = cv_versions.index(v)
+    return cv_versions[max(0, idx - distance):idx + distance + 1]
+
+
+def get_release_date(g: str, a: str, v: str) -> Optional[datetime]:
+    """Returns the date the pom of GAV was published to the remote repository, or None if it is unknown."""
+    gav = f"{g}:{a}:{v}"
+    if gav not in release_dates:
+        try:
+            response = requests.head(f"{REMOTE_REPOSITORY}/{get_artifact_path(g, a, v, f'{a}-{v}.pom')}",
+                                     headers=HTTP_headers, timeout=10)
+            last_modified = response.headers.get("Last-Modified") if response.status_code == 200 else None
+            release_dates[gav] = parsedate_to_datetime(last_modified) if last_modified else None
+        except (requests.RequestException, TypeError, ValueError) as e:
+            print(f"Could not get the release date of {gav}: {e}")
+            return None
+    return release_dates[gav]
+
+
+def date_window(g: str, a: str, v: str, cv_versions: list[str], days: int = CANDIDATE_DATE_WINDOW) -> list[str]:
+    """Prunes candidates released more than `days` days before or after the base. Unknown dates are kept."""
+    base_date = get_release_date(g, a, v)
+    if base_date is None:
+        return cv_versions
+    kept = []
+    for cv in cv_versions:
+        date = get_release_date(g, a, cv) if cv != v else base_date
+        if date is None or abs((date - base_date).days) <= days:
+            kept.append(cv)
+    return kept
+
+
+def read_known_broken(path: Path = KNOWN_BROKEN_CANDIDATES) -> list[str]:
+    """Reads the known-broken file, containing one G:A:V pattern per line, e.g. org.example:lib:2.3.* # no tag"""
+    if not os.path.isfile(path):
+        return []
+    with open(path, 'r') as f:
+        return [line.split("#")[0].strip() for line in f if line.split("#")[0].strip()]
+
+
+def skip_known_broken(g: str, a: str, v: str, cv_versions: list[str],
+                      patterns: Optional[Iterable[str]] = None) -> list[str]:
+    """Prunes candidates listed as known broken, e.g. because their tag is missing or their build never works."""
+    patterns = read_known_broken() if patterns is None else list(patterns)
+    return [cv for cv in cv_versions
+            if cv == v or not any(fnmatch.fnmatchcase(f"{g}:{a}:{cv}", pattern) for pattern in patterns)]
+
+
+POLICIES: dict[str, Policy] = {
+    "prerelease": skip_prereleases,
+    "major": major_version_fence,
+    "distance": max_distance,
+    "date": date_window,
+    "known_broken": skip_known_broken,
+}
+
+
+def register_policy(name: str, policy: Policy):
+    POLICIES[name] = policy
+
+
+def apply_candidate_policies(g: str, a: str, v: str, cv_versions: list[str],
+                             policies: Iterable[str] = CANDIDATE_POLICIES) -> tuple[list[str], dict[str, int]]:
+    """
+    Applies the named policies in order, the base version is always kept.
+    :return: the kept candidates in their original order, and the pruning statistics: the number of candidates
+    pruned by each policy, and the total number of candidates before and after pruning
+    """
+    kept = list(cv_versions)
+    stats = {'total': len(kept)}
+    for name in policies:
+        remaining = POLICIES[name](g, a, v, kept)
+        if v in kept and v not in remaining:
+            remaining = [cv for cv in kept if cv in remaining or cv == v]
+        stats[name] = len(kept) - len(remaining)
+        kept = remaining
+    stats['kept'] = len(kept)
+    if stats['kept'] < stats['total']:
+        print(f"Candidate policies pruned {stats['total'] - stats['kept']}/{stats['total']} candidates of {g}:{a}:{v}: "
+              + ", ".join(f"{name}={stats[name]}" for name in policies))
+    return kept, stats
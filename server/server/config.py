@@ -1,13 +1,17 @@
 """Collection of shared variables and methods."""
 import os
 import pathlib
+import threading
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Optional
 
 from git import Repo
 from github import Repository, Commit
 
 from core import get_github_session
 from server.exceptions import GithubRepoDownloadFailedException, GithubRepoNotFoundException
+from server.object_store import borrow_object_store, get_network_name
 
 path_to_repos = pathlib.Path(__file__).parent.parent.resolve() / "resources" / "repos"
 path_to_test_repos = pathlib.Path(__file__).parent.parent.resolve() / "test_resources" / "repos"
@@ -17,11 +21,128 @@ PATH_TO_JAPICMP = (pathlib.Path(__file__).parent.parent.resolve() / "libs" / "ja
 
 SERVER_RESOURCES = pathlib.Path(__file__).parent.parent.resolve() / "resources"
 COMPATIBILITY_STORE = SERVER_RESOURCES / "compatibilities.json"
+COMPATIBILITY_STORE_DB = SERVER_RESOURCES / "compatibilities.db"
+COMPATIBILITY_STORE_BACKEND = "sqlite"  # "sqlite" or "json"
+
+# Compatible versions of GAVs missing from the store are computed in the background by a pool of worker processes
+COMPUTE_ON_MISS = True
+JOB_WORKERS = 2
+JOB_HISTORY = 10000  # Number of jobs kept for status polling
+JOB_RETRY_AFTER = 3600  # Seconds before a failed job is retried on a new request
+JOB_MAX_WAIT = 60  # Maximum seconds a status request long-polls for completion
+
+# Durable work queue shared by the workers of a sweep, possibly on several machines sharing the resources directory
+WORK_QUEUE_DB = SERVER_RESOURCES / "work_queue.db"
+WORK_LEASE = 900  # Seconds a claimed task stays leased to a worker without a heartbeat
+WORK_HEARTBEAT = 60  # Seconds between heartbeats of a worker renewing its lease
+WORK_MAX_ATTEMPTS = 3  # Number of expired leases after which a task is given up on
+
+# Surefire report directories with at least REPORT_PARSE_PARALLEL_THRESHOLD unparsed reports are parsed in parallel
+REPORT_PARSE_WORKERS = 4
+REPORT_PARSE_PARALLEL_THRESHOLD = 256
+REPORT_CACHE_SIZE = 100000  # Number of parsed report files kept in memory
+
+AVAILABLE_VERSIONS_TTL = 3600  # Seconds before the available versions of a GA are fetched again
+RANGE_CACHE_SIZE = 10000
 BASE_TEMPLATES_DIR = SERVER_RESOURCES / "base_templates"
 CAND_TEMPLATES_DIR = SERVER_RESOURCES / "cand_templates"
+WORKTREES_DIR = SERVER_RESOURCES / "worktrees"  # Temporary checkouts of the commits templates are built from
+MAVEN_REPOSITORY = SERVER_RESOURCES / "maven_repository"
+
+# Repositories searched for jars, in order: the local ~/.m2, the server's own /maven repository, and the remote
+LOCAL_M2_REPOSITORY = pathlib.Path.home() / ".m2" / "repository"
+REMOTE_REPOSITORY = "https://repo1.maven.org/maven2"
+JAR_FETCH_WORKERS = 8
+
+# When set, the /maven repository acts as a pull-through cache of this upstream repository
+MAVEN_UPSTREAM = None
+METADATA_TTL = 300  # Seconds before maven-metadata files fetched from the upstream are refetched
 
 COMPILE_TIMEOUT = 60
 TEST_TIMEOUT = 300
+# Run only the base test classes that reach classes changed by the candidate, unless they are over the given fraction
+TEST_SELECTION = True
+TEST_SELECTION_MAX_FRACTION = 0.5
+# Skip the tests that failed in the baseline when running the candidate, as they cannot change the verdict
+EXCLUDE_BASELINE_FAILURES = True
+# New failures of the candidate are rerun to rule out flakiness: a failure is a regression if, counting the run it
+# first failed in, it failed in the majority of its runs. Tests found flaky often enough are quarantined
+FLAKY_RERUNS = 2
+FLAKINESS_DB = SERVER_RESOURCES / "flakiness.db"
+FLAKY_QUARANTINE_SCORE = 0.5  # Fraction of the evaluations of a test it must have been flaky in to be quarantined
+FLAKY_QUARANTINE_MIN_EVALUATIONS = 3
+FLAKY_QUARANTINE_TTL = 30 * 24 * 3600  # Seconds after its last evaluation that a quarantine expires and it runs again
+# Abort the candidate's test run as soon as a test fails that did not fail in the baseline
+FAIL_FAST = True
+FAIL_FAST_POLL_INTERVAL = 1  # Seconds between scans of the surefire-reports directory
+# Engine running the base tests on candidates: "maven" (surefire) or "junit" (JUnit console launcher, which skips
+# Maven's startup on every run and falls back to Maven for projects it cannot run)
+TEST_RUNNER = "maven"
+JUNIT_CONSOLE_VERSION = "1.10.2"
+# Split the test classes run against a candidate into up to TEST_SHARDS shards running in parallel, balanced by the
+# durations of the base's test run. 1 runs all tests in a single surefire run
+TEST_SHARDS = 1
+# Search strategy for compatible candidates: "linear" checks candidates going away from the base until three in a row
+# are incompatible, "bisect" binary-searches the compatibility boundaries within the base's major version and then
+# verifies SEARCH_SAMPLES of the candidates inferred to be compatible
+SEARCH_STRATEGY = "linear"
+SEARCH_SAMPLES = 2
+# The linear search builds the templates of up to BUILD_WORKERS upcoming candidates in the background while the
+# tests of up to TEST_WORKERS candidates run, see server.pipeline. 0 builds every candidate right before its tests
+BUILD_WORKERS = 2
+TEST_WORKERS = 1
+# Candidate versions are pruned by these policies of server.candidate_policy before any jar is fetched, in order:
+# "prerelease", "major", "distance", "date" and "known_broken"
+CANDIDATE_POLICIES = []
+MAX_CANDIDATE_DISTANCE = 20  # Maximum number of releases between the base and a candidate
+CANDIDATE_DATE_WINDOW = 5 * 365  # Maximum number of days between the releases of the base and a candidate
+KNOWN_BROKEN_CANDIDATES = SERVER_RESOURCES / "known_broken.txt"  # One G:A:V pattern per line, e.g. g:a:2.3.*
+# How repositories are cloned: "full" fetches all history and blobs, "partial" all history but blobs only when a
+# commit is checked out, "shallow" only the latest commit of the default branch. The commits of the tags templates
+# are built from are fetched on demand, deepening the history only if fetching them directly fails
+CLONE_STRATEGY = "partial"
+# Full and partial clones borrow their objects from a bare repository per fork network, see server.object_store
+OBJECT_STORE = True
+OBJECT_STORE_DIR = SERVER_RESOURCES / "object_store"
+# Templates, jars and clones are evicted once their total size exceeds STORAGE_BUDGET bytes, see server.storage.
+# STORAGE_EVICTION is "lru", or "value" to also weigh how often an entry was used against its size. None disables it
+STORAGE_DB = SERVER_RESOURCES / "storage.db"
+STORAGE_BUDGET = None
+STORAGE_EVICTION = "lru"
+STORAGE_MIN_IDLE = 3600  # Seconds since its last use before an entry may be evicted
+STORAGE_LEASE = 6 * 3600  # Seconds an entry stays protected if the process using it does not release it
+STORAGE_SCAN_INTERVAL = 3600  # Seconds before the sizes on disk are rescanned when enforcing the budget
+# The classes and test-classes of templates are hard links into a content-addressed store of their files, so files
+# shared by several versions are stored once, see server.blob_store. Candidates are staged with hard links to these
+# read-only blobs as well, unless running as root, so tests that write into target/classes or target/test-classes fail
+BLOB_STORE = False
+BLOB_STORE_DIR = SERVER_RESOURCES / "blobs"
+STAGING_DIR = SERVER_RESOURCES / "staging"  # Must be on the file system of the templates for hard links to work
+# Templates are pulled from this registry before building them, and pushed to it once built, see
+# server.template_registry. A shared directory or the URL of a server's /templates endpoint, None disables sharing
+TEMPLATE_REGISTRY = None
+TEMPLATE_REGISTRY_DIR = SERVER_RESOURCES / "template_registry"  # Bundles served by the /templates endpoint
+
+
+# Locks per path, each entry is a lock and the number of threads holding or waiting for it
+download_locks: dict[Path, list] = {}
+path_locks_guard = threading.Lock()
+
+
+@contextmanager
+def path_lock(locks: dict[Path, list], path: Path):
+    """Holds the lock of path in locks, created on first use and dropped once no thread holds or waits for it."""
+    with path_locks_guard:
+        entry = locks.setdefault(path, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with path_locks_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del locks[path]
 
 
 def get_repo(repo_name: str):
@@ -36,13 +157,44 @@ def download_repo_by_name(repo_name, storage_path=path_to_repos):
     return download_repo(get_repo(repo_name), storage_path=storage_path)
 
 
+def get_remote_url(repo: Repository) -> str:
+    return f"https://github.com/{repo.full_name}.git"
+
+
+def clone_repo(url: str, download_path: Path, strategy: str = CLONE_STRATEGY,
+               reference: Optional[Path] = None) -> Repo:
+    """
+    Clones the repository at url into download_path using the given clone strategy, see CLONE_STRATEGY.
+    :param reference: object store to borrow objects from instead of fetching them, ignored by shallow clones
+    """
+    options = {'reference': str(reference)} if reference is not None else {}
+    if strategy == "full":
+        return Repo.clone_from(url, to_path=download_path, **options)
+    if strategy == "partial":
+        return Repo.clone_from(url, to_path=download_path, filter="blob:none", **options)
+    if strategy == "shallow":
+        return Repo.clone_from(url, to_path=download_path, depth=1, filter="blob:none", no_tags=True)
+    raise ValueError(f"Unknown clone strategy {strategy}")
+
+
+def clone_github_repo(repo: Repository, download_path: Path) -> Repo:
+    url = get_remote_url(repo)
+    reference = None
+    if OBJECT_STORE and CLONE_STRATEGY != "shallow":
+        # The store of a partial clone only fetches what the clone would, blobs are fetched by the clone on demand
+        object_filter = "blob:none" if CLONE_STRATEGY == "partial" else None
+        reference = borrow_object_store(OBJECT_STORE_DIR, get_network_name(repo), repo.full_name, url, download_path,
+                                        object_filter=object_filter)
+    return clone_repo(url, download_path, reference=reference)
+
+
 def download_repo_and_return_commit(repo: Repository, storage_path=path_to_repos) -> Commit:
     print(f"Cloning {repo.full_name} into {storage_path}/{repo.full_name}")
     download_path = Path.joinpath(storage_path, repo.full_name)
     if os.path.isdir(download_path):
         return download_path
     try:
-        r = Repo.clone_from(f"https://github.com/{repo.full_name}.git", to_path=download_path)
+        r = clone_github_repo(repo, download_path)
         assert os.path.isdir(download_path)
         print("Success.")
         return r.head.commit
@@ -53,12 +205,14 @@ def download_repo_and_return_commit(repo: Repository, storage_path=path_to_repos
 def download_repo(repo: Repository, storage_path=path_to_repos) -> Path:
     print(f"Cloning {repo.full_name} into {storage_path}/{repo.full_name}")
     download_path = Path.joinpath(storage_path, repo.full_name)
-    if os.path.isdir(download_path):
-        return download_path
-    try:
-        Repo.clone_from(f"https://github.com/{repo.full_name}.git", to_path=download_path)
-        print("Success.")
-        assert os.path.isdir(download_path)
-        return download_path
-    except Exception:
-        raise GithubRepoDownloadFailedException(f"Could not clone repo {repo.full_name}.")
+    # Templates of several versions may be built concurrently, only the first one clones
+    with path_lock(download_locks, download_path):
+        if os.path.isdir(download_path):
+            return download_path
+        try:
+            clone_github_repo(repo, download_path)
+            print("Success.")
+            assert os.path.isdir(download_path)
+            return download_path
+        except Exception:
+            raise GithubRepoDownloadFailedException(f"Could not clone repo {repo.full_name}.")
@@ -2,17 +2,31 @@
 the base's tests on the source code of the candidate."""
 import os
 import pathlib
+import signal
 import subprocess
 import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional
 
 from lxml import etree as ET
 
 from core import namespace, dependencies_are_equal, get_text_of_child
-from server.exceptions import MavenSurefireTestFailedException, CandidateMavenTestTimeout
+from server.exceptions import (MavenSurefireTestFailedException, CandidateMavenTestTimeout,
+                               DirectTestRunUnsupportedException)
+from server.blob_store import link_tree
+from server.flakiness import FlakinessTable, get_flakiness_table, is_reproduced
 from server.template.base_template import BaseTemplate
 from server.template.candidate_template import CandidateTemplate
-from server.test_failure import get_test_failures_from_dir, TestFailure
-from server.config import TEST_TIMEOUT
+from server.junit_runner import run_tests_directly
+from server.test_failure import get_test_failures_from_dir, get_test_report_from_file, TestFailure
+from server.test_selection import select_tests
+from server.test_sharding import get_shards
+from server.config import TEST_TIMEOUT, FAIL_FAST, FAIL_FAST_POLL_INTERVAL, EXCLUDE_BASELINE_FAILURES, FLAKY_RERUNS, \
+    TEST_RUNNER, TEST_SHARDS, BLOB_STORE, STAGING_DIR
+from server.persistence import atomic_write
 
 
 def dynamic_check(base: set[TestFailure], candidate: set[TestFailure]) -> bool:
@@ -25,7 +39,8 @@ def dynamic_check(base: set[TestFailure], candidate: set[TestFailure]) -> bool:
     return (candidate - base) == set()
 
 
-def dynamically_compatible(base: BaseTemplate, cv: str, repo_name=None):
+def dynamically_compatible(base: BaseTemplate, cv: str, repo_name=None,
+                           candidate: Optional[CandidateTemplate] = None):
     """
     Given a base template, runs the base tests in the same "cleaned" environment as the candidates would.
     This is to prevent environment-related factors only affecting the candidate results to gain a more realistic
@@ -33,15 +48,92 @@ def dynamically_compatible(base: BaseTemplate, cv: str, repo_name=None):
     removed.
     :param base: BaseTemplate made from the base version of the GA
     :param cv: candidate version of the GA
+    :param candidate: template of cv if it was already built
     :return: True if candidate version is dynamically compatible with base version, False otherwise
     """
     # TODO: store baseline failures in metadata to avoid recomputation
     baseline = CandidateTemplate(base.group_id, base.artifact_id, base.version, repo_name=repo_name)
-    candidate = CandidateTemplate(base.group_id, base.artifact_id, cv, repo_name=repo_name)
-    base_failures = run_tests(base, baseline)  # Get baseline failures by running the base with itself
+    if candidate is None:
+        candidate = CandidateTemplate(base.group_id, base.artifact_id, cv, repo_name=repo_name)
+    # Candidates compiling to the same classes as the base or as an already compatible candidate need no tests
+    fingerprint = candidate.get_classes_fingerprint()
+    if fingerprint == baseline.get_classes_fingerprint() or fingerprint in base.get_compatible_fingerprints():
+        print(f"Classes of {cv} are identical to a compatible build, skipping tests")
+        return True
+
+    tests = select_tests(base, baseline, candidate)
+    if tests is not None and not tests:
+        print(f"No base tests reach the classes changed in {cv}")
+        return True
+    base_failures = run_tests(base, baseline, tests)  # Get baseline failures by running the base with itself
     # base_failures = get_test_failures_from_dir(base.target_path / "surefire-reports_BASE")  # TODO this would be more efficient, but needs testing => yep it broke everything please test before doing anything
-    candidate_failures = run_tests(base, candidate)
-    return dynamic_check(base_failures, candidate_failures)
+    ga = f"{base.group_id}:{base.artifact_id}"
+    quarantined = get_flakiness_table().get_quarantined(ga)
+    # The excludes depend on this evaluation's baseline, so each evaluation writes its own file, as the candidates of a
+    # base may be tested concurrently
+    with tempfile.TemporaryDirectory(prefix="excludes-") as run_dir:
+        excludes_file = write_excludes_file(base_failures, pathlib.Path(run_dir) / "surefire-excludes.txt",
+                                            quarantined) if EXCLUDE_BASELINE_FAILURES else None
+
+        known_failures = set(base_failures)
+        while True:
+            candidate_failures = run_tests(base, candidate, tests,
+                                           baseline_failures=known_failures if FAIL_FAST else None,
+                                           excludes_file=excludes_file)
+            new_failures = candidate_failures - known_failures
+            if not new_failures:
+                compatible = True
+                break
+            to_rerun = {failure for failure in new_failures if get_test_id(failure) not in quarantined}
+            if rerun_failures(base, candidate, to_rerun):
+                compatible = False
+                break
+            if not FAIL_FAST:
+                compatible = True
+                break
+            # All new failures were flaky, but the aborted run may have hidden real regressions in the remaining tests
+            known_failures |= new_failures
+
+    if compatible:
+        base.add_compatible_fingerprint(fingerprint)
+    return compatible
+
+
+def get_test_id(failure: TestFailure) -> str:
+    return f"{failure.testcase_classname}#{failure.testcase_name}"
+
+
+def get_method_pattern(test_id: str) -> Optional[str]:
+    """
+    Returns the surefire method filter (Class#method) selecting the given test, or None for parameterized tests whose
+    pattern would also select the other invocations.
+    """
+    classname, _, name = test_id.partition("#")
+    method = name.removesuffix("()")
+    return f"{classname}#{method}" if classname and method.isidentifier() else None
+
+
+def rerun_failures(base: BaseTemplate, candidate: CandidateTemplate, failures: set[TestFailure],
+                   reruns: int = FLAKY_RERUNS, flakiness: Optional[FlakinessTable] = None) -> set[TestFailure]:
+    """
+    Reruns only the given failed tests on the candidate `reruns` times and records the outcomes in the flakiness
+    table. Parameterized tests are rerun through their whole test class.
+    :return: the failures that reproduced in the majority of their runs, see is_reproduced
+    """
+    if reruns <= 0 or not failures:
+        return set(failures)
+    flakiness = flakiness or get_flakiness_table()
+    patterns = sorted({get_method_pattern(get_test_id(failure)) or failure.testcase_classname for failure in failures})
+    failed_reruns = Counter()
+    for i in range(reruns):
+        print(f"Rerunning {len(patterns)} failed tests ({i + 1}/{reruns})")
+        rerun = run_tests(base, candidate, patterns)
+        failed_reruns.update(failure for failure in failures if failure in rerun)
+
+    ga = f"{base.group_id}:{base.artifact_id}"
+    for failure in failures:
+        flakiness.record(ga, get_test_id(failure), runs=reruns, failures=failed_reruns[failure])
+    return {failure for failure in failures if is_reproduced(reruns, failed_reruns[failure])}
 
 
 def get_test_deps(pom: pathlib.Path, tag_name: str) -> list[ET.Element]:
@@ -110,40 +202,191 @@ def merge_poms(pom_base: pathlib.Path, pom_cand: pathlib.Path, save_to_path: pat
     tree.write(save_to_path, doctype='<?xml version="1.0" encoding="UTF-8"?>', encoding='UTF-8')
 
 
-def run_tests(base: BaseTemplate, candidate: CandidateTemplate) -> set[TestFailure]:
-    """Runs the base tests on the candidate code and returns the set of test failures."""
-    old_dir = os.getcwd()
+def get_exclude_patterns(failures: set[TestFailure], test_ids: Iterable[str] = ()) -> list[str]:
+    """
+    Returns surefire patterns (Class#method) excluding the given failed tests and test ids. Parameterized tests are
+    not excluded, as their pattern would also exclude the invocations that passed.
+    """
+    test_ids = [get_test_id(failure) for failure in failures] + list(test_ids)
+    return sorted({pattern for pattern in map(get_method_pattern, test_ids) if pattern})
+
+
+def write_excludes_file(failures: set[TestFailure], path: pathlib.Path, quarantined: Iterable[str] = ()) \
+        -> pathlib.Path:
+    """Replaces the surefire excludes file at path with patterns excluding the given failed and quarantined tests."""
+    with atomic_write(path) as f:
+        f.write("# Tests failing in the baseline or quarantined as flaky, rewritten on every baseline run\n")
+        for pattern in get_exclude_patterns(failures, quarantined):
+            f.write(f"{pattern}\n")
+    return path
+
+
+def read_excludes_file(path: pathlib.Path) -> list[str]:
+    with open(path, 'r') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def get_surefire_command(tests: Optional[list[str]] = None, excludes_file: Optional[pathlib.Path] = None) -> list[str]:
+    """
+    Returns the command running the given test classes, or the full test suite if tests is None.
+    :param excludes_file: surefire excludes file listing tests to skip
+    """
+    command = ["mvn", "surefire:test"]
+    if tests is not None:
+        # -Dtest overrides the excludes file, so the exclusions are added to it instead
+        excludes = [f"!{pattern}" for pattern in read_excludes_file(excludes_file)] if excludes_file else []
+        command += [f"-Dtest={','.join(tests + excludes)}", "-Dsurefire.failIfNoSpecifiedTests=false",
+                    "-DfailIfNoTests=false"]
+    elif excludes_file is not None:
+        command.append(f"-Dsurefire.excludesFile={excludes_file}")
+    return command
+
 
+def kill_process_group(process: subprocess.Popen, grace_period: float = 5):
+    """Terminates Maven together with the forked surefire JVMs, which share its process group."""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=grace_period)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    except ProcessLookupError:
+        pass
+
+
+def run_surefire_fail_fast(command: list[str], cwd: pathlib.Path, reports_dir: pathlib.Path,
+                           baseline_failures: set[TestFailure], timeout: float = TEST_TIMEOUT,
+                           poll_interval: float = FAIL_FAST_POLL_INTERVAL,
+                           stop: Optional[threading.Event] = None) -> set[TestFailure]:
+    """
+    Runs the surefire command while watching the reports it writes, and kills it as soon as a test fails that did
+    not fail in the baseline.
+    :param stop: event that kills the run when set
+    :return: the new failures that caused the run to be aborted, or an empty set if the run completed or was stopped
+    """
+    process = subprocess.Popen(command, cwd=cwd, start_new_session=True)
+    deadline = time.monotonic() + timeout
+    seen: dict[str, tuple[int, int]] = {}
+    while True:
+        finished = process.poll() is not None
+        if os.path.isdir(reports_dir):
+            for filename in os.listdir(reports_dir):
+                if not (filename.startswith("TEST-") and filename.endswith(".xml")):
+                    continue
+                path = reports_dir / filename
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if seen.get(filename) == (stat.st_size, stat.st_mtime_ns):
+                    continue
+                seen[filename] = (stat.st_size, stat.st_mtime_ns)
+                report = get_test_report_from_file(path)  # None while surefire is still writing the report
+                new_failures = report.failures - baseline_failures if report is not None else set()
+                if new_failures:
+                    print(f"Aborting tests, found new failures: {new_failures}")
+                    kill_process_group(process)
+                    return new_failures
+        if finished:
+            return set()
+        if stop is not None and stop.is_set():
+            kill_process_group(process)
+            return set()
+        if time.monotonic() > deadline:
+            kill_process_group(process)
+            raise CandidateMavenTestTimeout(f"mvn surefire:test lasted more than {timeout}s")
+        time.sleep(poll_interval)
+
+
+def run_tests(base: BaseTemplate, candidate: CandidateTemplate, tests: Optional[list[str]] = None,
+              baseline_failures: Optional[set[TestFailure]] = None,
+              excludes_file: Optional[pathlib.Path] = None, shards: int = TEST_SHARDS) -> set[TestFailure]:
+    """
+    Runs the base tests on the candidate code and returns the set of test failures.
+    :param tests: fully qualified names of the test classes to run, None to run the full test suite
+    :param baseline_failures: if given, the run is aborted on the first failure not in baseline_failures, in which
+    case only the failures found up to that point are returned
+    :param excludes_file: surefire excludes file listing tests to skip
+    :param shards: maximum number of staging directories the tests are split over to run in parallel
+    """
+    test_shards = get_shards(base, tests, shards)
+    if test_shards is None:
+        return run_tests_in_staging_dir(base, candidate, tests, baseline_failures, excludes_file)
+
+    print(f"Running {sum(map(len, test_shards))} test classes in {len(test_shards)} shards")
+    stop = threading.Event()  # Set by the first shard finding a new failure, to abort the other shards
+    with ThreadPoolExecutor(len(test_shards)) as executor:
+        futures = [executor.submit(run_tests_in_staging_dir, base, candidate, shard, baseline_failures, excludes_file,
+                                   stop) for shard in test_shards]
+        try:
+            return set().union(*(future.result() for future in futures))
+        except BaseException:
+            stop.set()
+            raise
+
+
+def stage_candidate(base: BaseTemplate, candidate: CandidateTemplate, staging_dir: pathlib.Path):
+    """
+    Copies the base's target, including its test-classes, and the candidate's classes into staging_dir. With the blob
+    store the deduplicated classes are hard linked to their read-only blobs instead, see link_tree, so tests writing
+    to a class file or resource fail rather than change the templates. Everything else is copied.
+    """
+    print(f"Copying {base.target_path} into {staging_dir}")
+    if BLOB_STORE:
+        link_tree(base.target_path, staging_dir / "target")
+    else:
+        subprocess.run(["cp", "-r", base.target_path, staging_dir])
+    assert os.path.isdir(pathlib.Path.joinpath(staging_dir, "target"))
+
+    assert os.path.isfile(candidate.pom_path)
+    merge_poms(base.pom_path, candidate.pom_path, save_to_path=staging_dir / "pom.xml")
+    if BLOB_STORE:
+        link_tree(candidate.target_path, staging_dir / "target")
+    else:
+        subprocess.run(["cp", "-r", candidate.target_path, staging_dir])
+
+
+def run_tests_in_staging_dir(base: BaseTemplate, candidate: CandidateTemplate, tests: Optional[list[str]] = None,
+                             baseline_failures: Optional[set[TestFailure]] = None,
+                             excludes_file: Optional[pathlib.Path] = None,
+                             stop: Optional[threading.Event] = None) -> set[TestFailure]:
+    """
+    Runs the given base tests on the candidate code in a fresh temporary directory, see run_tests.
+    :param stop: event aborting a fail-fast run when set, e.g. because another shard already found a new failure
+    """
     # Store info in temporary directory
-    with tempfile.TemporaryDirectory() as temp_dir:
+    if BLOB_STORE:
+        os.makedirs(STAGING_DIR, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=STAGING_DIR if BLOB_STORE else None) as temp_dir:
         print(f"Made temp dir: {temp_dir}")
         temp_dir = pathlib.Path(temp_dir)
         assert os.path.isdir(temp_dir)
-
-        # Copy base template target as target in temporary directory
-        print(f"Copying {base.target_path} into {temp_dir}")
-        subprocess.run(["cp", "-r", base.target_path, temp_dir])
-        temp_target = pathlib.Path.joinpath(temp_dir, "target")
-        assert os.path.isdir(temp_target)
-
-        # Copy candidate template into temporary directory
-        assert os.path.isfile(candidate.pom_path)
-        merge_poms(base.pom_path, candidate.pom_path, save_to_path=temp_dir / "pom.xml")
-        subprocess.run(["cp", "-r", candidate.target_path, temp_dir])
+        stage_candidate(base, candidate, temp_dir)
 
         # Run base tests on candidate and collect the results
-        os.chdir(temp_dir)
-        try:
-            subprocess.run(["mvn", "surefire:test"], timeout=TEST_TIMEOUT)
-        except subprocess.TimeoutExpired:
-            os.chdir(old_dir)
-            raise CandidateMavenTestTimeout(f"mvn surefire:test lasted more than {TEST_TIMEOUT}s")
-        cand_test_reports_dir = pathlib.Path.joinpath(temp_target, "surefire-reports")
+        cand_test_reports_dir = pathlib.Path.joinpath(temp_dir, "target", "surefire-reports")
+        if TEST_RUNNER == "junit":
+            # The launcher only writes its reports at the end of the run, so there is no fail-fast
+            try:
+                excludes = read_excludes_file(excludes_file) if excludes_file else None
+                return get_test_failures_from_dir(run_tests_directly(base, temp_dir, tests, excludes))
+            except DirectTestRunUnsupportedException as e:
+                print(f"Falling back to Maven: {e}")
+        if baseline_failures is not None:
+            new_failures = run_surefire_fail_fast(get_surefire_command(tests, excludes_file), temp_dir,
+                                                  cand_test_reports_dir, baseline_failures, stop=stop)
+            if new_failures:
+                if stop is not None:
+                    stop.set()
+                return new_failures
+        else:
+            try:
+                subprocess.run(get_surefire_command(tests, excludes_file), cwd=temp_dir, timeout=TEST_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                raise CandidateMavenTestTimeout(f"mvn surefire:test lasted more than {TEST_TIMEOUT}s")
+        if stop is not None and stop.is_set():
+            return set()  # Aborted, possibly before surefire wrote any report
         if not os.path.isdir(cand_test_reports_dir):
-            os.chdir(old_dir)
             raise MavenSurefireTestFailedException(f"Ran {base.tag_name} tests on {candidate.tag_name} source, "
                                                    f"but found no surefire-reports")
-        test_failures = get_test_failures_from_dir(cand_test_reports_dir)
-        os.chdir(old_dir)
-
-        return test_failures
+        return get_test_failures_from_dir(cand_test_reports_dir)
@@ -1,3 +1,6 @@
+from core import MavenMetadataNotFound
+
+
 class BaseJarNotFoundException(Exception):
     """Raised when the base jar used to find compatible candidates is not found."""
 
@@ -52,3 +55,37 @@ class BaseMavenTestTimeout(Exception):
 
 class CandidateMavenTestTimeout(Exception):
     """Running the tests for the candidate template exceeded timeout threshold."""
+
+
+class DirectTestRunUnsupportedException(Exception):
+    """The tests cannot be run without Maven, e.g. because java is missing or the project uses TestNG."""
+
+
+class ChecksumMismatchException(Exception):
+    """Raised when a downloaded artifact does not match its checksum."""
+
+
+# Error codes recorded for failed evaluations, most specific exception first
+ERROR_CODES = [
+    (BaseJarNotFoundException, "NO_JAR"),
+    (CandidateJarNotFoundException, "NO_JAR"),
+    (GithubRepoNotFoundException, "NO_GITHUB"),
+    (GithubTagNotFoundException, "NO_TAG"),
+    (BaseMavenCompileTimeout, "COMPILE_TIMEOUT"),
+    (BaseMavenTestTimeout, "TEST_TIMEOUT"),
+    (CandidateMavenCompileTimeout, "CAND_COMPILE_TIMEOUT"),
+    (CandidateMavenTestTimeout, "CAND_TEST_TIMEOUT"),
+    (MavenNoPomInDirectoryException, "NO_POM"),
+    (MavenResolutionFailedException, "NO_RESOLVE"),
+    (MavenCompileFailedException, "NO_COMPILE"),
+    (MavenSurefireTestFailedException, "NO_TEST"),
+    (MavenMetadataNotFound, "NO_VER"),
+]
+
+
+def get_error_code(e: Exception) -> str:
+    """Returns the error code of the given exception, or ERROR if it is not part of the error taxonomy."""
+    for exception_type, code in ERROR_CODES:
+        if isinstance(e, exception_type):
+            return code
+    return "ERROR"
@@ -0,0 +1,86 @@
+"""Module containing the persistent table of test flakiness, used to quarantine tests that fail intermittently."""
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Optional
+
+from server.config import (FLAKINESS_DB, FLAKY_QUARANTINE_SCORE, FLAKY_QUARANTINE_MIN_EVALUATIONS,
+                           FLAKY_QUARANTINE_TTL)
+from server.persistence import ThreadLocalConnection
+
+
+def is_reproduced(runs: int, failures: int) -> bool:
+    """Returns True if the test, counting the run it first failed in, failed in the majority of its runs."""
+    return (failures + 1) * 2 > runs + 1
+
+
+class FlakinessTable:
+    """
+    Per-test counts of reruns, kept per GA as tests belong to the test suite of a GA. A test is flaky in an
+    evaluation if it failed on the candidate but its failure did not reproduce, see is_reproduced.
+    """
+
+    def __init__(self, path: Path = FLAKINESS_DB, min_score: float = FLAKY_QUARANTINE_SCORE,
+                 min_evaluations: int = FLAKY_QUARANTINE_MIN_EVALUATIONS, ttl: float = FLAKY_QUARANTINE_TTL):
+        self.path = Path(path)
+        self.min_score = min_score
+        self.min_evaluations = min_evaluations
+        self.ttl = ttl
+        self.connections = ThreadLocalConnection(self.path)
+        os.makedirs(self.path.parent, exist_ok=True)
+        with self.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS flakiness ("
+                         "ga TEXT NOT NULL, test TEXT NOT NULL, evaluations INTEGER NOT NULL, runs INTEGER NOT NULL, "
+                         "failures INTEGER NOT NULL, flaky INTEGER NOT NULL, updated REAL, "
+                         "PRIMARY KEY (ga, test)) WITHOUT ROWID")
+
+    def connection(self) -> sqlite3.Connection:
+        return self.connections.get()
+
+    def record(self, ga: str, test: str, runs: int, failures: int):
+        """Records the outcome of rerunning a test that failed on the candidate `runs` times."""
+        flaky = 0 if is_reproduced(runs, failures) else 1
+        with self.connection() as conn:
+            conn.execute("INSERT INTO flakiness (ga, test, evaluations, runs, failures, flaky, updated) "
+                         "VALUES (?, ?, 1, ?, ?, ?, ?) ON CONFLICT (ga, test) DO UPDATE SET "
+                         "evaluations = evaluations + 1, runs = runs + excluded.runs, "
+                         "failures = failures + excluded.failures, flaky = flaky + excluded.flaky, "
+                         "updated = excluded.updated",
+                         (ga, test, runs, failures, flaky, time.time()))
+
+    def get(self, ga: str, test: str) -> Optional[dict]:
+        row = self.connection().execute("SELECT evaluations, runs, failures, flaky FROM flakiness "
+                                        "WHERE ga = ? AND test = ?", (ga, test)).fetchone()
+        if row is None:
+            return None
+        evaluations, runs, failures, flaky = row
+        return {'evaluations': evaluations, 'runs': runs, 'failures': failures, 'flaky': flaky}
+
+    def score(self, ga: str, test: str) -> float:
+        """Returns the fraction of evaluations in which the test turned out to be flaky."""
+        entry = self.get(ga, test)
+        return entry['flaky'] / entry['evaluations'] if entry else 0.0
+
+    def get_quarantined(self, ga: str) -> set[str]:
+        """
+        Returns the tests of the GA evaluated at least min_evaluations times with a score of at least min_score.
+        Quarantines expire ttl seconds after the last evaluation, as quarantined tests are not evaluated anymore.
+        """
+        rows = self.connection().execute("SELECT test FROM flakiness WHERE ga = ? AND evaluations >= ? "
+                                         "AND flaky >= ? * evaluations AND updated >= ?",
+                                         (ga, self.min_evaluations, self.min_score, time.time() - self.ttl))
+        return {row[0] for row in rows}
+
+    def close(self):
+        self.connections.close()
+
+
+flakiness_table: Optional[FlakinessTable] = None
+
+
+def get_flakiness_table() -> FlakinessTable:
+    global flakiness_table
+    if flakiness_table is None:
+        flakiness_table = FlakinessTable()
+    return flakiness_table
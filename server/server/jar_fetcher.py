@@ -0,0 +1,107 @@
+"""Module containing logic related to fetching jars from local and remote Maven repositories without starting Maven."""
+import hashlib
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import requests
+
+from core import HTTP_headers
+from server.config import (PATH_TO_JARS, LOCAL_M2_REPOSITORY, MAVEN_REPOSITORY, REMOTE_REPOSITORY,
+                           JAR_FETCH_WORKERS)
+from server.exceptions import ChecksumMismatchException
+from server.persistence import atomic_write
+from server.storage import get_storage_manager, get_size, get_entry_kind
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def get_jar_name(a: str, v: str) -> str:
+    return f"{a}-{v}.jar"
+
+
+def get_artifact_path(g: str, a: str, v: str, filename: str) -> str:
+    """Returns the path of the given file relative to the root of a Maven repository."""
+    return f"{g.replace('.', '/')}/{a}/{v}/{filename}"
+
+
+def sha1_of_file(path: Path) -> str:
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def parse_checksum(content: str) -> str:
+    """Checksum files contain either only the hash, or the hash followed by the filename."""
+    return content.strip().split()[0].lower() if content.strip() else ""
+
+
+def copy_from_local_repository(g: str, a: str, v: str, repository: Path, dest: Path) -> bool:
+    """Copies the jar of GAV from the given repository directory into dest, verifying its .sha1 if present."""
+    src = repository / get_artifact_path(g, a, v, get_jar_name(a, v))
+    if not os.path.isfile(src):
+        return False
+
+    checksum_path = Path(f"{src}.sha1")
+    if os.path.isfile(checksum_path):
+        with open(checksum_path, 'r') as f:
+            expected = parse_checksum(f.read())
+        if expected and expected != sha1_of_file(src):
+            print(f"Checksum mismatch for {src}, skipping")
+            return False
+
+    with open(src, 'rb') as f_src, atomic_write(dest, 'wb') as f_dest:
+        shutil.copyfileobj(f_src, f_dest)
+    return True
+
+
+def download_from_remote(g: str, a: str, v: str, remote_url: str, dest: Path) -> bool:
+    """Downloads the jar of GAV from the remote repository into dest, verifying it against the remote .sha1."""
+    url = f"{remote_url.rstrip('/')}/{get_artifact_path(g, a, v, get_jar_name(a, v))}"
+    try:
+        with requests.get(url, headers=HTTP_headers, stream=True, timeout=60) as response:
+            if response.status_code != 200:
+                return False
+            checksum_response = requests.get(f"{url}.sha1", headers=HTTP_headers, timeout=60)
+            expected = parse_checksum(checksum_response.text) if checksum_response.status_code == 200 else None
+            sha1 = hashlib.sha1()
+            with atomic_write(dest, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    sha1.update(chunk)
+                    f.write(chunk)
+                if expected and expected != sha1.hexdigest():
+                    raise ChecksumMismatchException(f"Checksum mismatch for {url}, discarding download")
+        return True
+    except (requests.RequestException, ChecksumMismatchException) as e:
+        print(e)
+        return False
+
+
+def fetch_jar(g: str, a: str, v: str, jar_dir: Path = PATH_TO_JARS) -> Optional[Path]:
+    """
+    Makes sure the jar of GAV is present in jar_dir, looking in ~/.m2, the server's /maven repository and the
+    remote repository, in that order.
+    :return: path to the jar, or None if it could not be found in any of the repositories
+    """
+    dest = jar_dir / get_jar_name(a, v)
+    if os.path.isfile(dest) \
+            or any(copy_from_local_repository(g, a, v, repository, dest)
+                   for repository in [LOCAL_M2_REPOSITORY, MAVEN_REPOSITORY]) \
+            or (REMOTE_REPOSITORY and download_from_remote(g, a, v, REMOTE_REPOSITORY, dest)):
+        if get_entry_kind(dest) is not None:  # Jars fetched elsewhere, e.g. into a temporary directory, are not managed
+            get_storage_manager().touch(dest, get_size(dest))
+        return dest
+
+    return None
+
+
+def prefetch_jars(g: str, a: str, versions: list[str], jar_dir: Path = PATH_TO_JARS,
+                  max_workers: int = JAR_FETCH_WORKERS) -> dict[str, Optional[Path]]:
+    """Concurrently fetches the jars of all the given versions of GA, returns a mapping of version to jar path."""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        jars = executor.map(lambda v: fetch_jar(g, a, v, jar_dir=jar_dir), versions)
+        return dict(zip(versions, jars))
@@ -0,0 +1,137 @@
+"""Module containing the background job queue that computes the compatible versions of GAVs missing from the store."""
+import heapq
+import itertools
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from server.config import JOB_HISTORY, JOB_RETRY_AFTER
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class Job:
+    """Computation of the compatible versions of a single GAV, shared by all clients that requested it."""
+
+    def __init__(self, gav: str):
+        self.id = uuid.uuid4().hex
+        self.gav = gav
+        self.status = QUEUED
+        self.requests = 1  # Number of times the GAV was requested while the job was pending, used as priority
+        self.result: Optional[list[str]] = None
+        self.err = ""
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.done = threading.Event()
+
+    def to_dict(self) -> dict:
+        return {'id': self.id, 'gav': self.gav, 'status': self.status, 'requests': self.requests,
+                'compatible_versions': self.result, 'err': self.err}
+
+    def __repr__(self):
+        return f"Job({self.id}, {self.gav}, status={self.status}, requests={self.requests})"
+
+
+class JobQueue:
+    """
+    Priority queue of deduplicated jobs processed by a pool of worker threads. Requesting a GAV that already has a
+    pending job returns that job and raises its priority, so GAVs requested by many clients are computed first.
+    """
+
+    def __init__(self, compute: Callable[[str], list[str]], workers: int = 1, history: int = JOB_HISTORY,
+                 retry_after: int = JOB_RETRY_AFTER):
+        self.compute = compute
+        self.history = history
+        self.retry_after = retry_after
+        self.jobs: OrderedDict[str, Job] = OrderedDict()  # job id => job, oldest first
+        self.jobs_by_gav: dict[str, Job] = {}
+        self.heap: list[tuple[int, int, str]] = []  # (-requests, insertion order, job id)
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.available = threading.Condition(self.lock)
+        self.workers = [threading.Thread(target=self.work, daemon=True) for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, gav: str) -> Job:
+        """Returns the job computing GAV, enqueueing a new one unless a pending or recent job exists."""
+        with self.lock:
+            job = self.jobs_by_gav.get(gav)
+            if job is not None and job.status == QUEUED:
+                job.requests += 1
+                heapq.heappush(self.heap, (-job.requests, next(self.counter), job.id))
+                return job
+            if job is not None and (job.status == RUNNING or job.status == DONE or
+                                    time.time() - job.finished < self.retry_after):
+                job.requests += 1
+                return job
+
+            job = Job(gav)
+            self.jobs[job.id] = job
+            self.jobs_by_gav[gav] = job
+            heapq.heappush(self.heap, (-job.requests, next(self.counter), job.id))
+            self.forget_old_jobs()
+            self.available.notify()
+            return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def wait(self, job_id: str, timeout: float) -> Optional[Job]:
+        """Returns the job once it finished or the timeout expired, whichever comes first."""
+        job = self.get(job_id)
+        if job is not None:
+            job.done.wait(timeout)
+        return job
+
+    def pending(self) -> int:
+        with self.lock:
+            return sum(1 for job in self.jobs.values() if job.status == QUEUED)
+
+    def next_job(self) -> Job:
+        """Blocks until a job is queued and returns the one with the highest priority."""
+        with self.lock:
+            while True:
+                while self.heap:
+                    priority, _, job_id = heapq.heappop(self.heap)
+                    job = self.jobs.get(job_id)
+                    # Skip entries superseded by a priority bump
+                    if job is not None and job.status == QUEUED and -priority == job.requests:
+                        job.status = RUNNING
+                        return job
+                self.available.wait()
+
+    def work(self):
+        while True:
+            job = self.next_job()
+            print(f"Computing compatible versions of {job.gav} ({job.requests} requests)")
+            try:
+                result = self.compute(job.gav)
+                with self.lock:
+                    job.result = result
+                    job.status = DONE
+                    job.finished = time.time()
+            except Exception as e:
+                print(e)
+                with self.lock:
+                    job.err = f"{type(e).__name__}: {e}"
+                    job.status = FAILED
+                    job.finished = time.time()
+            job.done.set()
+
+    def forget_old_jobs(self):
+        """Drops the oldest finished jobs once more than `history` jobs are kept."""
+        for job_id in list(self.jobs):
+            if len(self.jobs) <= self.history:
+                break
+            job = self.jobs[job_id]
+            if job.status in (DONE, FAILED):
+                del self.jobs[job_id]
+                if self.jobs_by_gav.get(job.gav) is job:
+                    del self.jobs_by_gav[job.gav]
@@ -0,0 +1,158 @@
+"""
+Module containing the engine that runs base tests on a candidate with the JUnit Platform console launcher instead of
+Maven. The test classpath is resolved with Maven once per set of dependencies and cached in the base template's
+metadata, after which every run is a plain java invocation with the candidate's classes swapped into the classpath.
+Surefire configuration (argLine, system properties, forking) is not applied, which affects the baseline and the
+candidates alike.
+"""
+import hashlib
+import os
+import pathlib
+import re
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Optional
+from xml.etree import ElementTree
+
+from lxml import etree as ET
+
+from core import namespace
+from server.config import COMPILE_TIMEOUT, TEST_TIMEOUT, JUNIT_CONSOLE_VERSION
+from server.exceptions import DirectTestRunUnsupportedException, CandidateMavenTestTimeout
+from server.jar_fetcher import fetch_jar
+from server.template import read_template_metadata, update_template_metadata
+
+# Sections of the pom that determine the resolved test classpath
+CLASSPATH_SECTIONS = ["parent", "properties", "dependencies", "dependencyManagement", "repositories"]
+# Class names run by surefire by default: Test*, *Test, *Tests and *TestCase
+DEFAULT_INCLUDE_CLASSNAME = r"^(.*[.$])?(Test[^.$]*|[^.$]*Tests?|[^.$]*TestCase)$"
+
+
+def get_classpath_key(pom_path: Path) -> str:
+    """Returns a hash of the pom sections that determine the test classpath, ignoring e.g. the project's version."""
+    root = ET.parse(pom_path).getroot()
+    key = hashlib.sha1()
+    for section in CLASSPATH_SECTIONS:
+        element = root.find(f"maven:{section}", namespace)
+        if element is not None:
+            key.update(ET.tostring(element, method="c14n"))
+    return key.hexdigest()
+
+
+def resolve_test_classpath(work_dir: Path) -> list[str]:
+    """Resolves the test-scoped dependency classpath of the project in work_dir using Maven."""
+    output_file = work_dir / "classpath.txt"
+    try:
+        out = subprocess.run(["mvn", "dependency:build-classpath", "-Dmdep.includeScope=test",
+                              f"-Dmdep.outputFile={output_file}"], cwd=work_dir, stdout=subprocess.PIPE,
+                             universal_newlines=True, timeout=COMPILE_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        raise DirectTestRunUnsupportedException(f"Resolving the test classpath lasted more than {COMPILE_TIMEOUT}s")
+    if out.returncode != 0 or not os.path.isfile(output_file):
+        raise DirectTestRunUnsupportedException(f"Failed to resolve the test classpath in {work_dir}")
+    with open(output_file, 'r') as f:
+        return [entry for entry in f.read().strip().split(os.pathsep) if entry]
+
+
+def get_test_classpath(base, work_dir: Path) -> list[str]:
+    """
+    Returns the dependency classpath of the merged pom in work_dir, resolving it only if no pom with the same
+    dependencies was resolved for the base template before.
+    """
+    key = get_classpath_key(work_dir / "pom.xml")
+    metadata = read_template_metadata(base.path) if os.path.isfile(base.path / "_metadata.json") else {}
+    classpaths = metadata.get('test_classpaths', {})
+    classpath = classpaths.get(key)
+    if classpath is None or not all(os.path.exists(entry) for entry in classpath):
+        classpath = resolve_test_classpath(work_dir)
+        classpaths[key] = classpath
+        update_template_metadata(base.path, test_classpaths=classpaths)
+    if any("testng" in Path(entry).name for entry in classpath):
+        raise DirectTestRunUnsupportedException("TestNG suites are not supported by the JUnit console launcher")
+    return classpath
+
+
+def get_launcher_jar() -> Path:
+    jar = fetch_jar("org.junit.platform", "junit-platform-console-standalone", JUNIT_CONSOLE_VERSION)
+    if jar is None or shutil.which("java") is None:
+        raise DirectTestRunUnsupportedException("java or the JUnit console launcher is not available")
+    return jar
+
+
+def get_launcher_command(launcher: Path, classpath: list[str], target: Path, reports_dir: Path,
+                         tests: Optional[list[str]] = None, excludes: Optional[list[str]] = None) -> list[str]:
+    """
+    Returns the console launcher command running the given tests, in the format of surefire's -Dtest (Class or
+    Class#method), or all tests surefire would run by default if tests is None.
+    :param excludes: tests to skip in the Class#method format
+    """
+    test_classes = target / "test-classes"
+    command = ["java", "-jar", str(launcher), "execute", "--disable-banner", "--details=none",
+               "--class-path", os.pathsep.join([str(test_classes), str(target / "classes"), *classpath]),
+               "--reports-dir", str(reports_dir)]
+    if tests is None:
+        command += ["--scan-class-path", str(test_classes), "--include-classname", DEFAULT_INCLUDE_CLASSNAME]
+    else:
+        for test in tests:
+            command += ["--select-method", test] if "#" in test else ["--select-class", test]
+    if excludes:
+        pattern = "|".join(re.escape(exclude) + r"\(.*\)" for exclude in excludes)
+        command += ["--exclude-methodname", f"^({pattern})$"]
+    return command
+
+
+def write_surefire_reports(launcher_reports_dir: Path, reports_dir: Path):
+    """
+    Splits the launcher's reports, which contain one test suite per test engine, into one TEST-<class>.xml report per
+    test class as written by surefire, so that server.test_failure parses them the same way.
+    """
+    suites: dict[str, list[ElementTree.Element]] = {}
+    for filename in sorted(os.listdir(launcher_reports_dir)):
+        if not filename.endswith(".xml"):
+            continue
+        root = ElementTree.parse(launcher_reports_dir / filename).getroot()
+        for testcase in root.iter("testcase"):
+            classname = testcase.get("classname", "")
+            # Surefire reports the plain method name, the launcher its display name with parentheses
+            testcase.set("name", testcase.get("name", "").removesuffix("()"))
+            for child in list(testcase):
+                if child.tag in ("system-out", "system-err"):
+                    testcase.remove(child)
+            suites.setdefault(classname, []).append(testcase)
+
+    os.makedirs(reports_dir, exist_ok=True)
+    for classname, testcases in suites.items():
+        suite = ElementTree.Element("testsuite", {
+            'name': classname,
+            'tests': str(len(testcases)),
+            'failures': str(sum(1 for testcase in testcases if testcase.find("failure") is not None)),
+            'errors': str(sum(1 for testcase in testcases if testcase.find("error") is not None)),
+            'skipped': str(sum(1 for testcase in testcases if testcase.find("skipped") is not None)),
+        })
+        suite.extend(testcases)
+        ElementTree.ElementTree(suite).write(reports_dir / f"TEST-{classname}.xml", encoding="UTF-8",
+                                             xml_declaration=True)
+
+
+def run_tests_directly(base, work_dir: Path, tests: Optional[list[str]] = None,
+                       excludes: Optional[list[str]] = None, timeout: float = TEST_TIMEOUT) -> Path:
+    """
+    Runs the tests in work_dir, containing the merged pom and a target with the base's test-classes and the
+    candidate's classes, writing surefire-compatible reports to target/surefire-reports.
+    :return: path to the surefire-reports directory
+    """
+    launcher = get_launcher_jar()
+    classpath = get_test_classpath(base, work_dir)
+    target = pathlib.Path.joinpath(work_dir, "target")
+    launcher_reports_dir = work_dir / "junit-reports"
+    command = get_launcher_command(launcher, classpath, target, launcher_reports_dir, tests, excludes)
+    try:
+        subprocess.run(command, cwd=work_dir, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise CandidateMavenTestTimeout(f"JUnit console launcher lasted more than {timeout}s")
+    if not os.path.isdir(launcher_reports_dir):
+        raise DirectTestRunUnsupportedException(f"JUnit console launcher wrote no reports in {work_dir}")
+    reports_dir = target / "surefire-reports"
+    write_surefire_reports(launcher_reports_dir, reports_dir)
+    return reports_dir
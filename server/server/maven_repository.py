@@ -0,0 +1,164 @@
+"""Module containing logic related to storing artifacts in, and listing the content of, the local Maven repository."""
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import BinaryIO, Callable, Optional
+
+import requests
+
+from core import HTTP_headers
+from server.persistence import atomic_write, write_atomically
+
+CHUNK_SIZE = 1024 * 1024
+CHECKSUM_EXTENSIONS = (".sha1", ".md5", ".sha256", ".sha512", ".asc")
+
+
+class DirectoryListingCache:
+    """
+    Caches rendered directory listings of the repository until an upload changes the directory. The modification time
+    of the directory is also checked, so that artifacts copied into the repository by other means show up as well.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.listings: dict[str, tuple[int, str, str]] = {}  # relative dir => (mtime, etag, rendered listing)
+        self.lock = threading.Lock()
+
+    def get(self, directory: str, render: Callable[[list[dict]], str]) -> tuple[str, str]:
+        """Returns the (etag, listing) of the directory, rendering and caching it on a miss."""
+        directory = directory.strip("/")
+        mtime = os.stat(self.root / directory).st_mtime_ns
+        with self.lock:
+            cached = self.listings.get(directory)
+        if cached and cached[0] == mtime:
+            return cached[1], cached[2]
+
+        listing = render(list_directory(self.root, directory))
+        etag = hashlib.sha1(listing.encode()).hexdigest()
+        with self.lock:
+            self.listings[directory] = (mtime, etag, listing)
+        return etag, listing
+
+    def invalidate(self, filename: str):
+        """Drops the listings of all directories containing the given file, as new subdirectories may have appeared."""
+        parts = filename.strip("/").split("/")[:-1]
+        with self.lock:
+            self.listings.pop("", None)
+            for i in range(1, len(parts) + 1):
+                self.listings.pop("/".join(parts[:i]), None)
+
+
+class UpstreamProxy:
+    """
+    Pull-through cache of an upstream Maven repository. Artifacts missing from the local repository are fetched from
+    the upstream, stored atomically and served from then on. Concurrent misses for the same artifact are coalesced into
+    a single download, and maven-metadata files obtained from the upstream are refetched once older than metadata_ttl.
+    """
+
+    def __init__(self, root: Path, upstream: str, metadata_ttl: int):
+        self.root = root
+        self.upstream = upstream.rstrip("/")
+        self.metadata_ttl = metadata_ttl
+        self.in_flight: dict[str, Future] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def is_metadata(filename: str) -> bool:
+        return Path(filename).name.startswith("maven-metadata")
+
+    @staticmethod
+    def marker_path(path: Path) -> Path:
+        """Hidden file marking that the file at path was obtained from the upstream."""
+        return path.parent / f".{path.name}.upstream"
+
+    def needs_fetch(self, filename: str) -> bool:
+        """Returns True if the file is missing locally, or if it is upstream metadata that outlived its TTL."""
+        path = resolve(self.root, filename)
+        if path is None or filename.endswith("/") or os.path.isdir(path):
+            return False
+        if not os.path.isfile(path):
+            return True
+        marker = self.marker_path(path)
+        return self.is_metadata(filename) and os.path.isfile(marker) and \
+            time.time() - os.path.getmtime(marker) > self.metadata_ttl
+
+    def fetch(self, filename: str) -> Optional[Path]:
+        """Fetches the file from the upstream unless another thread is already doing so, in which case its result is
+        awaited instead. Returns the local path, or None if the upstream does not have the file."""
+        with self.lock:
+            future = self.in_flight.get(filename)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.in_flight[filename] = future
+        if not owner:
+            return future.result()
+
+        path = None
+        try:
+            # Another thread may have completed the download between our check and taking ownership
+            path = self.download(filename) if self.needs_fetch(filename) else resolve(self.root, filename)
+        except Exception as e:
+            print(e)
+        finally:
+            with self.lock:
+                del self.in_flight[filename]
+            future.set_result(path)  # Also on a BaseException, so that waiters are never left blocked
+        return path
+
+    def download(self, filename: str) -> Optional[Path]:
+        path = resolve(self.root, filename)
+        url = f"{self.upstream}/{filename}"
+        print(f"Fetching {url}")
+        # Redirects and HTML are directory listings, which are not mirrored
+        with requests.get(url, headers=HTTP_headers, stream=True, timeout=60, allow_redirects=False) as response:
+            if response.status_code != 200 or response.headers.get("Content-Type", "").startswith("text/html"):
+                return None
+            response.raw.decode_content = True
+            store_artifact(response.raw, path, write_checksums=False)
+        if self.is_metadata(filename):
+            write_atomically(self.marker_path(path), b"")
+        return path
+
+
+def list_directory(root: Path, directory: str) -> list[dict]:
+    directory_content = []
+    for item in sorted(os.listdir(root / directory)):
+        if item.startswith("."):
+            continue
+        item_path = f"{directory}/{item}" if directory else item
+        directory_content.append({'name': item, 'url': f'/maven/{item_path}'})
+    return directory_content
+
+
+def store_artifact(stream: BinaryIO, path: Path, write_checksums=True) -> dict[str, str]:
+    """
+    Streams the artifact into a temporary file next to path and atomically moves it into place, so that concurrent
+    readers never observe a partial artifact. Unless the artifact is itself a checksum or signature, .sha1 and .md5
+    files are written next to it.
+    :return: mapping of the checksum algorithm to the hex digest of the artifact
+    """
+    sha1 = hashlib.sha1()
+    md5 = hashlib.md5()
+    with atomic_write(path, 'wb') as f:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+            sha1.update(chunk)
+            md5.update(chunk)
+            f.write(chunk)
+
+    checksums = {'sha1': sha1.hexdigest(), 'md5': md5.hexdigest()}
+    if write_checksums and not path.name.endswith(CHECKSUM_EXTENSIONS):
+        for algorithm, digest in checksums.items():
+            write_atomically(Path(f"{path}.{algorithm}"), digest.encode())
+    return checksums
+
+
+def resolve(root: Path, filename: str) -> Optional[Path]:
+    """Returns the path of filename inside root, or None if filename points outside of root."""
+    path = (root / filename).resolve()
+    if path != root.resolve() and root.resolve() not in path.parents:
+        return None
+    return path
@@ -0,0 +1,205 @@
+"""
+Python port of Maven's org.apache.maven.artifact.versioning.ComparableVersion, used to order versions the same way
+Maven does without calling into the JVM.
+"""
+import re
+from functools import total_ordering
+from typing import Optional
+
+QUALIFIERS = ["alpha", "beta", "milestone", "rc", "snapshot", "", "sp"]
+ALIASES = {"ga": "", "final": "", "release": "", "cr": "rc"}
+RELEASE_VERSION_INDEX = str(QUALIFIERS.index(""))
+
+
+class IntItem:
+    def __init__(self, value: int):
+        self.value = value
+
+    def is_null(self) -> bool:
+        return self.value == 0
+
+    def compare_to(self, item) -> int:
+        if item is None:
+            return 0 if self.value == 0 else 1
+        if isinstance(item, IntItem):
+            return (self.value > item.value) - (self.value < item.value)
+        return 1  # 1.1 > 1-sp and 1.1 > 1-1
+
+
+class StringItem:
+    def __init__(self, value: str, followed_by_digit: bool):
+        if followed_by_digit and len(value) == 1:
+            # a1 = alpha-1, b1 = beta-1, m1 = milestone-1
+            value = {"a": "alpha", "b": "beta", "m": "milestone"}.get(value, value)
+        self.value = ALIASES.get(value, value)
+
+    def is_null(self) -> bool:
+        return self.compare_to(None) == 0
+
+    @staticmethod
+    def comparable_qualifier(qualifier: str) -> str:
+        """Known qualifiers are ordered by their index, unknown qualifiers come after them in lexical order."""
+        if qualifier in QUALIFIERS:
+            return str(QUALIFIERS.index(qualifier))
+        return f"{len(QUALIFIERS)}-{qualifier}"
+
+    def compare_to(self, item) -> int:
+        if item is None:
+            # 1-rc < 1, 1-ga > 1
+            return compare_strings(self.comparable_qualifier(self.value), RELEASE_VERSION_INDEX)
+        if isinstance(item, StringItem):
+            return compare_strings(self.comparable_qualifier(self.value), self.comparable_qualifier(item.value))
+        return -1  # 1.any < 1.1 and 1-any < 1-1
+
+
+class ListItem(list):
+    def is_null(self) -> bool:
+        return len(self) == 0
+
+    def normalize(self):
+        """Removes trailing null items, e.g. 1.0.0 becomes 1."""
+        for i in range(len(self) - 1, -1, -1):
+            last_item = self[i]
+            if last_item.is_null():
+                del self[i]
+            elif not isinstance(last_item, ListItem):
+                break
+
+    def compare_to(self, item) -> int:
+        if item is None:
+            if len(self) == 0:
+                return 0  # 1-0 = 1- (normalize) = 1
+            return self[0].compare_to(None)
+        if isinstance(item, IntItem):
+            return -1  # 1-1 < 1.0.x
+        if isinstance(item, StringItem):
+            return 1  # 1-1 > 1-sp
+        for i in range(max(len(self), len(item))):
+            left = self[i] if i < len(self) else None
+            right = item[i] if i < len(item) else None
+            if left is None:
+                result = 0 if right is None else -1 * right.compare_to(left)
+            else:
+                result = left.compare_to(right)
+            if result != 0:
+                return result
+        return 0
+
+
+def compare_strings(x: str, y: str) -> int:
+    return (x > y) - (x < y)
+
+
+def parse_item(is_digit: bool, buf: str):
+    return IntItem(int(buf)) if is_digit else StringItem(buf, False)
+
+
+def parse_version(version: str) -> ListItem:
+    version = version.lower()
+    items = ListItem()
+    current = items
+    stack = [current]
+    is_digit = False
+    start_index = 0
+
+    for i, c in enumerate(version):
+        if c == ".":
+            current.append(IntItem(0) if i == start_index else parse_item(is_digit, version[start_index:i]))
+            start_index = i + 1
+        elif c == "-":
+            current.append(IntItem(0) if i == start_index else parse_item(is_digit, version[start_index:i]))
+            start_index = i + 1
+            sublist = ListItem()
+            current.append(sublist)
+            current = sublist
+            stack.append(current)
+        elif "0" <= c <= "9":
+            if not is_digit and i > start_index:
+                current.append(StringItem(version[start_index:i], True))
+                start_index = i
+                sublist = ListItem()
+                current.append(sublist)
+                current = sublist
+                stack.append(current)
+            is_digit = True
+        else:
+            if is_digit and i > start_index:
+                current.append(parse_item(True, version[start_index:i]))
+                start_index = i
+                sublist = ListItem()
+                current.append(sublist)
+                current = sublist
+                stack.append(current)
+            is_digit = False
+
+    if len(version) > start_index:
+        current.append(parse_item(is_digit, version[start_index:]))
+
+    while stack:
+        stack.pop().normalize()
+
+    return items
+
+
+@total_ordering
+class ComparableVersion:
+    """A version string that compares according to Maven's version ordering."""
+
+    def __init__(self, version: str):
+        self.value = version
+        self.items = parse_version(version)
+
+    def compare_to(self, other: "ComparableVersion") -> int:
+        return self.items.compare_to(other.items)
+
+    def __eq__(self, other):
+        if isinstance(other, ComparableVersion):
+            return self.compare_to(other) == 0
+        return False
+
+    def __lt__(self, other: "ComparableVersion"):
+        return self.compare_to(other) < 0
+
+    def __hash__(self):
+        return hash(canonical(self.items))
+
+    def __str__(self):
+        return self.value
+
+    def __repr__(self):
+        return f"ComparableVersion({self.value})"
+
+
+def canonical(item) -> str:
+    if isinstance(item, ListItem):
+        return "[" + ",".join(canonical(x) for x in item) + "]"
+    if isinstance(item, IntItem):
+        return str(item.value)
+    return f"'{item.value}'"
+
+
+def sort_versions(versions: list[str]) -> list[ComparableVersion]:
+    """Returns the given versions without duplicates in ascending order as defined by Maven."""
+    unique = []
+    seen = set()
+    for version in versions:
+        comparable = ComparableVersion(version)
+        if comparable not in seen:
+            seen.add(comparable)
+            unique.append(comparable)
+    return sorted(unique)
+
+
+def get_major_version(version: str) -> Optional[int]:
+    """Returns the leading number of the version, e.g. 2 for 2.16.0-rc1, or None if it does not start with one."""
+    match = re.match(r"\d+", version)
+    return int(match.group()) if match else None
+
+
+def is_prerelease(version: str) -> bool:
+    """Returns True if the version has a qualifier Maven orders before releases, e.g. alpha, beta, M1, rc or SNAPSHOT."""
+    def has_prerelease_qualifier(item) -> bool:
+        if isinstance(item, ListItem):
+            return any(has_prerelease_qualifier(x) for x in item)
+        return isinstance(item, StringItem) and item.compare_to(None) < 0
+    return has_prerelease_qualifier(parse_version(version))
@@ -0,0 +1,168 @@
+"""
+Module containing the shared object store, which keeps one bare repository per fork network (a repository together with
+its forks) that all clones of the network borrow their objects from through git alternates. Each fork is a remote of
+the store, so cloning a fork or recloning a repository only transfers the objects the store does not have yet.
+The clones borrowing from a store are recorded in its borrowers.json, and stores without borrowers are deleted by gc.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+from git import Repo, GitCommandError
+from github import Repository
+
+from server.persistence import atomic_write
+
+
+def get_network_name(repo: Repository) -> str:
+    """Returns the full name of the repository at the root of the fork network of repo."""
+    return repo.source.full_name if repo.fork and repo.source else repo.full_name
+
+
+def get_remote_name(full_name: str) -> str:
+    return full_name.replace("/", "__")
+
+
+def get_store_path(store_dir: Path, network: str) -> Path:
+    return Path(store_dir) / f"{network}.git"
+
+
+def get_object_stores(store_dir: Path) -> list[Path]:
+    return sorted(Path(store_dir).glob("*/*.git"))
+
+
+@contextmanager
+def store_lock(store: Path):
+    """Holds an exclusive lock on the store, excluding both other processes and other threads of this process."""
+    os.makedirs(store.parent, exist_ok=True)
+    with open(store.with_suffix(".lock"), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_borrowers(store: Path) -> dict[str, str]:
+    """Returns the clones borrowing from the store, mapped to the remote of the store they were cloned from."""
+    path = store / "borrowers.json"
+    if not os.path.isfile(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_borrowers(store: Path, borrowers: dict[str, str]):
+    with atomic_write(store / "borrowers.json") as f:
+        json.dump(borrowers, f, indent=4)
+
+
+def is_borrower(clone_path: Path, store: Path) -> bool:
+    """Returns True if the clone still exists and borrows from the store."""
+    alternates = Path(clone_path) / ".git" / "objects" / "info" / "alternates"
+    if not os.path.isfile(alternates):
+        return False
+    with open(alternates, 'r') as f:
+        return str((store / "objects").resolve()) in (line.strip() for line in f)
+
+
+def get_store_filter(repo: Repo) -> Optional[str]:
+    """Returns the object filter of a partial store, e.g. blob:none, or None if the store has all objects."""
+    try:
+        filters = repo.git.config("--get-regexp", r"remote\..*\.partialclonefilter").splitlines()
+    except GitCommandError:
+        return None  # No remote was fetched with a filter
+    return filters[0].split()[1] if filters else None
+
+
+def borrow_object_store(store_dir: Path, network: str, full_name: str, url: str, clone_path: Path,
+                        object_filter: Optional[str] = None) -> Path:
+    """
+    Fetches the repository at url into the store of its fork network and registers clone_path as a borrower.
+    :param object_filter: filter of a partial clone, e.g. blob:none, so that the store does not fetch the objects the
+    clone leaves out. The remote then becomes a promisor remote of the store
+    :return: path of the store, to pass as --reference when cloning into clone_path
+    """
+    store = get_store_path(store_dir, network)
+    remote = get_remote_name(full_name)
+    with store_lock(store):
+        repo = Repo(store) if os.path.isdir(store) else Repo.init(store, bare=True)
+        if remote not in [r.name for r in repo.remotes]:
+            repo.git.remote("add", remote, url)
+            # Tags of different forks may clash, so they are kept apart per remote
+            repo.git.config("--add", f"remote.{remote}.fetch", f"+refs/tags/*:refs/remotes/{remote}/tags/*")
+            repo.git.config(f"remote.{remote}.tagOpt", "--no-tags")
+        print(f"Fetching {full_name} into the object store {store}")
+        filter_args = [f"--filter={object_filter}"] if object_filter else []
+        repo.git.fetch(*filter_args, remote, "--prune", "--quiet")
+        borrowers = read_borrowers(store)
+        borrowers[str(Path(clone_path).resolve())] = remote
+        write_borrowers(store, borrowers)
+    return store
+
+
+def release_object_store(store_dir: Path, clone_path: Path) -> bool:
+    """
+    Unregisters the clone from the store it borrows from, to be called before deleting the clone.
+    :return: True if the clone was a borrower
+    """
+    clone_path = str(Path(clone_path).resolve())
+    for store in get_object_stores(store_dir):
+        with store_lock(store):
+            borrowers = read_borrowers(store)
+            if clone_path in borrowers:
+                del borrowers[clone_path]
+                write_borrowers(store, borrowers)
+                return True
+    return False
+
+
+def gc_object_store(store: Path, min_age: float = 3600) -> bool:
+    """
+    Forgets borrowers that were deleted, deletes the store if it has no borrowers left, and otherwise removes the
+    remotes no borrower was cloned from and runs git gc. The refs of every borrower are fetched into the store first,
+    so that gc never prunes an object a borrower relies on.
+    :param min_age: seconds since the last borrow before gc touches the store, as clones may still be in progress
+    :return: True if the store was deleted
+    """
+    with store_lock(store):
+        borrowers_path = store / "borrowers.json"
+        if os.path.isfile(borrowers_path) and time.time() - os.path.getmtime(borrowers_path) < min_age:
+            return False
+        borrowers = {path: remote for path, remote in read_borrowers(store).items() if is_borrower(Path(path), store)}
+        write_borrowers(store, borrowers)
+        if not borrowers:
+            print(f"Deleting the object store {store} without borrowers")
+            shutil.rmtree(store)
+            return True
+
+        repo = Repo(store)
+        for remote in repo.remotes:
+            if remote.name not in borrowers.values():
+                repo.git.remote("remove", remote.name)
+        for ref in repo.git.for_each_ref("--format=%(refname)", "refs/borrowers/").split():
+            repo.git.update_ref("-d", ref)
+        prune = "--prune=2.weeks.ago"
+        # Partial clones lack the objects the store lacks, so their refs are fetched with the store's filter
+        object_filter = get_store_filter(repo)
+        filter_args = [f"--filter={object_filter}"] if object_filter else []
+        for path in borrowers:
+            borrower_id = hashlib.sha1(path.encode()).hexdigest()[:12]
+            try:
+                repo.git.fetch("--quiet", "--no-tags", *filter_args, path, f"+refs/*:refs/borrowers/{borrower_id}/*")
+            except GitCommandError as e:
+                print(f"Could not fetch the refs of borrower {path}, keeping all objects: {e}")
+                prune = "--prune=never"
+        repo.git.gc("--quiet", prune)
+        return False
+
+
+def gc_object_stores(store_dir: Path, min_age: float = 3600) -> int:
+    """Runs gc_object_store on every store. Returns the number of deleted stores."""
+    return sum(gc_object_store(store, min_age) for store in get_object_stores(store_dir))
@@ -0,0 +1,63 @@
+"""Module containing the helpers persisting state safely under concurrency: atomic file writes and SQLite connections."""
+import os
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Union
+
+
+@contextmanager
+def atomic_write(path: Path, mode: str = 'w'):
+    """
+    Opens a temporary file next to path, which replaces path once the block exits without an exception, so that
+    concurrent readers never observe a partially written file. On an exception the temporary file is removed.
+    """
+    path = Path(path)
+    os.makedirs(path.parent, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=".", suffix=".part")
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def write_atomically(path: Path, content: Union[bytes, str]):
+    with atomic_write(path, 'wb' if isinstance(content, bytes) else 'w') as f:
+        f.write(content)
+
+
+class ThreadLocalConnection:
+    """Opens a connection to the SQLite database per thread, as sqlite3 connections cannot be shared between threads."""
+
+    def __init__(self, path: Path, timeout: float = 30, pragmas: Iterable[str] = ("journal_mode=WAL",), **options):
+        """
+        :param pragmas: PRAGMA statements run on every new connection
+        :param options: further arguments of sqlite3.connect, e.g. isolation_level
+        """
+        self.path = Path(path)
+        self.timeout = timeout
+        self.pragmas = list(pragmas)
+        self.options = options
+        self.local = threading.local()
+
+    def get(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, **self.options)
+            for pragma in self.pragmas:
+                conn.execute(f"PRAGMA {pragma}")
+            self.local.conn = conn
+        return conn
+
+    def close(self):
+        """Closes the connection of the calling thread, if it opened one."""
+        conn = getattr(self.local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
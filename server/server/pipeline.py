@@ -0,0 +1,64 @@
+"""
+Module containing the candidate pipeline, which overlaps the builds of candidate templates with the tests of other
+candidates: while a candidate is tested, the templates of the next candidates are compiled in the background. Builds
+and tests run in separately bounded pools, as compiles are CPU-bound while test runs mostly wait on surefire.
+"""
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Generic, Iterable, Iterator, Optional, TypeVar
+
+from server.config import BUILD_WORKERS, TEST_WORKERS
+
+B = TypeVar("B")
+R = TypeVar("R")
+
+
+class CandidatePipeline(Generic[B, R]):
+    """
+    Runs build(cv) for the candidates in the build pool and check(cv, build future) in the test pool. Builds are
+    submitted at most build_workers + test_workers candidates ahead of the one whose result is awaited, checks at most
+    test_workers ahead, so with more than one test worker the next candidates are tested speculatively.
+    """
+
+    def __init__(self, build: Callable[[str], B], check: Callable[[str, Optional[Future]], R],
+                 build_workers: int = BUILD_WORKERS, test_workers: int = TEST_WORKERS):
+        self.build = build
+        self.check = check
+        self.build_workers = build_workers
+        self.test_workers = max(1, test_workers)
+
+    def run(self, candidates: Iterable[str]) -> Iterator[tuple[str, R]]:
+        """
+        Yields the candidates with the results of their checks, in order. With build_workers set to 0 nothing is built
+        ahead and check gets None instead of a future. Closing the generator, e.g. when the search stops early,
+        cancels the builds and checks that have not started and waits for those already running, so that none
+        outlives the lease the caller holds on the base template.
+        """
+        build_pool = ThreadPoolExecutor(max_workers=self.build_workers, thread_name_prefix="build") \
+            if self.build_workers > 0 else None
+        test_pool = ThreadPoolExecutor(max_workers=self.test_workers, thread_name_prefix="test")
+        building: deque[tuple[str, Optional[Future]]] = deque()  # Candidates whose check was not submitted yet
+        checking: deque[tuple[str, Future]] = deque()
+        remaining = iter(candidates)
+        try:
+            while True:
+                while len(building) + len(checking) < self.build_workers + self.test_workers:
+                    cv = next(remaining, None)
+                    if cv is None:
+                        break
+                    building.append((cv, build_pool.submit(self.build, cv) if build_pool else None))
+                # Checks are only submitted as test workers free up, with one worker none runs past an early stop
+                while building and len(checking) < self.test_workers:
+                    cv, build = building.popleft()
+                    checking.append((cv, test_pool.submit(self.check, cv, build)))
+                if not checking:
+                    return
+                cv, check = checking.popleft()
+                yield cv, check.result()
+        finally:
+            for cv, build in building:
+                if build is not None and build.cancel():
+                    print(f"Cancelled the build of {cv}")
+            test_pool.shutdown(wait=True, cancel_futures=True)
+            if build_pool:
+                build_pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,114 @@
+"""Module containing logic related to converting compatible versions into Maven range specs on the server."""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from core import get_available_versions, scrape_available_versions, MavenMetadataNotFound
+from server.config import AVAILABLE_VERSIONS_TTL, RANGE_CACHE_SIZE
+from server.maven_version import ComparableVersion, sort_versions
+
+
+def create_range_spec_from_list(versions: list[ComparableVersion]) -> str:
+    """Given a list of ComparableVersions, e.g. [1,2,3], return the corresponding range, i.e. [1,3]"""
+    lower_bound = str(versions[0])
+    upper_bound = str(versions[-1])
+    if lower_bound == upper_bound:
+        return f"[{lower_bound}]"
+    return f"[{lower_bound},{upper_bound}]"
+
+
+def get_continuous_ranges(compatible_versions: list[ComparableVersion],
+                          available_versions: list[ComparableVersion]) -> list[list[ComparableVersion]]:
+    """Groups elements in compatible_versions that appear consecutively in available_versions."""
+    compatible = set(compatible_versions)
+    continuous_ranges = []
+    current_range = []
+
+    for av in available_versions:
+        if av in compatible:
+            current_range.append(av)
+        elif current_range:
+            continuous_ranges.append(current_range)
+            current_range = []
+
+    if current_range:
+        continuous_ranges.append(current_range)
+
+    return continuous_ranges
+
+
+def create_range_spec(compatible_versions: list[str], available_versions: list[str]) -> str:
+    """Creates a valid Maven range spec based on the given compatible and available versions."""
+    if len(compatible_versions) == 0:
+        # If there are no compatible versions, then the compatible version range is empty.
+        return "[]"
+
+    continuous_ranges = get_continuous_ranges(sort_versions(compatible_versions), sort_versions(available_versions))
+    return ",".join(create_range_spec_from_list(cr) for cr in continuous_ranges)
+
+
+def hash_versions(versions: list[str]) -> str:
+    return hashlib.sha1("\n".join(sorted(versions)).encode()).hexdigest()
+
+
+def fetch_available_versions(g: str, a: str) -> list[str]:
+    try:
+        return get_available_versions(g, a)
+    except MavenMetadataNotFound as e:
+        print(e)
+        return scrape_available_versions(g, a)
+
+
+class RangeCache:
+    """
+    Caches range specs keyed by (GA, hash of the compatible versions, hash of the available versions), so that a
+    change to either input results in a recomputation. The available versions of each GA are themselves cached for
+    AVAILABLE_VERSIONS_TTL seconds.
+    """
+
+    def __init__(self, fetch: Callable[[str, str], list[str]] = fetch_available_versions,
+                 ttl: int = AVAILABLE_VERSIONS_TTL, max_size: int = RANGE_CACHE_SIZE):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_size = max_size
+        self.available_versions: dict[tuple[str, str], tuple[float, list[str]]] = {}
+        self.ranges: OrderedDict[tuple[str, str, str], str] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_available_versions(self, g: str, a: str) -> list[str]:
+        with self.lock:
+            cached = self.available_versions.get((g, a))
+        if cached and time.monotonic() - cached[0] < self.ttl:
+            return cached[1]
+        versions = self.fetch(g, a)
+        with self.lock:
+            self.available_versions[(g, a)] = (time.monotonic(), versions)
+        return versions
+
+    def invalidate(self, g: str, a: str):
+        """Forgets the available versions and ranges of GA."""
+        ga = f"{g}:{a}"
+        with self.lock:
+            self.available_versions.pop((g, a), None)
+            for key in [key for key in self.ranges if key[0] == ga]:
+                del self.ranges[key]
+
+    def get_range(self, g: str, a: str, compatible_versions: list[str]) -> Optional[str]:
+        """Returns the range spec of the given compatible versions of GA, or None if there are none."""
+        if not compatible_versions:
+            return None
+        available_versions = self.get_available_versions(g, a)
+        key = (f"{g}:{a}", hash_versions(compatible_versions), hash_versions(available_versions))
+        with self.lock:
+            if key in self.ranges:
+                self.ranges.move_to_end(key)
+                return self.ranges[key]
+
+        range_spec = create_range_spec(compatible_versions, available_versions)
+        with self.lock:
+            self.ranges[key] = range_spec
+            while len(self.ranges) > self.max_size:
+                self.ranges.popitem(last=False)
+        return range_spec
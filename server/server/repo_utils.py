@@ -1,9 +1,15 @@
+import fcntl
 import os
+import shutil
+import socket
 import subprocess
+import tempfile
+from contextlib import contextmanager
 from pathlib import Path
 
+from server.exceptions import GithubTagNotFoundException
 from server.test_failure import at_least_one_passing_test
-from server.config import COMPILE_TIMEOUT, TEST_TIMEOUT
+from server.config import COMPILE_TIMEOUT, TEST_TIMEOUT, WORKTREES_DIR
 
 
 def get_sha_of_repo_head(repo_path: Path) -> str:
@@ -76,4 +82,136 @@ def compile_repo(repo_path: Path, use_pom="pom.xml", save_as=None) -> bool:
         compiles = False
     os.chdir(old_dir)
     return compiles
-# mvn clean install -DskipTests -Dspotbugs.skip=True -f original_pom.xml -l original_build.log
\ No newline at end of file
+# mvn clean install -DskipTests -Dspotbugs.skip=True -f original_pom.xml -l original_build.log
+
+
+def git(repo_path: Path, *args: str) -> str:
+    out = subprocess.run(["git", *args], cwd=repo_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                         universal_newlines=True)
+    if out.returncode != 0:
+        raise subprocess.CalledProcessError(out.returncode, ["git", *args], out.stdout, out.stderr)
+    return out.stdout
+
+
+@contextmanager
+def repo_lock(repo_path: Path):
+    """
+    Holds an exclusive lock on the git metadata of the clone containing repo_path. The lock is a flock on a file in
+    the .git directory, which excludes both other processes and other threads of this process.
+    """
+    git_dir = Path(git(repo_path, "rev-parse", "--path-format=absolute", "--git-common-dir").strip())
+    with open(git_dir / "worktree.lock", 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def has_commit(repo_path: Path, commit_sha: str) -> bool:
+    """Checks for the commit without fetching it, which cat-file would do in partial clones."""
+    try:
+        git(repo_path, "rev-list", "--no-walk", "--missing=allow-any", commit_sha)
+        return True
+    except subprocess.CalledProcessError:
+        return False
+
+
+def ensure_commit(repo_path: Path, commit_sha: str, tag_name: str = ""):
+    """
+    Makes sure the given commit is in the clone containing repo_path, fetching as little as possible: first only the
+    tag, then the commit itself, and only then the rest of the history. Partial clones keep fetching without blobs.
+    Must be called while holding the repo lock.
+    """
+    if has_commit(repo_path, commit_sha):
+        return
+    shallow = git(repo_path, "rev-parse", "--is-shallow-repository").strip() == "true"
+    depth = ["--depth=1"] if shallow else []
+    attempts = [[*depth, "origin", commit_sha]]
+    if tag_name:
+        attempts.insert(0, [*depth, "origin", f"+refs/tags/{tag_name}:refs/tags/{tag_name}"])
+    attempts.append(["--unshallow", "--tags", "origin"] if shallow else ["--tags", "origin"])
+    for attempt in attempts:
+        print(f"Fetching {commit_sha} into {repo_path}: git fetch {' '.join(attempt)}")
+        try:
+            git(repo_path, "fetch", "--quiet", *attempt)
+        except subprocess.CalledProcessError as e:
+            print(e.stderr)
+        if has_commit(repo_path, commit_sha):
+            return
+    raise GithubTagNotFoundException(f"Could not fetch commit {commit_sha} of tag {tag_name} into {repo_path}")
+
+
+def get_worktree_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def owner_is_alive(owner: str) -> bool:
+    """Returns False only if the owner is a process on this host that no longer exists."""
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def remove_stale_worktrees(repo_path: Path, worktrees_dir: Path = WORKTREES_DIR) -> int:
+    """
+    Removes the worktrees under worktrees_dir left behind by dead processes, and forgets worktrees whose directory was
+    deleted. Must be called while holding the repo lock.
+    :return: number of removed worktrees
+    """
+    removed = 0
+    worktree, locked = None, None
+    for line in git(repo_path, "worktree", "list", "--porcelain").splitlines() + [""]:
+        if line.startswith("worktree "):
+            worktree = Path(line.removeprefix("worktree "))
+        elif line.startswith("locked"):
+            locked = line.removeprefix("locked").strip()
+        elif not line and worktree is not None:
+            if worktree.parent == Path(worktrees_dir).resolve() and locked is not None and not owner_is_alive(locked):
+                git(repo_path, "worktree", "remove", "--force", "--force", str(worktree))
+                removed += 1
+            worktree, locked = None, None
+    git(repo_path, "worktree", "prune")
+    return removed
+
+
+@contextmanager
+def checkout_worktree(repo_path: Path, commit_sha: str, tag_name: str = "", worktrees_dir: Path = WORKTREES_DIR):
+    """
+    Checks out the given commit in a fresh worktree of the clone containing repo_path, so that several commits of the
+    same repository can be built at the same time. The commit is fetched first if the clone does not have it. The
+    worktree is removed on exit, and locked with the owning process while in use so that worktrees of crashed
+    processes can be told apart and cleaned up.
+    :return: path in the worktree corresponding to repo_path, which may be a module directory inside the clone
+    """
+    root = Path(git(repo_path, "rev-parse", "--show-toplevel").strip())
+    module = Path(repo_path).resolve().relative_to(root.resolve())
+    os.makedirs(worktrees_dir, exist_ok=True)
+    with repo_lock(root):
+        remove_stale_worktrees(root, worktrees_dir)
+        ensure_commit(root, commit_sha, tag_name)
+        # Created only once the commit is there, as directories that are not registered worktrees are never cleaned up
+        worktree = Path(tempfile.mkdtemp(dir=worktrees_dir, prefix=f"{root.name}-{commit_sha[:12]}-"))
+        try:
+            git(root, "worktree", "add", "--detach", "--force", "--lock", "--reason", get_worktree_owner(),
+                str(worktree), commit_sha)
+        except BaseException:
+            shutil.rmtree(worktree, ignore_errors=True)
+            raise
+    try:
+        yield worktree / module
+    finally:
+        with repo_lock(root):
+            try:
+                git(root, "worktree", "remove", "--force", "--force", str(worktree))
+            except subprocess.CalledProcessError as e:
+                print(f"Could not remove worktree {worktree}: {e.stderr}")
+            shutil.rmtree(worktree, ignore_errors=True)
+            git(root, "worktree", "prune")
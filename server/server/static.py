@@ -6,6 +6,7 @@ from pathlib import Path
 
 from server.config import PATH_TO_JAPICMP, PATH_TO_JARS
 from server.exceptions import BaseJarNotFoundException, CandidateJarNotFoundException
+from server.jar_fetcher import fetch_jar
 
 
 def run_static_check(path_to_jar_old: Path, path_to_jar_new: Path) -> bool:
@@ -40,14 +41,12 @@ def statically_compatible(g: str, a: str, v: str, cv: str) -> bool:
     new_jar = pathlib.Path.joinpath(PATH_TO_JARS, f"{a}-{cv}.jar")
 
     if not os.path.isfile(old_jar):
-        subprocess.run(["mvn", "dependency:copy", f"-Dartifact={g}:{a}:{v}",
-                        "-DexcludeTransitive=true", f"-DoutputDirectory={PATH_TO_JARS}"])
+        fetch_jar(g, a, v, jar_dir=PATH_TO_JARS)
     if not os.path.isfile(old_jar):
         raise BaseJarNotFoundException(f"Could not find base jar for the static compatibility check: {old_jar}")
 
     if not os.path.isfile(new_jar):
-        subprocess.run(["mvn", "dependency:copy", f"-Dartifact={g}:{a}:{cv}",
-                        "-DexcludeTransitive=true", f"-DoutputDirectory={PATH_TO_JARS}"])
+        fetch_jar(g, a, cv, jar_dir=PATH_TO_JARS)
     if not os.path.isfile(new_jar):
         raise CandidateJarNotFoundException(f"Could not find candidate jar for static compatibility check: {new_jar}")
 
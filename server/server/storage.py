@@ -0,0 +1,301 @@
+"""
+Module containing the storage manager, which tracks the size and last access of the templates, jars and clones in the
+resources directory and keeps them within a disk budget by evicting the least valuable entries. Entries in use or used
+recently are never evicted.
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Optional
+
+from server.config import (STORAGE_DB, STORAGE_BUDGET, STORAGE_EVICTION, STORAGE_MIN_IDLE, STORAGE_LEASE,
+                           STORAGE_SCAN_INTERVAL, BASE_TEMPLATES_DIR, CAND_TEMPLATES_DIR, PATH_TO_JARS, path_to_repos,
+                           OBJECT_STORE_DIR, BLOB_STORE_DIR)
+from server.blob_store import gc_blobs
+from server.object_store import release_object_store, gc_object_stores
+from server.repo_utils import get_worktree_owner, owner_is_alive
+from server.persistence import ThreadLocalConnection
+
+# Directories whose entries are managed, keyed by kind. Clones are stored as <owner>/<name> and object stores as
+# <owner>/<name>.git, hence at depth 2
+STORAGE_ROOTS = {
+    "base_templates": (BASE_TEMPLATES_DIR, 1),
+    "cand_templates": (CAND_TEMPLATES_DIR, 1),
+    "jars": (PATH_TO_JARS, 1),
+    "repos": (path_to_repos, 2),
+    "object_store": (OBJECT_STORE_DIR, 2),
+}
+# Object stores count towards the budget, but are only deleted by gc once no clone borrows from them
+UNEVICTABLE_KINDS = {"object_store"}
+SIZE_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def get_size(path: Path) -> int:
+    """Returns the disk usage of the file or directory in bytes, counting files with several hard links once."""
+    if not os.path.isdir(path):
+        return os.lstat(path).st_blocks * 512 if os.path.lexists(path) else 0
+    size = 0
+    seen = set()
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            stat = os.lstat(os.path.join(dirpath, filename))
+            if stat.st_nlink > 1:
+                if (stat.st_dev, stat.st_ino) in seen:
+                    continue
+                seen.add((stat.st_dev, stat.st_ino))
+            size += stat.st_blocks * 512
+    return size
+
+
+def parse_size(size: str) -> int:
+    """Parses a size such as 500M or 2G into bytes."""
+    size = size.strip().upper().removesuffix("B")
+    if size and size[-1] in SIZE_UNITS:
+        return int(float(size[:-1]) * SIZE_UNITS[size[-1]])
+    return int(size)
+
+
+def format_size(size: int) -> str:
+    for unit in ["T", "G", "M", "K"]:
+        if size >= SIZE_UNITS[unit]:
+            return f"{size / SIZE_UNITS[unit]:.1f}{unit}"
+    return f"{size}B"
+
+
+def get_value(entry: dict, now: float) -> float:
+    """Value of keeping an entry: how often it was used, decayed by the hours since its last use, per byte."""
+    hours_idle = max(0.0, now - entry['last_access']) / 3600
+    return (entry['hits'] + 1) / (hours_idle + 1) / max(entry['size'], 1)
+
+
+def get_entry_kind(path: Path, roots: dict[str, tuple[Path, int]] = STORAGE_ROOTS) -> Optional[str]:
+    """Returns the kind of the managed entry at path, or None if path is not an entry of one of the roots."""
+    path = Path(path).resolve()
+    for kind, (root, depth) in roots.items():
+        root = Path(root).resolve()
+        if path.parent == root if depth == 1 else path.parent.parent == root:
+            return kind
+    return None
+
+
+class StorageManager:
+    """Table of the managed entries and of the leases protecting entries in use, kept in SQLite."""
+
+    def __init__(self, path: Path = STORAGE_DB, roots: Optional[dict[str, tuple[Path, int]]] = None,
+                 min_idle: float = STORAGE_MIN_IDLE, lease: float = STORAGE_LEASE,
+                 blob_store_dir: Path = BLOB_STORE_DIR, object_store_dir: Path = OBJECT_STORE_DIR):
+        self.path = Path(path)
+        self.blob_store_dir = Path(blob_store_dir)
+        self.object_store_dir = Path(object_store_dir)
+        self.roots = STORAGE_ROOTS if roots is None else roots
+        self.min_idle = min_idle
+        self.lease = lease
+        self.connections = ThreadLocalConnection(self.path)
+        os.makedirs(self.path.parent, exist_ok=True)
+        with self.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS entries (path TEXT PRIMARY KEY, kind TEXT NOT NULL, "
+                         "size INTEGER NOT NULL DEFAULT 0, last_access REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)")
+            conn.execute("CREATE TABLE IF NOT EXISTS leases (path TEXT NOT NULL, owner TEXT NOT NULL, "
+                         "expires REAL NOT NULL, PRIMARY KEY (path, owner))")
+            conn.execute("CREATE TABLE IF NOT EXISTS scans (id INTEGER PRIMARY KEY CHECK (id = 0), time REAL)")
+
+    def connection(self) -> sqlite3.Connection:
+        return self.connections.get()
+
+    def get_kind(self, path: Path) -> Optional[str]:
+        """Returns the kind of the managed entry at path, or None if path is not an entry of a managed directory."""
+        return get_entry_kind(path, self.roots)
+
+    def touch(self, path: Path, size: Optional[int] = None):
+        """Records an access of the managed entry at path, and its size if given. Other paths are ignored."""
+        kind = self.get_kind(path)
+        if kind is None:
+            return
+        path = str(Path(path).resolve())
+        with self.connection() as conn:
+            conn.execute("INSERT INTO entries (path, kind, size, last_access, hits) VALUES (?, ?, ?, ?, 1) "
+                         "ON CONFLICT (path) DO UPDATE SET last_access = excluded.last_access, hits = hits + 1, "
+                         "size = CASE WHEN ? IS NULL THEN size ELSE excluded.size END",
+                         (path, kind, size or 0, time.time(), size))
+
+    def update_size(self, path: Path):
+        path = Path(path).resolve()
+        with self.connection() as conn:
+            conn.execute("UPDATE entries SET size = ? WHERE path = ?", (get_size(path), str(path)))
+
+    @contextmanager
+    def in_use(self, path: Path):
+        """Protects the entry at path from eviction until the block exits, or until the lease expires."""
+        path = str(Path(path).resolve())
+        owner = f"{get_worktree_owner()}:{threading.get_ident()}"
+        self.touch(Path(path))
+        with self.connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO leases (path, owner, expires) VALUES (?, ?, ?)",
+                         (path, owner, time.time() + self.lease))
+        try:
+            yield
+        finally:
+            with self.connection() as conn:
+                conn.execute("DELETE FROM leases WHERE path = ? AND owner = ?", (path, owner))
+
+    def is_in_use(self, path: str, now: float) -> bool:
+        rows = self.connection().execute("SELECT owner FROM leases WHERE path = ? AND expires > ?",
+                                         (path, now)).fetchall()
+        # Owners are host:pid:thread, leases of processes that died are ignored
+        return any(owner_is_alive(owner.rsplit(":", 1)[0]) for owner, in rows)
+
+    def scan(self):
+        """Adds the entries on disk that are not tracked yet, refreshes all sizes and forgets deleted entries."""
+        now = time.time()
+        on_disk = {}
+        for kind, (root, depth) in self.roots.items():
+            if not os.path.isdir(root):
+                continue
+            for path in Path(root).resolve().glob("/".join(["*"] * depth)):
+                if (depth == 1 or path.is_dir()) and not path.name.endswith(".part"):
+                    on_disk[str(path)] = (kind, get_size(path), os.path.getmtime(path))
+        with self.connection() as conn:
+            tracked = {row[0] for row in conn.execute("SELECT path FROM entries")}
+            conn.executemany("DELETE FROM entries WHERE path = ?", [(path,) for path in tracked - on_disk.keys()])
+            for path, (kind, size, mtime) in on_disk.items():
+                conn.execute("INSERT INTO entries (path, kind, size, last_access, hits) VALUES (?, ?, ?, ?, 0) "
+                             "ON CONFLICT (path) DO UPDATE SET size = excluded.size", (path, kind, size, mtime))
+            conn.execute("DELETE FROM leases WHERE expires < ?", (now,))
+            conn.execute("INSERT OR REPLACE INTO scans (id, time) VALUES (0, ?)", (now,))
+
+    def last_scan(self) -> float:
+        row = self.connection().execute("SELECT time FROM scans WHERE id = 0").fetchone()
+        return row[0] if row else 0.0
+
+    def entries(self) -> list[dict]:
+        rows = self.connection().execute("SELECT path, kind, size, last_access, hits FROM entries")
+        return [{'path': path, 'kind': kind, 'size': size, 'last_access': last_access, 'hits': hits}
+                for path, kind, size, last_access, hits in rows]
+
+    def usage(self) -> dict[str, dict[str, int]]:
+        """Returns the number of entries and their total size per kind."""
+        rows = self.connection().execute("SELECT kind, COUNT(*), SUM(size) FROM entries GROUP BY kind")
+        return {kind: {'entries': count, 'size': size or 0} for kind, count, size in rows}
+
+    def get_eviction_candidates(self, policy: str = STORAGE_EVICTION) -> list[dict]:
+        """Returns the entries that may be evicted, the first to evict first."""
+        now = time.time()
+        candidates = [entry for entry in self.entries()
+                      if entry['kind'] not in UNEVICTABLE_KINDS and now - entry['last_access'] >= self.min_idle
+                      and not self.is_in_use(entry['path'], now)]
+        if policy == "value":
+            return sorted(candidates, key=lambda entry: get_value(entry, now))
+        return sorted(candidates, key=lambda entry: entry['last_access'])
+
+    def delete(self, entry: dict):
+        path = Path(entry['path'])
+        print(f"Evicting {path} ({format_size(entry['size'])})")
+        if entry['kind'] == "repos":
+            release_object_store(self.object_store_dir, path)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.lexists(path):
+            os.remove(path)
+        with self.connection() as conn:
+            conn.execute("DELETE FROM entries WHERE path = ?", (str(path),))
+
+    def evict(self, budget: int, policy: str = STORAGE_EVICTION, dry_run: bool = False) -> list[dict]:
+        """
+        Evicts entries until their total size is within the budget, or no evictable entries are left.
+        :return: the evicted entries, or the entries that would be evicted if dry_run is set
+        """
+        total = sum(entry['size'] for entry in self.entries())
+        evicted = []
+        for entry in self.get_eviction_candidates(policy):
+            if total <= budget:
+                break
+            if not dry_run:
+                self.delete(entry)
+            total -= entry['size']
+            evicted.append(entry)
+        if evicted and not dry_run:
+            # Evicted templates and clones may have been the last users of blobs and object stores
+            self.gc()
+            total = sum(entry['size'] for entry in self.entries())
+        if total > budget:
+            print(f"Storage is over budget by {format_size(total - budget)}, but all remaining entries are in use")
+        return evicted
+
+    def gc(self):
+        """Deletes the blobs and object stores no longer used by any template or clone, then rescans the sizes."""
+        if os.path.isdir(self.blob_store_dir):
+            print(f"Deleted {gc_blobs(self.blob_store_dir)} blobs no longer used by any template")
+        if os.path.isdir(self.object_store_dir):
+            # Stores borrowed from within min_idle may still be cloned into
+            print(f"Deleted {gc_object_stores(self.object_store_dir, min_age=self.min_idle)} object stores without "
+                  f"borrowers")
+        self.scan()
+
+    def enforce_budget(self, budget: Optional[int] = STORAGE_BUDGET, policy: str = STORAGE_EVICTION,
+                       scan_interval: float = STORAGE_SCAN_INTERVAL) -> list[dict]:
+        """Evicts entries if the storage is over budget, rescanning the sizes on disk if they are outdated."""
+        if budget is None:
+            return []
+        if time.time() - self.last_scan() > scan_interval:
+            self.scan()
+        return self.evict(budget, policy)
+
+    def close(self):
+        self.connections.close()
+
+
+storage_manager: Optional[StorageManager] = None
+
+
+def get_storage_manager() -> StorageManager:
+    global storage_manager
+    if storage_manager is None:
+        storage_manager = StorageManager()
+    return storage_manager
+
+
+def print_report(manager: StorageManager, budget: Optional[int], policy: str, top: int):
+    usage = manager.usage()
+    total = sum(kind['size'] for kind in usage.values())
+    for kind, stats in sorted(usage.items()):
+        print(f"{kind:<16}{stats['entries']:>8} entries {format_size(stats['size']):>10}")
+    print(f"{'total':<16}{sum(kind['entries'] for kind in usage.values()):>8} entries {format_size(total):>10}"
+          + (f" of {format_size(budget)} budget" if budget is not None else ""))
+    print(f"\nFirst {top} entries to evict ({policy}):")
+    for entry in manager.get_eviction_candidates(policy)[:top]:
+        idle_hours = (time.time() - entry['last_access']) / 3600
+        print(f"  {format_size(entry['size']):>10} {idle_hours:>8.1f}h idle {entry['hits']:>5} hits  {entry['path']}")
+
+
+def main(args: Optional[Iterable[str]] = None):
+    """
+    Example: server-storage report
+             server-storage evict --budget 200G --policy value --dry-run
+             server-storage gc
+    """
+    cli = argparse.ArgumentParser(description='Storage manager of the templates, jars and clones')
+    cli.add_argument('command', choices=['report', 'scan', 'evict', 'gc'])
+    cli.add_argument('--budget', type=str, default=None, help='disk budget, e.g. 200G (default: STORAGE_BUDGET)')
+    cli.add_argument('--policy', choices=['lru', 'value'], default=STORAGE_EVICTION, help='eviction policy')
+    cli.add_argument('--dry-run', action='store_true', help='only print the entries that would be evicted')
+    cli.add_argument('--top', type=int, default=10, help='number of eviction candidates to report')
+    args = cli.parse_args(args)
+    budget = parse_size(args.budget) if args.budget else STORAGE_BUDGET
+
+    manager = get_storage_manager()
+    manager.scan()
+    if args.command == 'report':
+        print_report(manager, budget, args.policy, args.top)
+    elif args.command == 'evict':
+        if budget is None:
+            cli.error("no budget given and STORAGE_BUDGET is not set")
+        evicted = manager.evict(budget, args.policy, dry_run=args.dry_run)
+        print(f"{'Would evict' if args.dry_run else 'Evicted'} {len(evicted)} entries, "
+              f"{format_size(sum(entry['size'] for entry in evicted))}")
+    elif args.command == 'gc':
+        manager.gc()
@@ -0,0 +1,251 @@
+"""Module containing the backends of the compatibility store, which maps a GAV to its set of compatible versions."""
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from server.config import COMPATIBILITY_STORE, COMPATIBILITY_STORE_DB, COMPATIBILITY_STORE_BACKEND
+from server.persistence import ThreadLocalConnection, atomic_write
+
+
+class CompatibilityStore(ABC):
+    """Abstract class for the compatibility store backends."""
+
+    def __init__(self):
+        self.listeners: list[Callable[[], None]] = []
+
+    @abstractmethod
+    def get(self, gav: str) -> list[str]:
+        """Returns the compatible versions of the given GAV, or an empty list if the GAV is not in the store."""
+        pass
+
+    @abstractmethod
+    def add(self, gav: str, versions: Iterable[str]):
+        """Adds the given versions to the compatible versions of the given GAV."""
+        pass
+
+    @abstractmethod
+    def replace(self, compatibilities: dict[str, Iterable[str]]):
+        """Replaces the full content of the store with the given compatibilities."""
+        pass
+
+    @abstractmethod
+    def items(self) -> dict[str, list[str]]:
+        """Returns the full content of the store."""
+        pass
+
+    @abstractmethod
+    def files(self) -> list[Path]:
+        """Returns the files backing the store, used to detect changes made by other processes."""
+        pass
+
+    def update(self, compatibilities: dict[str, Iterable[str]]):
+        for gav, versions in compatibilities.items():
+            self.add(gav, versions)
+
+    def subscribe(self, listener: Callable[[], None]):
+        """Registers a callback that is called whenever this process writes to the store."""
+        self.listeners.append(listener)
+
+    def notify(self):
+        for listener in self.listeners:
+            listener()
+
+    def change_token(self) -> tuple:
+        """Returns a token that changes whenever the files backing the store are modified."""
+        token = []
+        for path in self.files():
+            try:
+                stat = os.stat(path)
+                token.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                token.append(None)
+        return tuple(token)
+
+    def __contains__(self, gav: str) -> bool:
+        return bool(self.get(gav))
+
+
+class JsonCompatibilityStore(CompatibilityStore):
+    """Compatibility store kept in a single JSON file, read in full on every lookup."""
+
+    def __init__(self, path: Path = COMPATIBILITY_STORE):
+        super().__init__()
+        self.path = Path(path)
+
+    def get(self, gav: str) -> list[str]:
+        return list(self.items().get(gav, []))
+
+    def add(self, gav: str, versions: Iterable[str]):
+        self.update({gav: versions})
+
+    def update(self, compatibilities: dict[str, Iterable[str]]):
+        with self.lock():
+            store = self.items()
+            for gav, versions in compatibilities.items():
+                stored = set(store.get(gav, []))
+                stored.update(versions)
+                store[gav] = sorted(stored)
+            self.write(store)
+        self.notify()
+
+    def replace(self, compatibilities: dict[str, Iterable[str]]):
+        with self.lock():
+            self.write({gav: sorted(set(versions)) for gav, versions in compatibilities.items()})
+        self.notify()
+
+    def items(self) -> dict[str, list[str]]:
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def files(self) -> list[Path]:
+        return [self.path]
+
+    def write(self, store: dict[str, list[str]]):
+        """Replaces the file atomically so that concurrent readers never observe a partially written store."""
+        with atomic_write(self.path) as f:
+            json.dump(store, f, indent=4)
+
+    @contextmanager
+    def lock(self):
+        """Serializes writers across processes."""
+        os.makedirs(self.path.parent, exist_ok=True)
+        with open(f"{self.path}.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class SqliteCompatibilityStore(CompatibilityStore):
+    """
+    Compatibility store kept in an indexed SQLite table with one row per (gav, version).
+    WAL mode allows any number of concurrent readers next to a single writer.
+    """
+
+    def __init__(self, path: Path = COMPATIBILITY_STORE_DB):
+        super().__init__()
+        self.path = Path(path)
+        self.connections = ThreadLocalConnection(self.path, pragmas=["journal_mode=WAL", "synchronous=NORMAL"])
+        os.makedirs(self.path.parent, exist_ok=True)
+        with self.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS compatibilities ("
+                         "gav TEXT NOT NULL, version TEXT NOT NULL, PRIMARY KEY (gav, version)) WITHOUT ROWID")
+
+    def connection(self) -> sqlite3.Connection:
+        return self.connections.get()
+
+    def get(self, gav: str) -> list[str]:
+        rows = self.connection().execute("SELECT version FROM compatibilities WHERE gav = ?", (gav,)).fetchall()
+        return [row[0] for row in rows]
+
+    def add(self, gav: str, versions: Iterable[str]):
+        self.update({gav: versions})
+
+    def update(self, compatibilities: dict[str, Iterable[str]]):
+        rows = [(gav, v) for gav, versions in compatibilities.items() for v in versions]
+        with self.connection() as conn:
+            conn.executemany("INSERT OR IGNORE INTO compatibilities (gav, version) VALUES (?, ?)", rows)
+        self.notify()
+
+    def replace(self, compatibilities: dict[str, Iterable[str]]):
+        rows = [(gav, v) for gav, versions in compatibilities.items() for v in versions]
+        with self.connection() as conn:  # A single transaction, readers see either the old or the new content
+            conn.execute("DELETE FROM compatibilities")
+            conn.executemany("INSERT OR IGNORE INTO compatibilities (gav, version) VALUES (?, ?)", rows)
+        self.notify()
+
+    def items(self) -> dict[str, list[str]]:
+        store = {}
+        for gav, version in self.connection().execute("SELECT gav, version FROM compatibilities"):
+            store.setdefault(gav, []).append(version)
+        return store
+
+    def files(self) -> list[Path]:
+        return [self.path, Path(f"{self.path}-wal")]
+
+    def is_empty(self) -> bool:
+        return self.connection().execute("SELECT 1 FROM compatibilities LIMIT 1").fetchone() is None
+
+    def close(self):
+        self.connections.close()
+
+
+class CompatibilityIndex:
+    """
+    Hot in-memory copy of a compatibility store. It is dropped when the store notifies of a write in this process, and
+    reloaded when the modification time of the store's files changes due to writes from other processes.
+    """
+
+    def __init__(self, store: CompatibilityStore):
+        self.store = store
+        self.index: Optional[dict[str, list[str]]] = None
+        self.token = None
+        self.lock = threading.Lock()
+        store.subscribe(self.invalidate)
+
+    def invalidate(self):
+        with self.lock:
+            self.index = None
+
+    def refresh(self) -> dict[str, list[str]]:
+        with self.lock:
+            token = self.store.change_token()
+            if self.index is None or token != self.token:
+                self.index = {gav: sorted(versions) for gav, versions in self.store.items().items()}
+                self.token = token
+            return self.index
+
+    def get(self, gav: str) -> list[str]:
+        return self.refresh().get(gav, [])
+
+    def get_many(self, gavs: Iterable[str]) -> dict[str, list[str]]:
+        index = self.refresh()
+        return {gav: index.get(gav, []) for gav in gavs}
+
+
+def migrate_json_store(json_path: Path, store: CompatibilityStore) -> int:
+    """Copies the content of the JSON compatibility store into the given store, returns the number of GAVs."""
+    compatibilities = JsonCompatibilityStore(json_path).items()
+    store.update(compatibilities)
+    print(f"Migrated {len(compatibilities)} GAVs from {json_path}")
+    return len(compatibilities)
+
+
+stores: dict[tuple[str, Path], CompatibilityStore] = {}
+stores_lock = threading.Lock()
+
+
+def get_compatibility_store(backend: Optional[str] = None, path: Optional[Path] = None) -> CompatibilityStore:
+    """
+    Returns the compatibility store of the given (or configured) backend. The first time an empty SQLite store is
+    opened next to an existing JSON store, the JSON store is migrated into it.
+    """
+    backend = backend or COMPATIBILITY_STORE_BACKEND
+    if backend == "json":
+        path = Path(path or COMPATIBILITY_STORE)
+    elif backend == "sqlite":
+        path = Path(path or COMPATIBILITY_STORE_DB)
+    else:
+        raise ValueError(f"backend must be 'json' or 'sqlite', but was {backend}")
+
+    with stores_lock:
+        if (backend, path) not in stores:
+            if backend == "json":
+                store = JsonCompatibilityStore(path)
+            else:
+                store = SqliteCompatibilityStore(path)
+                json_path = path.with_suffix(".json")
+                if store.is_empty() and os.path.isfile(json_path):
+                    migrate_json_store(json_path, store)
+            stores[(backend, path)] = store
+        return stores[(backend, path)]
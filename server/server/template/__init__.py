@@ -1,3 +1,4 @@
+import hashlib
 import json
 import os
 import pathlib
@@ -9,8 +10,16 @@ from github import Repository
 
 from core import (get_github_session, PomNotFoundException,
                   get_github_repo_and_tag)
-from server.config import download_repo
+from server.blob_store import deduplicate_directory
+from server.config import download_repo, path_lock, BLOB_STORE, BLOB_STORE_DIR
 from server.exceptions import GithubRepoNotFoundException, GithubTagNotFoundException
+from server.persistence import atomic_write
+from server.storage import get_storage_manager
+from server.template_registry import pull_template, push_template
+from server.test_selection import get_file_hashes
+
+
+build_locks: dict[Path, list] = {}
 
 
 class Template(ABC):
@@ -46,16 +55,33 @@ class Template(ABC):
             # Sets repo_name, tag_name, commit_sha, and returns Repository
             repo: Repository = self.get_github_metadata(pom_path=pom_path)
 
-        if not self.template_exists():
-            if repo_storage_path:
-                self.repo_path: Path = download_repo(repo, storage_path=repo_storage_path)  # Downloads repo (unless it exists) and returns its path
-            else:
-                self.repo_path: Path = download_repo(repo)  # Downloads repo (unless it exists) and returns its path
-            module_path = self.repo_path / self.artifact_id
-            if Path.is_dir(module_path):
-                self.repo_path = module_path
-                print(f"Found module path, repo_path={self.repo_path}")
+        storage = get_storage_manager()
+        storage.touch(self.path)
+        # Templates may be built by several threads, e.g. ahead of their tests by server.pipeline
+        with path_lock(build_locks, self.path):
+            if not self.template_exists():
+                # Another node may already have built the template
+                pull_template(self.base_dir.name, self.gav, templates_dir=self.base_dir)
+            if not self.template_exists():
+                self.build_template(repo, repo_storage_path, storage)
+
+    def build_template(self, repo: Repository, repo_storage_path, storage):
+        storage.enforce_budget()  # Make room for the template and possibly the clone before building it
+        if repo_storage_path:
+            self.repo_path: Path = download_repo(repo, storage_path=repo_storage_path)  # Downloads repo (unless it exists) and returns its path
+        else:
+            self.repo_path: Path = download_repo(repo)  # Downloads repo (unless it exists) and returns its path
+        clone_path = self.repo_path
+        module_path = self.repo_path / self.artifact_id
+        if Path.is_dir(module_path):
+            self.repo_path = module_path
+            print(f"Found module path, repo_path={self.repo_path}")
+        with storage.in_use(self.path), storage.in_use(clone_path):
             self.prepare_template()  # Generate test files and move them into the template
+            if BLOB_STORE:
+                self.deduplicate()
+        storage.update_size(self.path)
+        push_template(self.path, self.base_dir.name)
 
     @abstractmethod
     def template_exists(self) -> bool:
@@ -73,9 +99,14 @@ class Template(ABC):
     def prepare_template(self):
         pass
 
+    def deduplicate(self):
+        """Moves the compiled classes of the template into the blob store, writing their manifests."""
+        for classes_dir in ["classes", "test-classes"]:
+            if os.path.isdir(self.target_path / classes_dir):
+                deduplicate_directory(self.target_path / classes_dir, BLOB_STORE_DIR)
+
     def get_or_create_template_dir(self) -> Path:
         """Creates <base_dir>/gav/target/ if it does not already exist and returns the path to <base_dir>/gav"""
-        old_dir = os.getcwd()
         gav = f"{self.group_id}:{self.artifact_id}:{self.version}"
         template_path = pathlib.Path.joinpath(self.base_dir, gav)
 
@@ -83,12 +114,9 @@ class Template(ABC):
         if os.path.isdir(template_path):
             return template_path
 
-        # Otherwise, create the template and return the path
-        os.chdir(self.base_dir)
-        os.mkdir(gav)
-        os.chdir(template_path)
-        os.mkdir("target")
-        os.chdir(old_dir)
+        # Otherwise, create the template and return the path. The working directory is left alone, as it is shared by
+        # the threads building templates
+        os.makedirs(pathlib.Path.joinpath(template_path, "target"), exist_ok=True)
 
         return template_path
 
@@ -138,9 +166,22 @@ def read_template_metadata(path: Path):
 
 
 def write_template_metadata(repo_name: str, tag_name: str, commit_sha: str, path: Path):
-    metadata = {
-        'repo_name': repo_name, 'tag_name': tag_name, 'commit_sha': commit_sha
-    }
-    with open(pathlib.Path.joinpath(path, "_metadata.json"), 'w') as f:
+    update_template_metadata(path, repo_name=repo_name, tag_name=tag_name, commit_sha=commit_sha)
+
+
+def update_template_metadata(path: Path, **values):
+    """Sets the given keys in the template's _metadata.json, keeping all other keys."""
+    filepath = pathlib.Path.joinpath(path, "_metadata.json")
+    metadata = read_template_metadata(path) if os.path.isfile(filepath) else {}
+    metadata.update(values)
+    with atomic_write(filepath) as f:
         json.dump(metadata, f, indent=4)
 
+
+def fingerprint_directory(path: Path) -> str:
+    """Returns a hash over the relative paths and contents of all files in the given directory."""
+    fingerprint = hashlib.sha1()
+    for filename, file_hash in sorted(get_file_hashes(path).items()):
+        fingerprint.update(f"{filename}\0{file_hash}\n".encode())
+    return fingerprint.hexdigest()
+
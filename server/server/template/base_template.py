@@ -11,7 +11,8 @@ from server.config import BASE_TEMPLATES_DIR, COMPILE_TIMEOUT, TEST_TIMEOUT
 from server.exceptions import (GithubRepoNotFoundException, MavenSurefireTestFailedException,
                                MavenNoPomInDirectoryException, BaseMavenCompileTimeout, BaseMavenTestTimeout,
                                MavenCompileFailedException, MavenResolutionFailedException)
-from server.template import Template
+from server.repo_utils import checkout_worktree
+from server.template import Template, read_template_metadata, update_template_metadata
 from server.test_failure import at_least_one_passing_test
 
 
@@ -32,6 +33,17 @@ class BaseTemplate(Template):
     def get_base_dir(self) -> Path:
         return BASE_TEMPLATES_DIR
 
+    def get_compatible_fingerprints(self) -> set[str]:
+        """Returns the fingerprints of the candidate classes that were proven dynamically compatible with this base."""
+        if not os.path.isfile(self.path / "_metadata.json"):
+            return set()
+        return set(read_template_metadata(self.path).get('compatible_fingerprints', []))
+
+    def add_compatible_fingerprint(self, fingerprint: str):
+        fingerprints = self.get_compatible_fingerprints()
+        if fingerprint not in fingerprints:
+            update_template_metadata(self.path, compatible_fingerprints=sorted(fingerprints | {fingerprint}))
+
     def get_preexisting_github_metadata(self) -> Optional[Repository]:
         if os.path.isdir(pathlib.Path.joinpath(self.target_path, "test-classes")):
             if os.path.isdir(pathlib.Path.joinpath(self.target_path, "surefire-reports_BASE")):  # TODO: remove
@@ -45,52 +57,39 @@ class BaseTemplate(Template):
         return None
 
     def prepare_template(self):
-        # Compile test classes and sources of the base and move them to temp/target/
-        old_dir = os.getcwd()
-        os.chdir(self.repo_path)
-        subprocess.run(["git", "checkout", "-f", self.commit_sha])
-        print("Running mvn clean test-compile...")
-        try:
-            out = subprocess.run(["mvn", "clean", "test-compile", "-Dspotbugs.skip=true",
-                                  "-Dspotless.check.skip=true", "-Dspotless.apply.skip=true"],
-                                 stdout=subprocess.PIPE, universal_newlines=True, timeout=COMPILE_TIMEOUT)
-            if "there is no POM in this directory" in out.stdout:
-                os.chdir(old_dir)
-                raise MavenNoPomInDirectoryException(f"Found no POM for base {self.gav}")
-            elif "Could not resolve dependencies" in out.stdout:
-                os.chdir(old_dir)
-                raise MavenResolutionFailedException(f"Failed to resolve dependencies for base {self.gav}")
-            elif "Compilation failure" in out.stdout or "Fatal error compiling" in out.stdout:
-                os.chdir(old_dir)
-                raise MavenCompileFailedException(f"Failed to compile for base {self.gav}")
-            elif "BUILD FAILURE" in out.stdout:
-                os.chdir(old_dir)
-                raise MavenCompileFailedException(f"Failed to compile for base {self.gav}")
-        except subprocess.TimeoutExpired:
-            os.chdir(old_dir)
-            raise BaseMavenCompileTimeout(f"mvn clean compile lasted more than {COMPILE_TIMEOUT}s")
+        # Compile test classes and sources of the base in a worktree of the commit and move them to the template
+        with checkout_worktree(self.repo_path, self.commit_sha, self.tag_name) as work_dir:
+            print("Running mvn clean test-compile...")
+            try:
+                out = subprocess.run(["mvn", "clean", "test-compile", "-Dspotbugs.skip=true",
+                                      "-Dspotless.check.skip=true", "-Dspotless.apply.skip=true"], cwd=work_dir,
+                                     stdout=subprocess.PIPE, universal_newlines=True, timeout=COMPILE_TIMEOUT)
+                if "there is no POM in this directory" in out.stdout:
+                    raise MavenNoPomInDirectoryException(f"Found no POM for base {self.gav}")
+                elif "Could not resolve dependencies" in out.stdout:
+                    raise MavenResolutionFailedException(f"Failed to resolve dependencies for base {self.gav}")
+                elif "Compilation failure" in out.stdout or "Fatal error compiling" in out.stdout:
+                    raise MavenCompileFailedException(f"Failed to compile for base {self.gav}")
+                elif "BUILD FAILURE" in out.stdout:
+                    raise MavenCompileFailedException(f"Failed to compile for base {self.gav}")
+            except subprocess.TimeoutExpired:
+                raise BaseMavenCompileTimeout(f"mvn clean compile lasted more than {COMPILE_TIMEOUT}s")
 
-        try:
-            out = subprocess.run(["mvn", "surefire:test"],
-                                 stdout=subprocess.PIPE, universal_newlines=True, timeout=TEST_TIMEOUT)
-            if "No tests to run" in out.stdout or "Tests are skipped" in out.stdout:
-                os.chdir(old_dir)
-                raise MavenSurefireTestFailedException(f"Found no running tests for base {self.gav}")
-        except subprocess.TimeoutExpired:
-            os.chdir(old_dir)
-            raise BaseMavenTestTimeout(f"mvn surefire:test lasted more than {TEST_TIMEOUT}s")
-        print("Done.")
+            try:
+                out = subprocess.run(["mvn", "surefire:test"], cwd=work_dir,
+                                     stdout=subprocess.PIPE, universal_newlines=True, timeout=TEST_TIMEOUT)
+                if "No tests to run" in out.stdout or "Tests are skipped" in out.stdout:
+                    raise MavenSurefireTestFailedException(f"Found no running tests for base {self.gav}")
+            except subprocess.TimeoutExpired:
+                raise BaseMavenTestTimeout(f"mvn surefire:test lasted more than {TEST_TIMEOUT}s")
+            print("Done.")
 
-        surefire_path = pathlib.Path.joinpath(self.repo_path).resolve() / "target" / "surefire-reports"
-        if not at_least_one_passing_test(surefire_path):
-            os.chdir(old_dir)
-            raise MavenSurefireTestFailedException(f"Found no running tests for base {self.gav}")
-        try:
-            subprocess.run(["mv", "target/generated-test-sources", self.target_path])
-        except Exception:
-            pass
-        subprocess.run(["mv", "target/test-classes", self.target_path])
-        subprocess.run(["mv", "target/surefire-reports", pathlib.Path.joinpath(self.target_path,
-                                                                               "surefire-reports_BASE")])
-        subprocess.run(["cp", "pom.xml", self.path])
-        os.chdir(old_dir)
+            work_target = pathlib.Path.joinpath(work_dir, "target")
+            if not at_least_one_passing_test(work_target / "surefire-reports"):
+                raise MavenSurefireTestFailedException(f"Found no running tests for base {self.gav}")
+            if os.path.isdir(work_target / "generated-test-sources"):
+                subprocess.run(["mv", work_target / "generated-test-sources", self.target_path])
+            subprocess.run(["mv", work_target / "test-classes", self.target_path])
+            subprocess.run(["mv", work_target / "surefire-reports", pathlib.Path.joinpath(self.target_path,
+                                                                                          "surefire-reports_BASE")])
+            subprocess.run(["cp", work_dir / "pom.xml", self.path])
@@ -11,7 +11,8 @@ from server.config import CAND_TEMPLATES_DIR, COMPILE_TIMEOUT
 from server.exceptions import (GithubRepoNotFoundException, MavenCompileFailedException,
                                MavenNoPomInDirectoryException, CandidateMavenCompileTimeout,
                                MavenResolutionFailedException)
-from server.template import Template
+from server.repo_utils import checkout_worktree
+from server.template import Template, fingerprint_directory, read_template_metadata, update_template_metadata
 
 
 class CandidateTemplate(Template):
@@ -29,6 +30,15 @@ class CandidateTemplate(Template):
     def get_base_dir(self) -> Path:
         return CAND_TEMPLATES_DIR
 
+    def get_classes_fingerprint(self) -> str:
+        """Returns the content fingerprint of target/classes, computed once and stored in _metadata.json."""
+        metadata = read_template_metadata(self.path) if os.path.isfile(self.path / "_metadata.json") else {}
+        fingerprint = metadata.get('classes_fingerprint')
+        if fingerprint is None:
+            fingerprint = fingerprint_directory(pathlib.Path.joinpath(self.target_path, "classes"))
+            update_template_metadata(self.path, classes_fingerprint=fingerprint)
+        return fingerprint
+
     def get_preexisting_github_metadata(self) -> Optional[Repository]:
         if os.path.isdir(pathlib.Path.joinpath(self.target_path, "classes")):
             if os.path.isfile(pathlib.Path.joinpath(self.path, "_metadata.json")):
@@ -41,38 +51,28 @@ class CandidateTemplate(Template):
         return None
 
     def prepare_template(self):
-        # Compile test classes and sources of the base and move them to temp/target/
-        old_dir = os.getcwd()
-        os.chdir(self.repo_path)
-        subprocess.run(["git", "checkout", "-f", self.commit_sha])
-        try:
-            out = subprocess.run(["mvn", "clean", "test-compile", "-Dspotbugs.skip=true", "-Dspotless.check.skip=true", "-Dspotless.apply.skip=true"],
-                                 stdout=subprocess.PIPE, universal_newlines=True, timeout=COMPILE_TIMEOUT)
-            if "there is no POM in this directory" in out.stdout:
-                os.chdir(old_dir)
-                raise MavenNoPomInDirectoryException(f"Found no POM for candidate {self.gav}")
-            elif "Could not resolve dependencies" in out.stdout:
-                os.chdir(old_dir)
-                raise MavenResolutionFailedException(f"Failed to resolve dependencies for candidate {self.gav}")
-            elif "Compilation failure" in out.stdout or "Fatal error compiling" in out.stdout:
-                os.chdir(old_dir)
-                raise MavenCompileFailedException(f"Failed to compile for candidate {self.gav}")
-            elif "BUILD FAILURE" in out.stdout:
-                os.chdir(old_dir)
-                raise MavenCompileFailedException(f"Failed to compile for base {self.gav}")
-        except subprocess.TimeoutExpired:
-            os.chdir(old_dir)
-            raise CandidateMavenCompileTimeout(f"mvn clean test-compile lasted more than {COMPILE_TIMEOUT}s")
+        # Compile the classes and sources of the candidate in a worktree of the commit and move them to the template
+        with checkout_worktree(self.repo_path, self.commit_sha, self.tag_name) as work_dir:
+            try:
+                out = subprocess.run(["mvn", "clean", "test-compile", "-Dspotbugs.skip=true",
+                                      "-Dspotless.check.skip=true", "-Dspotless.apply.skip=true"], cwd=work_dir,
+                                     stdout=subprocess.PIPE, universal_newlines=True, timeout=COMPILE_TIMEOUT)
+                if "there is no POM in this directory" in out.stdout:
+                    raise MavenNoPomInDirectoryException(f"Found no POM for candidate {self.gav}")
+                elif "Could not resolve dependencies" in out.stdout:
+                    raise MavenResolutionFailedException(f"Failed to resolve dependencies for candidate {self.gav}")
+                elif "Compilation failure" in out.stdout or "Fatal error compiling" in out.stdout:
+                    raise MavenCompileFailedException(f"Failed to compile for candidate {self.gav}")
+                elif "BUILD FAILURE" in out.stdout:
+                    raise MavenCompileFailedException(f"Failed to compile for base {self.gav}")
+            except subprocess.TimeoutExpired:
+                raise CandidateMavenCompileTimeout(f"mvn clean test-compile lasted more than {COMPILE_TIMEOUT}s")
 
-        classes_path = pathlib.Path.joinpath(self.repo_path).resolve() / "target" / "classes"
-        if not os.path.isdir(classes_path):
-            os.chdir(old_dir)
-            raise MavenCompileFailedException(f"Failed to compile {self.gav}")
+            work_target = pathlib.Path.joinpath(work_dir, "target")
+            if not os.path.isdir(work_target / "classes"):
+                raise MavenCompileFailedException(f"Failed to compile {self.gav}")
 
-        try:
-            subprocess.run(["mv", "target/generated-sources", self.target_path])
-        except Exception:
-            pass
-        subprocess.run(["mv", "target/classes", self.target_path])
-        subprocess.run(["cp", "pom.xml", self.path])
-        os.chdir(old_dir)
+            if os.path.isdir(work_target / "generated-sources"):
+                subprocess.run(["mv", work_target / "generated-sources", self.target_path])
+            subprocess.run(["mv", work_target / "classes", self.target_path])
+            subprocess.run(["cp", work_dir / "pom.xml", self.path])
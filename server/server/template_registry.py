@@ -0,0 +1,265 @@
+"""
+Module containing the template registry, through which nodes share the templates they built so that every GAV is built
+only once in a cluster-wide sweep. A template is shared as a bundle: a tar.gz of the template directory, including its
+_metadata.json, and a bundle.json with a manifest of the sha1 of every file and the fingerprint of the toolchain that
+built it. Bundles are stored as <toolchain>/<kind>/<gav>.tar.gz in a shared directory or behind the server's /templates
+endpoint, so that nodes only pull templates compiled by the same JDK and Maven.
+"""
+import argparse
+import functools
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+import requests
+
+from core import HTTP_headers
+from server.blob_store import hash_file, read_manifest, deduplicate_directory
+from server.config import (TEMPLATE_REGISTRY, BLOB_STORE, BLOB_STORE_DIR, BASE_TEMPLATES_DIR, CAND_TEMPLATES_DIR)
+from server.maven_repository import store_artifact
+from server.persistence import atomic_write
+
+BUNDLE_FORMAT = 1
+TOOLCHAIN_COMMANDS = [["java", "-version"], ["mvn", "-version"]]
+TEMPLATE_KINDS = {"base_templates": BASE_TEMPLATES_DIR, "cand_templates": CAND_TEMPLATES_DIR}
+GAV_PATTERN = re.compile(r"[\w.-]+:[\w.-]+:[\w.+-]+")  # A plain g:a:v, bundles name the directory they unpack into
+
+
+@functools.cache
+def get_toolchain_fingerprint(commands: tuple[tuple[str, ...], ...] = tuple(map(tuple, TOOLCHAIN_COMMANDS))) -> str:
+    """Returns a hash over the versions of the JDK and Maven building the templates, as they determine the bytecode."""
+    fingerprint = hashlib.sha1()
+    for command in commands:
+        try:
+            out = subprocess.run(list(command), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                 universal_newlines=True, timeout=60)
+            # Only the version lines, mvn -version also prints the locale and other machine specific details
+            version = "\n".join(line for line in out.stdout.splitlines() if "version" in line.lower())
+        except (OSError, subprocess.TimeoutExpired):
+            version = "missing"
+        fingerprint.update(f"{' '.join(command)}\0{version}\n".encode())
+    return fingerprint.hexdigest()[:16]
+
+
+def get_bundle_name(toolchain: str, kind: str, gav: str) -> str:
+    return f"{toolchain}/{kind}/{gav}.tar.gz"
+
+
+def get_template_hashes(template_path: Path, use_manifests: bool = True) -> dict[str, str]:
+    """Returns the sha1 of every file in the template, taking those of deduplicated directories from their manifest."""
+    hashes = {}
+    for dirpath, dirnames, filenames in os.walk(template_path):
+        for dirname in list(dirnames) if use_manifests else []:
+            manifest = read_manifest(Path(dirpath) / dirname)
+            if manifest is not None:
+                prefix = (Path(dirpath) / dirname).relative_to(template_path).as_posix()
+                hashes.update({f"{prefix}/{filename}": sha1 for filename, sha1 in manifest.items()})
+                dirnames.remove(dirname)
+        for filename in filenames:
+            if not filename.endswith(".part"):
+                path = Path(dirpath) / filename
+                hashes[path.relative_to(template_path).as_posix()] = hash_file(path)
+    return hashes
+
+
+def export_template(template_path: Path, kind: str, bundle_path: Path, toolchain: Optional[str] = None) -> dict:
+    """
+    Writes the template at template_path into a bundle at bundle_path.
+    :return: the bundle's bundle.json
+    """
+    template_path = Path(template_path)
+    hashes = get_template_hashes(template_path)
+    info = {
+        'format': BUNDLE_FORMAT,
+        'kind': kind,
+        'gav': template_path.name,
+        'toolchain': toolchain or get_toolchain_fingerprint(),
+        'created': time.time(),
+        'manifest': hashes,
+    }
+    with atomic_write(bundle_path, 'wb') as f, tarfile.open(fileobj=f, mode="w:gz") as tar:
+        data = json.dumps(info, indent=1).encode()
+        member = tarfile.TarInfo("bundle.json")
+        member.size = len(data)
+        member.mtime = int(info['created'])
+        tar.addfile(member, io.BytesIO(data))
+        for filename in sorted(hashes):
+            tar.add(template_path / filename, arcname=f"template/{filename}", recursive=False)
+    return info
+
+
+def read_bundle_info(bundle_path: Path) -> dict:
+    with tarfile.open(bundle_path, mode="r:gz") as tar:
+        return json.load(tar.extractfile("bundle.json"))
+
+
+def import_template(bundle_path: Path, templates_dir: Optional[Path] = None, toolchain: Optional[str] = None,
+                    blob_store_dir: Path = BLOB_STORE_DIR) -> bool:
+    """
+    Unpacks the bundle into <templates_dir>/<gav>, replacing what is there, after checking its toolchain and contents.
+    :param templates_dir: directory of the templates of the bundle's kind by default
+    :param blob_store_dir: blob store the classes are deduplicated into, must be on the file system of templates_dir
+    :return: False if the bundle was built by another toolchain or its contents do not match its manifest
+    """
+    info = read_bundle_info(bundle_path)
+    if info['toolchain'] != (toolchain or get_toolchain_fingerprint()):
+        print(f"Bundle {bundle_path} was built by another toolchain, not importing it")
+        return False
+    if info['kind'] not in TEMPLATE_KINDS or not GAV_PATTERN.fullmatch(info['gav']) or ".." in info['gav']:
+        print(f"Bundle {bundle_path} is not a template of a GAV, not importing it")
+        return False
+    templates_dir = Path(templates_dir or TEMPLATE_KINDS[info['kind']])
+    if (templates_dir / info['gav']).resolve().parent != templates_dir.resolve():
+        print(f"Bundle {bundle_path} would be imported outside of {templates_dir}, not importing it")
+        return False
+    os.makedirs(templates_dir, exist_ok=True)
+    temp_dir = Path(tempfile.mkdtemp(dir=templates_dir, prefix=".import-"))
+    try:
+        with tarfile.open(bundle_path, mode="r:gz") as tar:
+            tar.extractall(temp_dir, filter="data")
+        extracted = temp_dir / "template"
+        os.makedirs(extracted / "target", exist_ok=True)
+        if get_template_hashes(extracted, use_manifests=False) != info['manifest']:
+            print(f"Contents of bundle {bundle_path} do not match its manifest, not importing it")
+            return False
+
+        template_path = templates_dir / info['gav']
+        if os.path.isdir(template_path):
+            os.rename(template_path, temp_dir / "replaced")
+        os.rename(extracted, template_path)
+        if BLOB_STORE:
+            for classes_dir in ["classes", "test-classes"]:
+                if os.path.isdir(template_path / "target" / classes_dir):
+                    deduplicate_directory(template_path / "target" / classes_dir, blob_store_dir)
+        print(f"Imported {info['gav']} from bundle {bundle_path}")
+        return True
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+class SharedDirectoryRegistry:
+    """Registry of bundles in a directory shared by the nodes, e.g. on NFS."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def pull(self, name: str, dest: Path) -> bool:
+        if not os.path.isfile(self.root / name):
+            return False
+        with open(self.root / name, 'rb') as f:
+            store_artifact(f, dest, write_checksums=False)
+        return True
+
+    def push(self, name: str, bundle_path: Path):
+        with open(bundle_path, 'rb') as f:
+            store_artifact(f, self.root / name, write_checksums=False)
+
+
+class HttpRegistry:
+    """Registry of bundles behind the /templates endpoint of a server."""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+
+    def pull(self, name: str, dest: Path) -> bool:
+        try:
+            with requests.get(f"{self.url}/{name}", headers=HTTP_headers, stream=True, timeout=60) as response:
+                if response.status_code != 200:
+                    return False
+                store_artifact(response.raw, dest, write_checksums=False)
+                return True
+        except requests.RequestException as e:
+            print(f"Could not pull {name} from the template registry: {e}")
+            return False
+
+    def push(self, name: str, bundle_path: Path):
+        with open(bundle_path, 'rb') as f:
+            response = requests.put(f"{self.url}/{name}", data=f, headers=HTTP_headers, timeout=600)
+        response.raise_for_status()
+
+
+def get_template_registry(location: Optional[str] = TEMPLATE_REGISTRY):
+    """Returns the registry at the given directory or http(s) URL, or None if no registry is configured."""
+    if not location:
+        return None
+    if str(location).startswith(("http://", "https://")):
+        return HttpRegistry(str(location))
+    return SharedDirectoryRegistry(Path(location))
+
+
+def pull_template(kind: str, gav: str, registry=None, templates_dir: Optional[Path] = None,
+                  blob_store_dir: Path = BLOB_STORE_DIR) -> bool:
+    """Imports the template of GAV from the registry, returns False if the registry has no usable bundle of it."""
+    registry = registry or get_template_registry()
+    if registry is None:
+        return False
+    toolchain = get_toolchain_fingerprint()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        bundle_path = Path(temp_dir) / "bundle.tar.gz"
+        if not registry.pull(get_bundle_name(toolchain, kind, gav), bundle_path):
+            return False
+        try:
+            info = read_bundle_info(bundle_path)
+            if info['kind'] != kind or info['gav'] != gav:
+                print(f"Bundle of {kind}/{gav} in the template registry holds {info['kind']}/{info['gav']}, "
+                      f"not importing it")
+                return False
+            return import_template(bundle_path, templates_dir, toolchain, blob_store_dir)
+        except (tarfile.TarError, KeyError, ValueError, OSError) as e:
+            print(f"Could not import the bundle of {gav} from the template registry: {e}")
+            return False
+
+
+def push_template(template_path: Path, kind: str, registry=None):
+    """Exports the template and pushes the bundle to the registry. Failures are logged, as sharing is best-effort."""
+    registry = registry or get_template_registry()
+    if registry is None:
+        return
+    toolchain = get_toolchain_fingerprint()
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            bundle_path = Path(temp_dir) / "bundle.tar.gz"
+            export_template(template_path, kind, bundle_path, toolchain)
+            registry.push(get_bundle_name(toolchain, kind, Path(template_path).name), bundle_path)
+    except (OSError, requests.RequestException) as e:
+        print(f"Could not push {template_path} to the template registry: {e}")
+
+
+def main(args: Optional[Iterable[str]] = None):
+    """
+    Example: server-templates export resources/base_templates/g:a:1.0 g:a:1.0.tar.gz
+             server-templates import g:a:1.0.tar.gz
+             server-templates push resources/base_templates/g:a:1.0 --registry http://server:5000/templates
+    """
+    cli = argparse.ArgumentParser(description='Export, import and share template bundles')
+    cli.add_argument('command', choices=['export', 'import', 'push', 'pull'])
+    cli.add_argument('paths', nargs='+', help='template dir and bundle (export), bundle (import), template dir (push) '
+                                              'or kind and GAV (pull)')
+    cli.add_argument('--registry', default=TEMPLATE_REGISTRY, help='directory or URL of the registry')
+    args = cli.parse_args(args)
+
+    if args.command == 'pull':
+        kind, gav = args.paths
+        print("Pulled" if pull_template(kind, gav, get_template_registry(args.registry)) else "Not found")
+        return
+    template_path = Path(args.paths[0]).resolve()
+    kind = template_path.parent.name
+    if args.command == 'export':
+        export_template(template_path, kind, Path(args.paths[1]))
+    elif args.command == 'import':
+        if not import_template(Path(args.paths[0])):
+            cli.exit(1)
+    elif args.command == 'push':
+        registry = get_template_registry(args.registry)
+        if registry is None:
+            cli.error("no registry given and TEMPLATE_REGISTRY is not set")
+        push_template(template_path, kind, registry)
@@ -1,8 +1,14 @@
 """Module containing logic related to the creation of TestFailures from surefire test reports."""
 import os
 import pathlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Optional
 from xml.etree import ElementTree
+
+from server.config import REPORT_PARSE_WORKERS, REPORT_PARSE_PARALLEL_THRESHOLD, REPORT_CACHE_SIZE
 # from lxml import etree as ET
 
 # TODO: refactor TestFailure into TestResult maybe?
@@ -29,39 +35,143 @@ class TestFailure:
         return f"TestFailure(suite={self.testsuite_name}, case={self.testcase_name}, class={self.testcase_classname})"
 
 
-def get_test_failures_from_file(path_to_filename: Path) -> set[TestFailure]:
-    """Parses the given .xml test report and creates TestFailures for each <testcase> with a <failure> or <error> tag"""
+class TestReport:
+    """Test results and failures parsed from one or more surefire test reports."""
+    __test__ = False   # To avoid being collected by pytest
+
+    def __init__(self):
+        self.results = {
+            'pass': 0,
+            'failure': 0,
+            'error': 0,
+            'skipped': 0,
+        }
+        self.failures: set[TestFailure] = set()
+
+    def update(self, other: "TestReport"):
+        for outcome, count in other.results.items():
+            self.results[outcome] += count
+        self.failures.update(other.failures)
+
+    def __repr__(self):
+        return f"TestReport({self.results}, failures={len(self.failures)})"
+
+
+# Parsed reports by path, kept as long as the size and modification time of the file are unchanged
+report_cache: OrderedDict[str, tuple[tuple[int, int], Optional[TestReport]]] = OrderedDict()
+report_cache_lock = threading.Lock()
+
+
+def parse_test_report(path_to_filename: Path) -> Optional[TestReport]:
+    """
+    Parses the given .xml test report in a single streaming pass, creating TestFailures for each <testcase> with a
+    <failure>, <error> or <skipped> tag. Test cases are cleared once processed to keep memory usage flat.
+    :return: the parsed report, or None if the report is malformed
+    """
     # TODO: can a report contain more than one testsuite (this code assumes not)? What happens then?
-    assert os.path.isfile(path_to_filename) and path_to_filename.suffix == ".xml"
+    report = TestReport()
+    testsuite_name = None
     try:
-        tree = ElementTree.parse(path_to_filename)
+        for event, element in ElementTree.iterparse(path_to_filename, events=("start", "end")):
+            if event == "start":
+                if testsuite_name is None:
+                    testsuite_name = element.get("name")
+                continue
+            if element.tag != "testcase":
+                continue
+
+            failure_type = ""
+            if element.find("failure") is not None:
+                failure_type = "failure"
+            elif element.find("error") is not None:
+                failure_type = "error"
+            elif element.find("skipped") is not None:
+                failure_type = "skipped"
+
+            if failure_type:
+                report.results[failure_type] += 1
+                report.failures.add(TestFailure(testsuite_name, element.get("name"), element.get("classname"),
+                                                failure_type))
+            else:
+                report.results['pass'] += 1
+            element.clear()
     except ElementTree.ParseError as e:
+        # This happens for orphan-oss/ognl/target/surefire-reports/TEST-org.ognl.test.NumericConversionTest.xml
         print(e)
-        return set()
+        return None
+    return report
+
 
-    root = tree.getroot()
-    testsuite_name = root.get("name")
-    testcases = root.findall("testcase")
+def get_cache_key(path_to_filename: Path) -> tuple[int, int]:
+    stat = os.stat(path_to_filename)
+    return stat.st_size, stat.st_mtime_ns
 
-    failures = set()
-    for testcase in testcases:
-        testcase_name = testcase.get("name")
-        testcase_classname = testcase.get("classname")
-        failure_subtag = testcase.find("failure")
-        error_subtag = testcase.find("error")
-        skipped_subtag = testcase.find("skipped")
 
-        failure_type = ""
-        if failure_subtag is not None:
-            failure_type = "failure"
-        elif error_subtag is not None:
-            failure_type = "error"
-        elif skipped_subtag is not None:
-            failure_type = "skipped"
-        if failure_type:
-            failures.add(TestFailure(testsuite_name, testcase_name, testcase_classname, failure_type))
+def get_cached_report(path_to_filename: Path, key: tuple[int, int]) -> tuple[bool, Optional[TestReport]]:
+    with report_cache_lock:
+        cached = report_cache.get(str(path_to_filename))
+        if cached is None or cached[0] != key:
+            return False, None
+        report_cache.move_to_end(str(path_to_filename))
+        return True, cached[1]
 
-    return failures
+
+def cache_report(path_to_filename: Path, key: tuple[int, int], report: Optional[TestReport]):
+    with report_cache_lock:
+        report_cache[str(path_to_filename)] = (key, report)
+        report_cache.move_to_end(str(path_to_filename))
+        while len(report_cache) > REPORT_CACHE_SIZE:
+            report_cache.popitem(last=False)
+
+
+def get_test_report_from_file(path_to_filename: Path) -> Optional[TestReport]:
+    """Returns the parsed .xml test report, reusing the previous result if the file did not change since."""
+    assert os.path.isfile(path_to_filename) and path_to_filename.suffix == ".xml"
+    key = get_cache_key(path_to_filename)
+    hit, report = get_cached_report(path_to_filename, key)
+    if not hit:
+        report = parse_test_report(path_to_filename)
+        cache_report(path_to_filename, key, report)
+    return report
+
+
+def get_test_report_from_dir(path_to_dir: Path, workers: int = REPORT_PARSE_WORKERS) -> TestReport:
+    """
+    Parses the test results and failures of the given surefire-reports directory. Reports missing from the cache are
+    parsed by a pool of worker processes when there are enough of them to make up for starting the pool.
+    """
+    assert os.path.isdir(path_to_dir)
+    overall_report = TestReport()
+    unparsed = []
+    for filename in sorted(os.listdir(path_to_dir)):
+        if not filename.endswith(".xml"):
+            continue
+        path_to_filename = pathlib.Path.joinpath(path_to_dir, filename)
+        key = get_cache_key(path_to_filename)
+        hit, report = get_cached_report(path_to_filename, key)
+        if not hit:
+            unparsed.append((path_to_filename, key))
+        elif report is not None:
+            overall_report.update(report)
+
+    paths = [path for path, _ in unparsed]
+    if workers > 1 and len(unparsed) >= REPORT_PARSE_PARALLEL_THRESHOLD:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            reports = list(executor.map(parse_test_report, paths, chunksize=max(1, len(paths) // (workers * 4))))
+    else:
+        reports = [parse_test_report(path) for path in paths]
+
+    for (path_to_filename, key), report in zip(unparsed, reports):
+        cache_report(path_to_filename, key, report)
+        if report is not None:
+            overall_report.update(report)
+    return overall_report
+
+
+def get_test_failures_from_file(path_to_filename: Path) -> set[TestFailure]:
+    """Parses the given .xml test report and creates TestFailures for each <testcase> with a <failure> or <error> tag"""
+    report = get_test_report_from_file(path_to_filename)
+    return set(report.failures) if report is not None else set()
 
 
 def at_least_one_passing_test(path_to_dir: Path) -> bool:
@@ -74,69 +184,16 @@ def at_least_one_passing_test(path_to_dir: Path) -> bool:
 
 def get_test_results_from_file(path_to_filename: Path) -> dict:
     """returns dict of tests results: {'pass': int, 'failure': int, 'error': int, 'skipped': int}"""
-    assert os.path.isfile(path_to_filename) and path_to_filename.suffix == ".xml"
-    try:
-        tree = ElementTree.parse(path_to_filename)
-    except ElementTree.ParseError as e:
-        print(e)
-        # This happens for orphan-oss/ognl/target/surefire-reports/TEST-org.ognl.test.NumericConversionTest.xml
-        return {}
-
-    root = tree.getroot()
-    testcases = root.findall("testcase")
-    results = {
-        'pass': 0,
-        'failure': 0,
-        'error': 0,
-        'skipped': 0,
-    }
-
-    for testcase in testcases:
-        failure_subtag = testcase.find("failure")
-        error_subtag = testcase.find("error")
-        skipped_subtag = testcase.find("skipped")
-
-        if failure_subtag is not None:
-            results['failure'] += 1
-        elif error_subtag is not None:
-            results['error'] += 1
-        elif skipped_subtag is not None:
-            results['skipped'] += 1
-        else:
-            results['pass'] += 1
-
-    return results
+    report = get_test_report_from_file(path_to_filename)
+    return dict(report.results) if report is not None else {}
 
 
 def get_test_results_from_dir(path_to_dir: Path) -> dict:
     """Parses test results from the given surefire-reports directory."""
-    assert os.path.isdir(path_to_dir)
-    overall_results = {
-        'pass': 0,
-        'failure': 0,
-        'error': 0,
-        'skipped': 0,
-    }
-    for filename in os.listdir(path_to_dir):
-        if filename.endswith(".xml"):
-            path_to_filename = pathlib.Path.joinpath(path_to_dir, filename)
-            single_results = get_test_results_from_file(path_to_filename)
-            if not single_results:
-                continue
-            overall_results['pass'] += single_results['pass']
-            overall_results['failure'] += single_results['failure']
-            overall_results['error'] += single_results['error']
-            overall_results['skipped'] += single_results['skipped']
-    return overall_results
+    return get_test_report_from_dir(path_to_dir).results
 
 
 def get_test_failures_from_dir(path_to_dir: Path) -> set[TestFailure]:
     """Parses TestFailures from the given surefire-reports directory."""
     print(f"get_test_results_from_dir with dir={path_to_dir}")
-    assert os.path.isdir(path_to_dir)
-    all_failures = set()
-    for filename in os.listdir(path_to_dir):
-        if filename.endswith(".xml"):
-            path_to_filename = pathlib.Path.joinpath(path_to_dir, filename)
-            all_failures.update(get_test_failures_from_file(path_to_filename))
-    return all_failures
+    return get_test_report_from_dir(path_to_dir).failures
@@ -0,0 +1,188 @@
+"""
+Module containing logic related to test impact selection, which restricts the base tests run against a candidate to
+the test classes that can reach a class whose bytecode differs between the base and the candidate.
+"""
+import hashlib
+import json
+import os
+import re
+import struct
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Optional
+
+from server.blob_store import read_manifest
+from server.config import TEST_SELECTION, TEST_SELECTION_MAX_FRACTION
+
+CLASS_MAGIC = 0xCAFEBABE
+# Size in bytes of the constant pool entries with a fixed size, by tag
+CONSTANT_SIZES = {3: 4, 4: 4, 5: 8, 6: 8, 7: 2, 8: 2, 9: 4, 10: 4, 11: 4, 12: 4, 15: 3, 16: 2, 17: 4, 18: 4, 19: 2, 20: 2}
+CONSTANT_UTF8 = 1
+CONSTANT_CLASS = 7
+CONSTANT_LONG = 5
+CONSTANT_DOUBLE = 6
+DESCRIPTOR_REFERENCE = re.compile(r"L([\w/$]+)[;<]")
+
+
+def get_class_references(path_to_class: Path) -> set[str]:
+    """
+    Reads the constant pool of the given .class file and returns the internal names (e.g. com/example/Foo) of all
+    classes it references, both as class constants and inside type descriptors and generic signatures. This
+    over-approximates the classes used, which is the safe direction for test selection. Constants inlined by javac
+    are not visible in the bytecode and hence not tracked.
+    """
+    with open(path_to_class, 'rb') as f:
+        data = f.read()
+    magic, _, _, constant_pool_count = struct.unpack_from(">IHHH", data, 0)
+    if magic != CLASS_MAGIC:
+        raise ValueError(f"{path_to_class} is not a class file")
+
+    offset = 10
+    utf8: dict[int, str] = {}
+    class_name_indices = []
+    index = 1
+    while index < constant_pool_count:
+        tag = data[offset]
+        if tag == CONSTANT_UTF8:
+            length = struct.unpack_from(">H", data, offset + 1)[0]
+            utf8[index] = data[offset + 3:offset + 3 + length].decode("utf-8", errors="replace")
+            offset += 3 + length
+        elif tag in CONSTANT_SIZES:
+            if tag == CONSTANT_CLASS:
+                class_name_indices.append(struct.unpack_from(">H", data, offset + 1)[0])
+            offset += 1 + CONSTANT_SIZES[tag]
+        else:
+            raise ValueError(f"Unknown constant pool tag {tag} in {path_to_class}")
+        index += 2 if tag in (CONSTANT_LONG, CONSTANT_DOUBLE) else 1  # Longs and doubles take up two entries
+
+    # Array classes such as [Lcom/example/Foo; are covered by the descriptor references
+    references = {utf8.get(name_index, "") for name_index in class_name_indices}
+    references = {name for name in references if not name.startswith("[")}
+    for string in utf8.values():
+        references.update(DESCRIPTOR_REFERENCE.findall(string))
+    references.discard("")
+    return references
+
+
+def get_class_name(classes_dir: Path, path_to_class: Path) -> str:
+    return path_to_class.relative_to(classes_dir).as_posix().removesuffix(".class")
+
+
+def get_file_hashes(classes_dir: Path) -> dict[str, str]:
+    """
+    Returns the sha1 of every file in the given directory, keyed by its path relative to the directory. The hashes of
+    deduplicated template directories are read from their manifest.
+    """
+    hashes = read_manifest(classes_dir)
+    if hashes is not None:
+        return hashes
+    hashes = {}
+    for dirpath, _, filenames in os.walk(classes_dir):
+        for filename in filenames:
+            path = Path(dirpath) / filename
+            with open(path, 'rb') as f:
+                hashes[path.relative_to(classes_dir).as_posix()] = hashlib.sha1(f.read()).hexdigest()
+    return hashes
+
+
+def get_changed_classes(base_classes: Path, cand_classes: Path) -> Optional[set[str]]:
+    """
+    Returns the internal names of the classes that were added, removed or whose bytecode changed between the base and
+    the candidate. Returns None if other files (e.g. resources) differ, as their impact cannot be traced.
+    """
+    base_hashes = get_file_hashes(base_classes)
+    cand_hashes = get_file_hashes(cand_classes)
+    changed = set()
+    for filename in base_hashes.keys() | cand_hashes.keys():
+        if base_hashes.get(filename) == cand_hashes.get(filename):
+            continue
+        if not filename.endswith(".class"):
+            return None
+        changed.add(filename.removesuffix(".class"))
+    return changed
+
+
+def build_dependency_index(classes_dir: Path) -> dict[str, list[str]]:
+    """Maps each class in the given directory to the classes it references."""
+    index = {}
+    for dirpath, _, filenames in os.walk(classes_dir):
+        for filename in filenames:
+            if filename.endswith(".class"):
+                path = Path(dirpath) / filename
+                index[get_class_name(classes_dir, path)] = sorted(get_class_references(path))
+    return index
+
+
+def get_dependency_index(classes_dir: Path, index_path: Path) -> dict[str, list[str]]:
+    """Returns the dependency index of the given directory, building it and storing it at index_path on first use."""
+    if os.path.isfile(index_path):
+        with open(index_path, 'r') as f:
+            return json.load(f)
+    index = build_dependency_index(classes_dir)
+    with open(index_path, 'w') as f:
+        json.dump(index, f)
+    return index
+
+
+def get_affected_classes(changed: set[str], *indices: dict[str, list[str]]) -> set[str]:
+    """Returns the classes that transitively reference one of the changed classes, including the changed classes."""
+    referenced_by = defaultdict(set)
+    for index in indices:
+        for name, references in index.items():
+            for reference in references:
+                referenced_by[reference].add(name)
+
+    affected = set(changed)
+    queue = deque(changed)
+    while queue:
+        for name in referenced_by[queue.popleft()]:
+            if name not in affected:
+                affected.add(name)
+                queue.append(name)
+    return affected
+
+
+def get_test_classes_of_reports(reports_dir: Path) -> set[str]:
+    """Returns the fully qualified names of the test classes that produced a report in the given surefire-reports dir."""
+    return {filename.removeprefix("TEST-").removesuffix(".xml") for filename in os.listdir(reports_dir)
+            if filename.startswith("TEST-") and filename.endswith(".xml")}
+
+
+def select_tests(base, baseline, candidate, enabled: bool = TEST_SELECTION,
+                 max_fraction: float = TEST_SELECTION_MAX_FRACTION) -> Optional[list[str]]:
+    """
+    Selects the base test classes that need to run to compare the candidate against the baseline, which is the
+    candidate template of the base version.
+    :param base: BaseTemplate providing test-classes and surefire-reports_BASE
+    :param baseline: CandidateTemplate of the base version
+    :param candidate: CandidateTemplate of the candidate version
+    :return: sorted fully qualified names of the selected test classes, or None if the full suite should run
+    """
+    if not enabled:
+        return None
+    test_classes_dir = base.target_path / "test-classes"
+    reports_dir = base.target_path / "surefire-reports_BASE"
+    if not os.path.isdir(test_classes_dir) or not os.path.isdir(reports_dir):
+        return None
+
+    try:
+        changed = get_changed_classes(baseline.target_path / "classes", candidate.target_path / "classes")
+        if changed is None:
+            print("Non-class files differ, running the full test suite")
+            return None
+        affected = get_affected_classes(
+            changed,
+            get_dependency_index(test_classes_dir, base.path / "_test_index.json"),
+            get_dependency_index(baseline.target_path / "classes", baseline.path / "_class_index.json"),
+            get_dependency_index(candidate.target_path / "classes", candidate.path / "_class_index.json"))
+    except (OSError, ValueError, struct.error) as e:
+        print(f"Test selection failed, running the full test suite: {e}")
+        return None
+
+    # Nested test classes are run through their top-level class
+    test_classes = {name.split("$")[0] for name in get_test_classes_of_reports(reports_dir)}
+    selected = sorted({name.replace("/", ".").split("$")[0] for name in affected} & test_classes)
+    print(f"{len(changed)} changed classes affect {len(selected)}/{len(test_classes)} test classes")
+    if test_classes and len(selected) > max_fraction * len(test_classes):
+        return None
+    return selected
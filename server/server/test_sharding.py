@@ -0,0 +1,66 @@
+"""
+Module containing logic related to test sharding, which splits the base test classes run against a candidate into
+shards of similar duration that run in parallel, each in its own staging directory.
+"""
+import heapq
+import os
+from pathlib import Path
+from typing import Optional
+from xml.etree import ElementTree
+
+from server.config import TEST_SHARDS
+from server.test_selection import get_test_classes_of_reports
+
+
+def get_test_durations(reports_dir: Path) -> dict[str, float]:
+    """Returns the duration in seconds of every test class with a report in the given surefire-reports dir."""
+    durations = {}
+    for test_class in get_test_classes_of_reports(reports_dir):
+        try:
+            root = ElementTree.parse(reports_dir / f"TEST-{test_class}.xml").getroot()
+            duration = float(root.get("time", "0").replace(",", ""))  # Surefire formats large times as 1,234.5
+        except (ElementTree.ParseError, ValueError):
+            duration = 0.0
+        # Nested test classes are run through their top-level class
+        top_level = test_class.split("$")[0]
+        durations[top_level] = durations.get(top_level, 0.0) + duration
+    return durations
+
+
+def split_into_shards(durations: dict[str, float], shards: int) -> list[list[str]]:
+    """
+    Distributes the test classes over at most `shards` shards with similar total durations, assigning the longest
+    test classes first to the shard that has the least work so far.
+    :return: sorted test classes of each non-empty shard
+    """
+    heap = [(0.0, i) for i in range(min(shards, len(durations)))]
+    assigned: list[list[str]] = [[] for _ in heap]
+    for test_class in sorted(durations, key=lambda name: (-durations[name], name)):
+        total, i = heapq.heappop(heap)
+        assigned[i].append(test_class)
+        heapq.heappush(heap, (total + durations[test_class], i))
+    return [sorted(shard) for shard in assigned if shard]
+
+
+def get_shards(base, tests: Optional[list[str]] = None, shards: int = TEST_SHARDS) -> Optional[list[list[str]]]:
+    """
+    Splits the test classes to run into shards, using the durations of the base's own test run. The classes that ran
+    in the base are used rather than those in test-classes, as only surefire knows which classes its configuration
+    includes.
+    :param base: BaseTemplate providing surefire-reports_BASE
+    :param tests: fully qualified names of the test classes to run, None for the full test suite
+    :return: the shards, or None if the tests should run in a single surefire run
+    """
+    reports_dir = base.target_path / "surefire-reports_BASE"
+    if shards <= 1 or not os.path.isdir(reports_dir):
+        return None
+    if tests is not None and any("#" in test for test in tests):
+        return None  # Reruns of single test methods are too short to be worth sharding
+    durations = get_test_durations(reports_dir)
+    if tests is not None:
+        # Selected classes without a recorded duration are assumed to take as long as an average class
+        average = sum(durations.values()) / len(durations) if durations else 0.0
+        durations = {test: durations.get(test, average) for test in tests}
+    if len(durations) <= 1:
+        return None
+    return split_into_shards(durations, shards)
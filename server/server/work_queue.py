@@ -0,0 +1,220 @@
+"""
+Module containing the durable work queue used to spread a compatibility sweep over several workers, possibly running on
+different machines that share the resources directory. Tasks are leased to the worker that claims them, the worker
+renews its lease with heartbeats, and tasks whose lease expired because their worker died are re-queued.
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterable, Optional
+
+from server.config import WORK_QUEUE_DB, WORK_LEASE, WORK_HEARTBEAT, WORK_MAX_ATTEMPTS
+from server.exceptions import get_error_code
+from server.persistence import ThreadLocalConnection
+
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+LEASE_EXPIRED = "LEASE_EXPIRED"
+
+
+class Task:
+    """A unit of work claimed from the queue, e.g. a GAV or a (GAV, candidate) pair."""
+
+    def __init__(self, queue: str, key: str, payload: Any, worker: str, attempts: int):
+        self.queue = queue
+        self.key = key
+        self.payload = payload
+        self.worker = worker
+        self.attempts = attempts
+
+    def __repr__(self):
+        return f"Task({self.queue}, {self.key}, worker={self.worker}, attempts={self.attempts})"
+
+
+class WorkQueue:
+    """
+    Lease table kept in SQLite. The rollback journal is used instead of WAL, as WAL relies on shared memory and does
+    not work for databases accessed from several machines over a network filesystem.
+    """
+
+    def __init__(self, path: Path = WORK_QUEUE_DB, lease: int = WORK_LEASE, max_attempts: int = WORK_MAX_ATTEMPTS):
+        self.path = Path(path)
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.connections = ThreadLocalConnection(self.path, timeout=60, pragmas=["journal_mode=DELETE"],
+                                                 isolation_level=None)
+        os.makedirs(self.path.parent, exist_ok=True)
+        with self.transaction() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS tasks ("
+                         "queue TEXT NOT NULL, key TEXT NOT NULL, payload TEXT, status TEXT NOT NULL, worker TEXT, "
+                         "lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0, outcome TEXT, message TEXT, "
+                         "result TEXT, updated REAL, PRIMARY KEY (queue, key))")
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_by_status ON tasks (queue, status, lease_expires)")
+
+    def connection(self) -> sqlite3.Connection:
+        return self.connections.get()
+
+    @contextmanager
+    def transaction(self):
+        """Takes the write lock up front, so that two workers can never claim the same task."""
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def enqueue(self, queue: str, key: str, payload: Any = None) -> bool:
+        """Adds a task unless a task with the same key is already in the queue. Returns True if it was added."""
+        return self.enqueue_many(queue, {key: payload}) == 1
+
+    def enqueue_many(self, queue: str, tasks: dict[str, Any]) -> int:
+        """Adds the tasks whose key is not in the queue yet. Returns the number of added tasks."""
+        now = time.time()
+        with self.transaction() as conn:
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO tasks (queue, key, payload, status, updated) VALUES (?, ?, ?, ?, ?)",
+                             [(queue, key, json.dumps(payload), QUEUED, now) for key, payload in tasks.items()])
+            return conn.total_changes - before
+
+    def claim(self, queue: str, worker: str) -> Optional[Task]:
+        """Leases the oldest queued task to the worker, or returns None if no task is available."""
+        now = time.time()
+        with self.transaction() as conn:
+            self.requeue_expired(queue, conn, now)
+            row = conn.execute("SELECT key, payload, attempts FROM tasks WHERE queue = ? AND status = ? "
+                               "ORDER BY rowid LIMIT 1", (queue, QUEUED)).fetchone()
+            if row is None:
+                return None
+            key, payload, attempts = row
+            conn.execute("UPDATE tasks SET status = ?, worker = ?, lease_expires = ?, attempts = ?, updated = ? "
+                         "WHERE queue = ? AND key = ?", (LEASED, worker, now + self.lease, attempts + 1, now, queue, key))
+        return Task(queue, key, json.loads(payload), worker, attempts + 1)
+
+    def heartbeat(self, task: Task) -> bool:
+        """Renews the lease of the task. Returns False if the worker lost the lease to another worker."""
+        now = time.time()
+        with self.transaction() as conn:
+            cursor = conn.execute("UPDATE tasks SET lease_expires = ?, updated = ? "
+                                  "WHERE queue = ? AND key = ? AND status = ? AND worker = ?",
+                                  (now + self.lease, now, task.queue, task.key, LEASED, task.worker))
+            return cursor.rowcount == 1
+
+    def complete(self, task: Task, outcome: str = "", result: Any = None, message: str = "") -> bool:
+        """
+        Records the outcome of the task, an empty outcome meaning success and any other an error code such as NO_JAR.
+        Returns False if the worker lost the lease, in which case the outcome is discarded.
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            cursor = conn.execute("UPDATE tasks SET status = ?, outcome = ?, message = ?, result = ?, "
+                                  "lease_expires = NULL, updated = ? "
+                                  "WHERE queue = ? AND key = ? AND status = ? AND worker = ?",
+                                  (FAILED if outcome else DONE, outcome, message, json.dumps(result), now,
+                                   task.queue, task.key, LEASED, task.worker))
+            return cursor.rowcount == 1
+
+    def requeue_expired(self, queue: str, conn: Optional[sqlite3.Connection] = None, now: Optional[float] = None) -> int:
+        """
+        Re-queues the tasks whose lease expired, giving up on tasks that already used up their attempts, as their
+        workers most likely keep crashing on them. Returns the number of re-queued tasks.
+        """
+        if conn is None:
+            with self.transaction() as conn:
+                return self.requeue_expired(queue, conn, now)
+        now = time.time() if now is None else now
+        conn.execute("UPDATE tasks SET status = ?, outcome = ?, lease_expires = NULL, updated = ? "
+                     "WHERE queue = ? AND status = ? AND lease_expires < ? AND attempts >= ?",
+                     (FAILED, LEASE_EXPIRED, now, queue, LEASED, now, self.max_attempts))
+        cursor = conn.execute("UPDATE tasks SET status = ?, worker = NULL, lease_expires = NULL, updated = ? "
+                              "WHERE queue = ? AND status = ? AND lease_expires < ?",
+                              (QUEUED, now, queue, LEASED, now))
+        return cursor.rowcount
+
+    def retry(self, queue: str, outcomes: Iterable[str]) -> int:
+        """Re-queues the failed tasks with one of the given outcomes, e.g. after fixing the cause of NO_RESOLVE."""
+        outcomes = list(outcomes)
+        if not outcomes:
+            return 0
+        with self.transaction() as conn:
+            cursor = conn.execute(f"UPDATE tasks SET status = ?, worker = NULL, attempts = 0, updated = ? "
+                                  f"WHERE queue = ? AND status = ? AND outcome IN ({','.join('?' * len(outcomes))})",
+                                  (QUEUED, time.time(), queue, FAILED, *outcomes))
+            return cursor.rowcount
+
+    def get(self, queue: str, key: str) -> Optional[dict]:
+        row = self.connection().execute("SELECT status, worker, attempts, outcome, message, result FROM tasks "
+                                        "WHERE queue = ? AND key = ?", (queue, key)).fetchone()
+        if row is None:
+            return None
+        status, worker, attempts, outcome, message, result = row
+        return {'status': status, 'worker': worker, 'attempts': attempts, 'outcome': outcome, 'message': message,
+                'result': json.loads(result) if result is not None else None}
+
+    def counts(self, queue: str) -> dict[str, int]:
+        """Returns the number of tasks per status."""
+        rows = self.connection().execute("SELECT status, COUNT(*) FROM tasks WHERE queue = ? GROUP BY status", (queue,))
+        return dict(rows.fetchall())
+
+    def outcomes(self, queue: str) -> dict[str, int]:
+        """Returns the number of failed tasks per error code."""
+        rows = self.connection().execute("SELECT outcome, COUNT(*) FROM tasks WHERE queue = ? AND status = ? "
+                                         "GROUP BY outcome", (queue, FAILED))
+        return dict(rows.fetchall())
+
+    def close(self):
+        self.connections.close()
+
+
+def get_worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def keep_lease(work_queue: WorkQueue, task: Task, stop: threading.Event, interval: float):
+    while not stop.wait(interval):
+        if not work_queue.heartbeat(task):
+            print(f"Lost the lease on {task}")
+            return
+
+
+def run_worker(work_queue: WorkQueue, queue: str, handle: Callable[[Task], Any], worker: Optional[str] = None,
+               heartbeat: float = WORK_HEARTBEAT, poll: float = 10) -> int:
+    """
+    Claims and handles tasks until the queue is drained. The return value of handle is stored as the result of the
+    task, and exceptions are stored as their error code. While tasks leased to other workers remain, the worker keeps
+    polling so that it can take over the tasks of workers that died.
+    :return: number of tasks handled by this worker
+    """
+    worker = worker or get_worker_name()
+    handled = 0
+    while True:
+        task = work_queue.claim(queue, worker)
+        if task is None:
+            if not work_queue.counts(queue).get(LEASED):
+                return handled
+            time.sleep(poll)
+            continue
+
+        print(f"{worker} claimed {task.key} (attempt {task.attempts})")
+        stop = threading.Event()
+        heartbeats = threading.Thread(target=keep_lease, args=(work_queue, task, stop, heartbeat), daemon=True)
+        heartbeats.start()
+        try:
+            result = handle(task)
+            work_queue.complete(task, result=result)
+        except Exception as e:
+            print(e)
+            work_queue.complete(task, outcome=get_error_code(e), message=str(e))
+        finally:
+            stop.set()
+            heartbeats.join()
+        handled += 1
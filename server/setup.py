@@ -18,7 +18,9 @@ setup(
     },
     entry_points={
         'console_scripts': [
-                'server-example=server:main'
+                'server-example=server:main',
+                'server-storage=server.storage:main',
+                'server-templates=server.template_registry:main'
         ]
     }
 )
\ No newline at end of file
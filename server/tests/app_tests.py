@@ -0,0 +1,146 @@
+import gzip
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from server.app import app
+from server.jobs import JobQueue
+from server.ranges import RangeCache
+from server.store import CompatibilityIndex, SqliteCompatibilityStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SqliteCompatibilityStore(tmp_path / "compatibilities.db")
+    store.add("g:a:1", ["1", "2", "3"])
+    with patch('server.app.compatibility_index', CompatibilityIndex(store)), \
+            patch('server.app.COMPUTE_ON_MISS', False), patch('server.app.job_queue', None):
+        yield store
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def test_compatibilities(store, client):
+    response = client.get("/compatibilities/g:a:1")
+    assert response.status_code == 200
+    assert response.json == {'compatible_versions': ["1", "2", "3"]}
+
+    response = client.get("/compatibilities/g:a:2")
+    assert response.json == {'compatible_versions': None}
+
+
+def test_compatibilities_index_sees_new_writes(store, client):
+    assert client.get("/compatibilities/g:b:1").json == {'compatible_versions': None}
+    store.add("g:b:1", ["1"])
+    assert client.get("/compatibilities/g:b:1").json == {'compatible_versions': ["1"]}
+
+
+def test_compatibilities_index_sees_writes_of_other_processes(store, client):
+    assert client.get("/compatibilities/g:b:1").json == {'compatible_versions': None}
+    SqliteCompatibilityStore(store.path).add("g:b:1", ["1"])  # Separate store object, no notification
+    assert client.get("/compatibilities/g:b:1").json == {'compatible_versions': ["1"]}
+
+
+def test_compatibilities_etag(store, client):
+    response = client.get("/compatibilities/g:a:1")
+    etag = response.headers["ETag"]
+
+    response = client.get("/compatibilities/g:a:1", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    store.add("g:a:1", ["4"])
+    response = client.get("/compatibilities/g:a:1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json == {'compatible_versions': ["1", "2", "3", "4"]}
+
+
+def test_compatibilities_batch(store, client):
+    response = client.post("/compatibilities", json=["g:a:1", "g:a:2"])
+    assert response.status_code == 200
+    assert response.json == {'compatible_versions': {"g:a:1": ["1", "2", "3"], "g:a:2": None}}
+
+    response = client.post("/compatibilities", json={"gavs": ["g:a:1"]})
+    assert response.json == {'compatible_versions': {"g:a:1": ["1", "2", "3"]}}
+
+    response = client.post("/compatibilities", json={"gav": "g:a:1"})
+    assert response.status_code == 400
+
+
+def test_compatibilities_batch_gzip(store, client):
+    gavs = [f"g:a:{i}" for i in range(100)]
+    store.update({gav: ["1", "2", "3"] for gav in gavs})
+
+    response = client.post("/compatibilities", json=gavs, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    body = gzip.decompress(response.data)
+    assert body.count(b'"1"') == 100
+
+    response = client.post("/compatibilities", json=gavs)
+    assert "Content-Encoding" not in response.headers
+
+
+def test_ranges(store, client):
+    with patch('server.app.range_cache', RangeCache(fetch=lambda g, a: ["0", "1", "2", "3", "4"])):
+        response = client.get("/ranges/g:a:1")
+        assert response.json == {'range': "[1,3]"}
+
+        response = client.get("/ranges/g:a:2")
+        assert response.json == {'range': None}
+
+        response = client.post("/ranges", json=["g:a:1", "g:a:2"])
+        assert response.json == {'ranges': {"g:a:1": "[1,3]", "g:a:2": None}}
+
+        response = client.post("/ranges", json=["g:a"])
+        assert response.status_code == 400
+
+
+def test_compatibilities_miss_enqueues_job(store, client):
+    release = threading.Event()
+
+    def compute(gav):
+        release.wait(5)
+        store.add(gav, ["1"])
+        return ["1"]
+
+    with patch('server.app.job_queue', JobQueue(compute)):
+        response = client.get("/compatibilities/g:b:1")
+        assert response.status_code == 202
+        job = response.json['job']
+        assert response.headers["Location"] == f"/jobs/{job['id']}"
+        assert job['status'] == "queued" or job['status'] == "running"
+
+        # Batch misses share the pending job
+        response = client.post("/compatibilities", json=["g:a:1", "g:b:1"])
+        assert response.json['jobs'] == {"g:b:1": job['id']}
+
+        assert client.get(f"/jobs/{job['id']}").json['status'] != "done"
+        release.set()
+        response = client.get(f"/jobs/{job['id']}?wait=5")
+        assert response.json['status'] == "done"
+        assert response.json['compatible_versions'] == ["1"]
+
+        assert client.get("/compatibilities/g:b:1").json == {'compatible_versions': ["1"]}
+        assert client.get("/jobs/unknown").status_code == 404
+
+
+def test_compatibilities_miss_without_job_queue(store, client):
+    response = client.get("/compatibilities/g:b:1")
+    assert response.status_code == 200
+    assert response.json == {'compatible_versions': None}
+    assert client.get("/jobs/unknown").status_code == 404
+
+
+def test_template_registry(tmp_path, client):
+    with patch('server.app.TEMPLATE_REGISTRY_DIR', tmp_path):
+        assert client.get("/templates/t/base_templates/g:a:1.tar.gz").status_code == 404
+        assert client.put("/templates/t/base_templates/g:a:1.tar.gz", data=b"bundle").status_code == 201
+        assert client.put("/templates/t/base_templates/g:a:1.txt", data=b"bundle").status_code == 400
+        assert client.put("/templates/../g:a:1.tar.gz", data=b"bundle").status_code in (400, 404)
+        response = client.get("/templates/t/base_templates/g:a:1.tar.gz")
+        assert response.status_code == 200
+        assert response.data == b"bundle"
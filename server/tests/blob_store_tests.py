@@ -0,0 +1,100 @@
+import os
+
+from server.blob_store import (deduplicate_directory, read_manifest, get_blob_path, hash_file, link_tree, gc_blobs,
+                               get_manifest_path)
+from server.test_selection import get_file_hashes
+
+
+def write_classes(classes_dir, files):
+    for name, content in files.items():
+        os.makedirs((classes_dir / name).parent, exist_ok=True)
+        with open(classes_dir / name, 'wb') as f:
+            f.write(content)
+
+
+def test_deduplicate_directories_share_blobs(tmp_path):
+    store = tmp_path / "blobs"
+    v1, v2 = tmp_path / "g:a:1" / "classes", tmp_path / "g:a:2" / "classes"
+    write_classes(v1, {"org/A.class": b"A", "org/B.class": b"B1"})
+    write_classes(v2, {"org/A.class": b"A", "org/B.class": b"B2"})
+    expected_hashes = get_file_hashes(v1)
+
+    hashes = deduplicate_directory(v1, store)
+    deduplicate_directory(v2, store)
+    assert hashes == expected_hashes
+    assert read_manifest(v1) == hashes
+    assert os.path.samefile(v1 / "org/A.class", v2 / "org/A.class")
+    assert os.path.samefile(v1 / "org/A.class", get_blob_path(store, hashes["org/A.class"]))
+    assert not os.path.samefile(v1 / "org/B.class", v2 / "org/B.class")
+    assert len(list(store.glob("*/*"))) == 3
+    with open(v2 / "org/B.class", 'rb') as f:
+        assert f.read() == b"B2"
+
+    # Deduplicating again changes nothing
+    assert deduplicate_directory(v1, store) == hashes
+    assert len(list(store.glob("*/*"))) == 3
+
+
+def test_get_file_hashes_uses_manifest(tmp_path):
+    classes = tmp_path / "classes"
+    write_classes(classes, {"A.class": b"A"})
+    assert get_file_hashes(classes) == {"A.class": hash_file(classes / "A.class")}
+    deduplicate_directory(classes, tmp_path / "blobs")
+    with open(get_manifest_path(classes), 'w') as f:
+        f.write('{"A.class": "from-manifest"}')
+    assert get_file_hashes(classes) == {"A.class": "from-manifest"}
+
+
+def test_link_tree_links_only_blobs(tmp_path, monkeypatch):
+    monkeypatch.setattr(os, "geteuid", lambda: 1000)
+    write_classes(tmp_path / "base" / "target", {"test-classes/ATest.class": b"T", "surefire-reports/r.xml": b"R"})
+    deduplicate_directory(tmp_path / "base" / "target" / "test-classes", tmp_path / "blobs")
+    write_classes(tmp_path / "cand" / "target", {"classes/A.class": b"A"})
+    staging = tmp_path / "staging" / "target"
+    link_tree(tmp_path / "base" / "target", staging)
+    link_tree(tmp_path / "cand" / "target", staging)
+    assert os.path.samefile(staging / "test-classes/ATest.class", tmp_path / "base/target/test-classes/ATest.class")
+    # Files that are not blobs are copied, as tests may write to them
+    assert not os.path.samefile(staging / "surefire-reports/r.xml", tmp_path / "base/target/surefire-reports/r.xml")
+    assert not os.path.samefile(staging / "classes/A.class", tmp_path / "cand/target/classes/A.class")
+    with open(staging / "classes/A.class", 'rb') as f:
+        assert f.read() == b"A"
+
+    # Root could write through the read-only blobs, so nothing is linked
+    monkeypatch.setattr(os, "geteuid", lambda: 0)
+    link_tree(tmp_path / "base" / "target", tmp_path / "root" / "target")
+    assert not os.path.samefile(tmp_path / "root/target/test-classes/ATest.class",
+                                tmp_path / "base/target/test-classes/ATest.class")
+
+
+def test_link_tree_replaces_existing_files_without_writing_through(tmp_path, monkeypatch):
+    monkeypatch.setattr(os, "geteuid", lambda: 1000)
+    store = tmp_path / "blobs"
+    write_classes(tmp_path / "base" / "target" / "classes", {"A.class": b"base"})
+    hashes = deduplicate_directory(tmp_path / "base" / "target" / "classes", store)
+    staging = tmp_path / "staging" / "target"
+    link_tree(tmp_path / "base" / "target", staging)
+    link_tree(tmp_path / "base" / "target", staging)  # Linking the same files again is a no-op
+
+    write_classes(tmp_path / "cand" / "target" / "classes", {"A.class": b"cand"})
+    link_tree(tmp_path / "cand" / "target", staging)  # Copied over the link to the blob
+    with open(staging / "classes/A.class", 'rb') as f:
+        assert f.read() == b"cand"
+    with open(get_blob_path(store, hashes["A.class"]), 'rb') as f:
+        assert f.read() == b"base"
+    assert sorted(os.listdir(staging / "classes")) == ["A.class"]
+
+
+def test_gc_blobs_deletes_unused_blobs(tmp_path):
+    store = tmp_path / "blobs"
+    v1, v2 = tmp_path / "g:a:1" / "classes", tmp_path / "g:a:2" / "classes"
+    write_classes(v1, {"A.class": b"A", "B.class": b"B"})
+    write_classes(v2, {"A.class": b"A"})
+    deduplicate_directory(v1, store)
+    deduplicate_directory(v2, store)
+
+    assert gc_blobs(store) == 0
+    os.remove(v1 / "A.class")
+    os.remove(v1 / "B.class")
+    assert gc_blobs(store) == 1
+    assert [blob.name for blob in store.glob("*/*")] == [hash_file(v2 / "A.class")[2:]]
@@ -0,0 +1,60 @@
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from server.candidate_policy import (apply_candidate_policies, skip_prereleases, major_version_fence, max_distance,
+                                     date_window, skip_known_broken, read_known_broken, register_policy, POLICIES)
+
+VERSIONS = ["3.0.0", "2.1.0", "2.1.0-rc1", "2.0.1", "2.0.0", "2.0.0-SNAPSHOT", "2.0.0-M1", "1.9.0", "1.8.0"]
+
+
+def test_skip_prereleases():
+    assert skip_prereleases("g", "a", "2.0.0", VERSIONS) == ["3.0.0", "2.1.0", "2.0.1", "2.0.0", "1.9.0", "1.8.0"]
+    # The base itself is kept even if it is a pre-release
+    assert "2.0.0-M1" in skip_prereleases("g", "a", "2.0.0-M1", VERSIONS)
+
+
+def test_major_version_fence():
+    assert major_version_fence("g", "a", "2.0.0", VERSIONS) == VERSIONS[1:7]
+
+
+def test_max_distance():
+    assert max_distance("g", "a", "2.0.0", VERSIONS, distance=1) == ["2.0.1", "2.0.0", "2.0.0-SNAPSHOT"]
+    assert max_distance("g", "a", "3.0.0", VERSIONS, distance=2) == ["3.0.0", "2.1.0", "2.1.0-rc1"]
+
+
+def test_date_window():
+    dates = {"2.0.0": datetime(2020, 1, 1, tzinfo=timezone.utc), "2.1.0": datetime(2020, 6, 1, tzinfo=timezone.utc),
+             "3.0.0": datetime(2024, 1, 1, tzinfo=timezone.utc)}
+    with patch("server.candidate_policy.get_release_date", side_effect=lambda g, a, v: dates.get(v)):
+        # Candidates without a known release date are kept
+        assert date_window("g", "a", "2.0.0", ["3.0.0", "2.1.0", "2.0.0", "1.9.0"], days=365) == \
+               ["2.1.0", "2.0.0", "1.9.0"]
+        assert date_window("g", "a", "1.9.0", ["3.0.0", "1.9.0"], days=365) == ["3.0.0", "1.9.0"]
+
+
+def test_skip_known_broken(tmp_path):
+    path = tmp_path / "known_broken.txt"
+    path.write_text("# Tags missing on GitHub\ng:a:2.0.*  # no tag\nother:lib:1.0\n")
+    patterns = read_known_broken(path)
+    assert patterns == ["g:a:2.0.*", "other:lib:1.0"]
+    assert skip_known_broken("g", "a", "2.1.0", VERSIONS, patterns) == ["3.0.0", "2.1.0", "2.1.0-rc1", "1.9.0",
+                                                                        "1.8.0"]
+    assert read_known_broken(tmp_path / "missing.txt") == []
+
+
+def test_apply_candidate_policies():
+    kept, stats = apply_candidate_policies("g", "a", "2.0.0", VERSIONS, ["prerelease", "major"])
+    assert kept == ["2.1.0", "2.0.1", "2.0.0"]
+    assert stats == {'total': 9, 'prerelease': 3, 'major': 3, 'kept': 3}
+
+    assert apply_candidate_policies("g", "a", "2.0.0", VERSIONS, []) == (VERSIONS, {'total': 9, 'kept': 9})
+
+
+def test_registered_policy_keeps_base():
+    register_policy("nothing", lambda g, a, v, cv_versions: [])
+    try:
+        kept, stats = apply_candidate_policies("g", "a", "2.0.0", VERSIONS, ["nothing"])
+        assert kept == ["2.0.0"]
+        assert stats['nothing'] == 8
+    finally:
+        del POLICIES["nothing"]
@@ -0,0 +1,129 @@
+from functools import partial
+from typing import Optional
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from server import (CompatibilityResult, get_compatibility_results_helper, get_compatibility_results_bisect,
+                    get_sample_indices, compute_compatible_versions, find_compatibility_results)
+from server.candidate_policy import apply_candidate_policies
+from server.exceptions import CandidateJarNotFoundException
+from server.maven_version import get_major_version
+
+
+def fake_check(compatible: set[str], missing: frozenset[str] = frozenset(), errors: Optional[dict[str, str]] = None):
+    checked = []
+
+    def check(g, a, v, cv, base_template, build=None):
+        checked.append(cv)
+        if cv in missing:
+            return CompatibilityResult(g, a, v, cv, False, False, err="NO_JAR")
+        if errors and cv in errors:
+            return CompatibilityResult(g, a, v, cv, True, False, err=errors[cv])
+        return CompatibilityResult(g, a, v, cv, cv in compatible, cv in compatible)
+    return check, checked
+
+
+def versions(n: int) -> list[str]:
+    return [f"1.{i}" for i in range(1, n + 1)]
+
+
+def test_get_major_version():
+    assert get_major_version("2.16.0-rc1") == 2
+    assert get_major_version("10") == 10
+    assert get_major_version("r09") is None
+
+
+def test_get_sample_indices():
+    assert get_sample_indices(list(range(10)), 2) == [2, 7]
+    assert get_sample_indices([4], 3) == [4]
+    assert get_sample_indices(list(range(10)), 0) == []
+
+
+def test_linear_search_gives_up_after_three_fails():
+    check, checked = fake_check({"1.1", "1.6"}, missing=frozenset({"1.3"}), errors={"1.4": "NO_TAG"})
+    with patch("server.check_candidate", side_effect=check), patch("server.build_candidate"):
+        results = get_compatibility_results_helper("g", "a", "1.0", versions(9), MagicMock())
+    assert [r.v_cand for r in results if r.is_compatible()] == ["1.1", "1.6"]
+    # The missing jar of 1.3 and the missing tag of 1.4 do not count as fails, as in the bisect search
+    assert checked == ["1.1", "1.2", "1.3", "1.4", "1.5", "1.6", "1.7", "1.8", "1.9"]
+
+
+def test_linear_search_stops_building_after_three_fails():
+    check, checked = fake_check(set())
+    built = []
+    with patch("server.check_candidate", side_effect=check), \
+            patch("server.build_candidate", side_effect=lambda g, a, v, cv: built.append(cv)):
+        results = get_compatibility_results_helper("g", "a", "1.0", versions(20), MagicMock(), build_workers=2,
+                                                   test_workers=1)
+    assert [r.v_cand for r in results] == ["1.1", "1.2", "1.3"]
+    assert checked == ["1.1", "1.2", "1.3"]
+    assert set(built) <= set(versions(5))  # Builds are submitted at most build_workers + test_workers ahead
+
+
+def test_bisect_finds_boundary_with_few_checks():
+    candidates = versions(100) + ["2.0", "2.1"]
+    check, checked = fake_check(set(versions(37)))
+    with patch("server.check_candidate", side_effect=check):
+        results = get_compatibility_results_bisect("g", "a", "1.0", candidates, MagicMock(), samples=0)
+    assert len(checked) <= 8
+    assert [r.v_cand for r in results if r.is_compatible()] == versions(37)
+    assert all(r.inferred != (r.v_cand in checked) for r in results)
+    # Candidates beyond the boundary or outside the major version are left out unless checked
+    assert all(r.v_cand in checked for r in results if not r.is_compatible())
+    assert "2.0" not in checked
+
+
+def test_bisect_skips_missing_jars():
+    check, checked = fake_check(set(versions(6)), missing=frozenset({"1.5"}))
+    with patch("server.check_candidate", side_effect=check):
+        results = get_compatibility_results_bisect("g", "a", "1.0", versions(8), MagicMock(), samples=0)
+    assert checked == ["1.5", "1.4", "1.7", "1.6"]
+    assert [r.v_cand for r in results if r.is_compatible()] == ["1.1", "1.2", "1.3", "1.4", "1.6"]
+    assert next(r for r in results if r.v_cand == "1.5").err == "NO_JAR"
+
+
+def test_bisect_skips_candidates_that_could_not_be_built():
+    check, checked = fake_check(set(versions(6)), errors={"1.5": "NO_TAG", "1.6": "CAND_COMPILE_TIMEOUT"})
+    with patch("server.check_candidate", side_effect=check):
+        results = get_compatibility_results_bisect("g", "a", "1.0", versions(8), MagicMock(), samples=0)
+    assert checked == ["1.5", "1.4", "1.7", "1.6"]
+    assert [r.v_cand for r in results if r.is_compatible()] == ["1.1", "1.2", "1.3", "1.4"]
+    assert {r.v_cand: r.err for r in results if r.err} == {"1.5": "NO_TAG", "1.6": "CAND_COMPILE_TIMEOUT"}
+
+
+def test_bisect_falls_back_when_not_monotone():
+    compatible = set(versions(40)) - {"1.14"}
+    check, checked = fake_check(compatible)
+    with patch("server.check_candidate", side_effect=check):
+        results = get_compatibility_results_bisect("g", "a", "1.0", versions(40), MagicMock(), samples=4)
+    assert set(checked) == set(versions(40))
+    assert not any(r.inferred for r in results)
+    assert [r.v_cand for r in results if not r.is_compatible()] == ["1.14"]
+
+
+def test_compute_compatible_versions_fails_without_any_jar():
+    store = MagicMock()
+    missing = [CompatibilityResult("g", "a", "1.0", cv, False, False, err="NO_JAR") for cv in versions(2)]
+    with patch("server.find_compatibility_results", return_value=(missing, {})), \
+            patch("server.get_compatibility_store", return_value=store):
+        with pytest.raises(CandidateJarNotFoundException):
+            compute_compatible_versions("g:a:1.0")
+        store.add.assert_not_called()
+
+        found = missing + [CompatibilityResult("g", "a", "1.0", "1.3", True, True)]
+        with patch("server.find_compatibility_results", return_value=(found, {})):
+            assert compute_compatible_versions("g:a:1.0") == ["1.0", "1.3"]
+        store.add.assert_called_once_with("g:a:1.0", {"1.0", "1.3"})
+
+
+def test_find_compatibility_results_returns_pruning_statistics():
+    available = ["1.0", "1.1-rc1", "1.1", "2.0"]
+    prune_prereleases = partial(apply_candidate_policies, policies=["prerelease"])
+    with patch("server.get_available_versions", return_value=available), \
+            patch("server.apply_candidate_policies", side_effect=prune_prereleases), \
+            patch("server.get_compatibility_results", return_value=[]) as get_results:
+        results, stats = find_compatibility_results("g", "a", "1.0", silent=True)
+    assert results == []
+    assert stats == {'total': 4, 'prerelease': 1, 'kept': 3}
+    assert get_results.call_args.args[3] == ["1.0", "1.1", "2.0"]
@@ -1,15 +1,23 @@
 import filecmp
+import os
 import pathlib
+import sys
+import threading
+import time
 from unittest.mock import patch, MagicMock
 
 import pytest
 from tests.template import BASE_TEMPLATES_TEST_DIR, CAND_TEMPLATES_TEST_DIR, REPOS_TEST_DIR, cleanup_repo
 
 from core import PomNotFoundException
-from server.dynamic import dynamic_check, run_tests, merge_poms, get_test_deps
+from server.dynamic import (dynamic_check, run_tests, merge_poms, get_test_deps, dynamically_compatible,
+                            run_surefire_fail_fast, write_excludes_file, read_excludes_file, get_surefire_command,
+                            rerun_failures)
+from server.exceptions import CandidateMavenTestTimeout
+from server.flakiness import FlakinessTable
 from server.template.base_template import BaseTemplate
 from server.template.candidate_template import CandidateTemplate
-from server.test_failure import get_test_failures_from_dir
+from server.test_failure import get_test_failures_from_dir, TestFailure
 
 
 def mock_template(v: int, type: str) -> MagicMock:
@@ -472,4 +480,189 @@ def test_tt():
     candidate_fails = run_tests(base, cand)
     input(f"cand ({v_cand}) has {len(candidate_fails - baseline_fails)} fails not in base ({v_base}): {candidate_fails - baseline_fails}")
     compatible = dynamic_check(baseline_fails, candidate_fails)
-    input(f"is cand ({v_cand}) compatible with base ({v_base})? {compatible}")
\ No newline at end of file
+    input(f"is cand ({v_cand}) compatible with base ({v_base})? {compatible}")
+
+
+def test_dynamically_compatible_skips_identical_classes(tmp_path):
+    base = MagicMock()
+    base.path = tmp_path
+    base.get_compatible_fingerprints.return_value = {"compatible"}
+    templates = {"1": MagicMock(), "2": MagicMock(), "3": MagicMock(), "4": MagicMock()}
+    templates["1"].get_classes_fingerprint.return_value = "base"
+    templates["2"].get_classes_fingerprint.return_value = "base"  # Re-release of the base
+    templates["3"].get_classes_fingerprint.return_value = "compatible"
+    templates["4"].get_classes_fingerprint.return_value = "new"
+    base.version = "1"
+
+    with patch('server.dynamic.CandidateTemplate', side_effect=lambda g, a, v, repo_name=None: templates[v]), \
+            patch('server.dynamic.select_tests', return_value=None), \
+            patch('server.dynamic.get_flakiness_table', return_value=FlakinessTable(tmp_path / "flakiness.db")), \
+            patch('server.dynamic.run_tests', return_value=set()) as run_tests_mock:
+        assert dynamically_compatible(base, "2")
+        assert dynamically_compatible(base, "3")
+        run_tests_mock.assert_not_called()
+
+        assert dynamically_compatible(base, "4")
+        assert run_tests_mock.call_count == 2
+        base.add_compatible_fingerprint.assert_called_once_with("new")
+
+
+FAKE_SUREFIRE = """
+import os, subprocess, sys, time
+reports = sys.argv[1]
+child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])  # Stands in for the forked JVM
+with open(os.path.join(reports, "child.pid"), "w") as f:
+    f.write(str(child.pid))
+for i, outcome in enumerate(sys.argv[2:]):
+    time.sleep(0.1)
+    case = '<testcase name="t{0}" classname="C{0}">{1}</testcase>'.format(i, outcome)
+    with open(os.path.join(reports, "TEST-C{}.xml".format(i)), "w") as f:
+        f.write('<testsuite name="C{}">{}</testsuite>'.format(i, case))
+child.kill()
+"""
+
+
+def fake_surefire(tmp_path, *outcomes) -> list[str]:
+    os.makedirs(tmp_path / "surefire-reports", exist_ok=True)
+    return [sys.executable, "-c", FAKE_SUREFIRE, str(tmp_path / "surefire-reports"), *outcomes]
+
+
+def is_running(pid: int) -> bool:
+    """Killed processes whose parent died may linger as zombies until reaped, which do not count as running."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().split(")")[-1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def test_run_surefire_fail_fast_aborts_on_new_failure(tmp_path):
+    command = fake_surefire(tmp_path, "", "<failure/>", "<failure/>")
+    command[2] = command[2].replace("child.kill()", "time.sleep(60)")
+    baseline = {TestFailure("C2", "t2", "C2", "failure")}
+
+    start = time.monotonic()
+    new_failures = run_surefire_fail_fast(command, tmp_path, tmp_path / "surefire-reports", baseline,
+                                          poll_interval=0.05)
+    assert time.monotonic() - start < 30
+    assert new_failures == {TestFailure("C1", "t1", "C1", "failure")}
+
+    # The whole process group is gone, including processes forked by the build
+    child_pid = int((tmp_path / "surefire-reports" / "child.pid").read_text())
+    time.sleep(0.1)
+    assert not is_running(child_pid)
+
+
+def test_run_surefire_fail_fast_completes(tmp_path):
+    command = fake_surefire(tmp_path, "", "<failure/>")
+    baseline = {TestFailure("C1", "t1", "C1", "failure")}
+    assert run_surefire_fail_fast(command, tmp_path, tmp_path / "surefire-reports", baseline,
+                                  poll_interval=0.05) == set()
+
+
+def test_run_surefire_fail_fast_timeout(tmp_path):
+    command = fake_surefire(tmp_path, "")
+    command[2] = command[2].replace("child.kill()", "time.sleep(60)")
+    with pytest.raises(CandidateMavenTestTimeout):
+        run_surefire_fail_fast(command, tmp_path, tmp_path / "surefire-reports", set(), timeout=0.5,
+                               poll_interval=0.05)
+
+
+def test_surefire_command_excludes_baseline_failures(tmp_path):
+    failures = {TestFailure("s", "testFlaky", "com.example.FooTest", "error"),
+                TestFailure("s", "testNetwork()", "com.example.BarTest", "failure"),
+                TestFailure("s", "testParameterized(String)[1]", "com.example.BarTest", "failure")}
+    excludes_file = write_excludes_file(failures, tmp_path / "surefire-excludes.txt")
+    assert read_excludes_file(excludes_file) == ["com.example.BarTest#testNetwork", "com.example.FooTest#testFlaky"]
+
+    assert get_surefire_command(excludes_file=excludes_file) == \
+        ["mvn", "surefire:test", f"-Dsurefire.excludesFile={excludes_file}"]
+    command = get_surefire_command(["com.example.FooTest"], excludes_file=excludes_file)
+    assert "-Dtest=com.example.FooTest,!com.example.BarTest#testNetwork,!com.example.FooTest#testFlaky" in command
+
+    # Refreshing the baseline replaces the previous exclusions
+    write_excludes_file(set(), excludes_file)
+    assert read_excludes_file(excludes_file) == []
+
+
+def test_rerun_failures(tmp_path):
+    base = MagicMock()
+    base.group_id, base.artifact_id = "g", "a"
+    flaky = TestFailure("s", "testFlaky", "com.example.FooTest", "failure")
+    broken = TestFailure("s", "testBroken()", "com.example.FooTest", "failure")
+    parameterized = TestFailure("s", "testParameterized(String)[1]", "com.example.BarTest", "failure")
+    intermittent = TestFailure("s", "testIntermittent", "com.example.FooTest", "failure")
+    outcomes = iter([{broken, parameterized, intermittent}, {broken, parameterized}])
+    flakiness = FlakinessTable(tmp_path / "flakiness.db", min_evaluations=1)
+
+    with patch('server.dynamic.run_tests', side_effect=lambda b, c, tests: next(outcomes)) as run_tests_mock:
+        confirmed = rerun_failures(base, MagicMock(), {flaky, broken, parameterized, intermittent}, reruns=2,
+                                   flakiness=flakiness)
+
+    # Failing in two of three runs is an intermittent regression rather than flakiness
+    assert confirmed == {broken, parameterized, intermittent}
+    # Only the failed methods are rerun, parameterized tests through their class
+    assert run_tests_mock.call_args[0][2] == ["com.example.BarTest", "com.example.FooTest#testBroken",
+                                             "com.example.FooTest#testFlaky", "com.example.FooTest#testIntermittent"]
+    assert flakiness.get("g:a", "com.example.FooTest#testFlaky") == {'evaluations': 1, 'runs': 2, 'failures': 0,
+                                                                     'flaky': 1}
+    assert flakiness.get_quarantined("g:a") == {"com.example.FooTest#testFlaky"}
+
+
+def test_dynamically_compatible_ignores_flaky_failures(tmp_path):
+    base = MagicMock()
+    base.path = tmp_path
+    base.group_id, base.artifact_id, base.version = "g", "a", "1"
+    base.get_compatible_fingerprints.return_value = set()
+    flaky = TestFailure("s", "testFlaky", "com.example.FooTest", "failure")
+    quarantined = TestFailure("s", "testQuarantined", "com.example.FooTest", "failure")
+    flakiness = FlakinessTable(tmp_path / "flakiness.db", min_evaluations=1)
+    flakiness.record("g:a", "com.example.FooTest#testQuarantined", runs=2, failures=0)
+
+    # Baseline, aborted candidate run, two reruns of the flaky test, candidate run resumed with the flaky test known,
+    # which may have been aborted on the quarantined test and is hence resumed once more
+    outcomes = iter([set(), {flaky}, set(), set(), {flaky, quarantined}, {flaky, quarantined}])
+    excludes = []
+
+    def run_tests(*args, **kwargs):
+        if kwargs.get('excludes_file') and not excludes:
+            excludes.append(read_excludes_file(kwargs['excludes_file']))
+        return next(outcomes)
+
+    with patch('server.dynamic.CandidateTemplate', side_effect=lambda g, a, v, repo_name=None: MagicMock()), \
+            patch('server.dynamic.select_tests', return_value=None), \
+            patch('server.dynamic.get_flakiness_table', return_value=flakiness), \
+            patch('server.dynamic.FAIL_FAST', True), \
+            patch('server.dynamic.run_tests', side_effect=run_tests) as run_tests_mock:
+        assert dynamically_compatible(base, "2")
+        assert run_tests_mock.call_count == 6
+
+    # Each evaluation writes its own excludes file, removed once it is done
+    excludes_file = next(kwargs['excludes_file'] for _, kwargs in run_tests_mock.call_args_list if kwargs)
+    assert not excludes_file.is_relative_to(tmp_path)
+    assert not os.path.exists(excludes_file)
+    assert "com.example.FooTest#testQuarantined" in excludes[0]
+
+
+def test_run_surefire_fail_fast_stops(tmp_path):
+    command = fake_surefire(tmp_path, "")
+    command[2] = command[2].replace("child.kill()", "time.sleep(60)")
+    stop = threading.Event()
+    stop.set()
+    assert run_surefire_fail_fast(command, tmp_path, tmp_path / "surefire-reports", set(), timeout=30,
+                                  poll_interval=0.05, stop=stop) == set()
+
+
+def test_run_tests_merges_shards():
+    shard_failures = {"FooTest": {TestFailure("FooTest", "t", "FooTest", "failure")},
+                      "BarTest": {TestFailure("BarTest", "t", "BarTest", "error")}}
+
+    def run_shard(base, candidate, tests, baseline_failures, excludes_file, stop):
+        assert not stop.is_set()
+        return set().union(*(shard_failures.get(test, set()) for test in tests))
+
+    with patch('server.dynamic.get_shards', return_value=[["FooTest"], ["BarTest", "BazTest"]]), \
+            patch('server.dynamic.run_tests_in_staging_dir', side_effect=run_shard) as run_shard_mock:
+        failures = run_tests(MagicMock(), MagicMock(), shards=2)
+    assert run_shard_mock.call_count == 2
+    assert failures == shard_failures["FooTest"] | shard_failures["BarTest"]
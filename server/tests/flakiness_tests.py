@@ -0,0 +1,40 @@
+import time
+
+from server.flakiness import FlakinessTable, is_reproduced
+
+
+def test_is_reproduced():
+    assert is_reproduced(runs=2, failures=1)  # Failed in two of three runs, an intermittent regression
+    assert not is_reproduced(runs=2, failures=0)
+    assert is_reproduced(runs=4, failures=2)
+    assert not is_reproduced(runs=4, failures=1)
+
+
+def test_flakiness_table(tmp_path):
+    table = FlakinessTable(tmp_path / "flakiness.db", min_score=0.5, min_evaluations=3)
+    assert table.get("g:a", "FooTest#test") is None
+    assert table.score("g:a", "FooTest#test") == 0.0
+
+    table.record("g:a", "FooTest#test", runs=2, failures=1)  # Reproduced, not flaky
+    table.record("g:a", "FooTest#test", runs=2, failures=0)
+    assert table.get("g:a", "FooTest#test") == {'evaluations': 2, 'runs': 4, 'failures': 1, 'flaky': 1}
+    assert table.score("g:a", "FooTest#test") == 0.5
+    assert table.get_quarantined("g:a") == set()  # Not evaluated often enough
+
+    table.record("g:a", "FooTest#test", runs=2, failures=0)
+    assert table.get_quarantined("g:a") == {"FooTest#test"}
+    assert table.get_quarantined("g:b") == set()
+    for _ in range(2):
+        table.record("g:a", "FooTest#test", runs=2, failures=2)
+    assert table.get_quarantined("g:a") == set()  # Flaky in only two of five evaluations
+
+    # Persisted across instances
+    assert FlakinessTable(tmp_path / "flakiness.db").get("g:a", "FooTest#test")['flaky'] == 2
+
+
+def test_quarantine_expires(tmp_path):
+    table = FlakinessTable(tmp_path / "flakiness.db", min_evaluations=1, ttl=0.05)
+    table.record("g:a", "FooTest#test", runs=2, failures=0)
+    assert table.get_quarantined("g:a") == {"FooTest#test"}
+    time.sleep(0.1)
+    assert table.get_quarantined("g:a") == set()
@@ -0,0 +1,95 @@
+import functools
+import hashlib
+import os
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import pytest
+
+from server.jar_fetcher import fetch_jar, prefetch_jars, get_artifact_path
+
+G, A = "com.example.dep", "dep"
+
+
+def deploy_jar(repository, v: str, content: bytes, checksum=None):
+    """Writes a jar (and its .sha1) for com.example.dep:dep:v into the given repository directory."""
+    jar_path = repository / get_artifact_path(G, A, v, f"{A}-{v}.jar")
+    os.makedirs(jar_path.parent, exist_ok=True)
+    jar_path.write_bytes(content)
+    checksum = checksum if checksum is not None else hashlib.sha1(content).hexdigest()
+    (jar_path.parent / f"{jar_path.name}.sha1").write_text(checksum)
+    return jar_path
+
+
+@pytest.fixture
+def remote(tmp_path):
+    """Serves tmp_path/remote over HTTP as a stand-in for a remote Maven repository."""
+    root = tmp_path / "remote"
+    os.makedirs(root)
+
+    class QuietHandler(SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=str(root)))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield root, f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+
+
+def test_fetch_jar_from_local_m2(tmp_path):
+    m2 = tmp_path / "m2"
+    deploy_jar(m2, "1", b"jar-1")
+    with patch('server.jar_fetcher.LOCAL_M2_REPOSITORY', m2), \
+            patch('server.jar_fetcher.MAVEN_REPOSITORY', tmp_path / "maven"), \
+            patch('server.jar_fetcher.REMOTE_REPOSITORY', ""), \
+            patch('server.jar_fetcher.get_storage_manager') as get_storage_manager:
+        jar = fetch_jar(G, A, "1", jar_dir=tmp_path / "jars")
+
+    assert jar == tmp_path / "jars" / "dep-1.jar"
+    assert jar.read_bytes() == b"jar-1"
+    get_storage_manager.assert_not_called()  # Jars outside the managed directories are not tracked
+
+
+def test_fetch_jar_skips_corrupt_local_jar(tmp_path, remote):
+    remote_root, remote_url = remote
+    m2 = tmp_path / "m2"
+    deploy_jar(m2, "1", b"corrupt", checksum=hashlib.sha1(b"jar-1").hexdigest())
+    deploy_jar(remote_root, "1", b"jar-1")
+    with patch('server.jar_fetcher.LOCAL_M2_REPOSITORY', m2), \
+            patch('server.jar_fetcher.MAVEN_REPOSITORY', tmp_path / "maven"), \
+            patch('server.jar_fetcher.REMOTE_REPOSITORY', remote_url):
+        jar = fetch_jar(G, A, "1", jar_dir=tmp_path / "jars")
+
+    assert jar.read_bytes() == b"jar-1"
+
+
+def test_fetch_jar_rejects_remote_checksum_mismatch(tmp_path, remote):
+    remote_root, remote_url = remote
+    deploy_jar(remote_root, "1", b"jar-1", checksum="0" * 40)
+    with patch('server.jar_fetcher.LOCAL_M2_REPOSITORY', tmp_path / "m2"), \
+            patch('server.jar_fetcher.MAVEN_REPOSITORY', tmp_path / "maven"), \
+            patch('server.jar_fetcher.REMOTE_REPOSITORY', remote_url):
+        jar = fetch_jar(G, A, "1", jar_dir=tmp_path / "jars")
+
+    assert jar is None
+    assert os.listdir(tmp_path / "jars") == []  # No partial downloads are left behind
+
+
+def test_prefetch_jars(tmp_path, remote):
+    remote_root, remote_url = remote
+    maven = tmp_path / "maven"
+    deploy_jar(maven, "1", b"jar-1")
+    deploy_jar(remote_root, "2", b"jar-2")
+    deploy_jar(remote_root, "3", b"jar-3")
+    with patch('server.jar_fetcher.LOCAL_M2_REPOSITORY', tmp_path / "m2"), \
+            patch('server.jar_fetcher.MAVEN_REPOSITORY', maven), \
+            patch('server.jar_fetcher.REMOTE_REPOSITORY', remote_url):
+        jars = prefetch_jars(G, A, ["1", "2", "3", "4"], jar_dir=tmp_path / "jars")
+
+    assert jars["1"].read_bytes() == b"jar-1"
+    assert jars["2"].read_bytes() == b"jar-2"
+    assert jars["3"].read_bytes() == b"jar-3"
+    assert jars["4"] is None
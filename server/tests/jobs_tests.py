@@ -0,0 +1,89 @@
+import threading
+import time
+
+from server.jobs import JobQueue, DONE, FAILED, QUEUED
+
+
+def blocking_compute(computed: list, release: threading.Event):
+    def compute(gav):
+        release.wait(5)
+        computed.append(gav)
+        return [gav.split(":")[-1]]
+    return compute
+
+
+def test_submit_deduplicates():
+    computed = []
+    release = threading.Event()
+    queue = JobQueue(blocking_compute(computed, release))
+
+    job = queue.submit("g:a:1")
+    assert queue.submit("g:a:1") is job
+    assert job.requests == 2
+
+    release.set()
+    job = queue.wait(job.id, 5)
+    assert job.status == DONE
+    assert job.result == ["1"]
+    assert computed == ["g:a:1"]
+
+    # Finished jobs are reused instead of recomputed
+    assert queue.submit("g:a:1") is job
+    assert computed == ["g:a:1"]
+
+
+def test_most_requested_gav_is_computed_first():
+    computed = []
+    release = threading.Event()
+    queue = JobQueue(blocking_compute(computed, release))
+
+    first = queue.submit("g:a:0")  # Occupies the single worker
+    while first.status == QUEUED:
+        time.sleep(0.01)
+    queue.submit("g:a:1")
+    queue.submit("g:a:2")
+    queue.submit("g:a:2")
+    queue.submit("g:a:3")
+    assert queue.pending() == 3
+
+    release.set()
+    for gav in ["g:a:0", "g:a:1", "g:a:2", "g:a:3"]:
+        queue.wait(queue.submit(gav).id, 5)
+    assert first.status == DONE
+    assert computed == ["g:a:0", "g:a:2", "g:a:1", "g:a:3"]
+
+
+def test_failed_job_is_retried_after_delay():
+    def compute(gav):
+        raise RuntimeError("no repository")
+
+    queue = JobQueue(compute, retry_after=3600)
+    job = queue.wait(queue.submit("g:a:1").id, 5)
+    assert job.status == FAILED
+    assert job.err == "RuntimeError: no repository"
+    assert queue.submit("g:a:1") is job
+
+    queue.retry_after = 0
+    retried = queue.submit("g:a:1")
+    assert retried is not job
+    assert queue.wait(retried.id, 5).status == FAILED
+
+
+def test_wait_times_out():
+    release = threading.Event()
+    queue = JobQueue(blocking_compute([], release))
+    queue.submit("g:a:0")
+    job = queue.submit("g:a:1")
+
+    assert queue.wait(job.id, 0.01).status == QUEUED
+    assert queue.wait("unknown", 0.01) is None
+    release.set()
+
+
+def test_old_jobs_are_forgotten():
+    queue = JobQueue(lambda gav: [], history=2)
+    jobs = [queue.wait(queue.submit(f"g:a:{i}").id, 5) for i in range(2)]
+    queue.wait(queue.submit("g:a:2").id, 5)
+
+    assert queue.get(jobs[0].id) is None
+    assert queue.get(jobs[1].id) is not None
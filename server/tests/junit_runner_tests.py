@@ -0,0 +1,105 @@
+import os
+from pathlib import Path
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from server.exceptions import DirectTestRunUnsupportedException
+from server.junit_runner import get_classpath_key, get_launcher_command, get_test_classpath, write_surefire_reports
+from server.test_failure import get_test_failures_from_dir, get_test_results_from_dir
+
+POM = """<?xml version="1.0" encoding="UTF-8"?>
+<project xmlns="http://maven.apache.org/POM/4.0.0">
+    <groupId>com.example</groupId>
+    <artifactId>example</artifactId>
+    <version>{version}</version>
+    <dependencies>
+        <dependency>
+            <groupId>junit</groupId>
+            <artifactId>junit</artifactId>
+            <version>{junit}</version>
+        </dependency>
+    </dependencies>
+</project>
+"""
+
+LAUNCHER_REPORT = """<?xml version="1.0" encoding="UTF-8"?>
+<testsuite name="JUnit Vintage" tests="3" skipped="0" failures="1" errors="0">
+    <testcase name="testAdd" classname="com.example.FooTest" time="0.01"/>
+    <testcase name="testSub()" classname="com.example.FooTest" time="0.01">
+        <failure message="expected 1" type="java.lang.AssertionError">stack</failure>
+        <system-out>output</system-out>
+    </testcase>
+    <testcase name="testMul" classname="com.example.BarTest" time="0.01"/>
+</testsuite>
+"""
+
+
+def write_pom(path: Path, version: str, junit: str = "4.13.2") -> Path:
+    os.makedirs(path, exist_ok=True)
+    (path / "pom.xml").write_text(POM.format(version=version, junit=junit))
+    return path / "pom.xml"
+
+
+def test_get_classpath_key(tmp_path):
+    key = get_classpath_key(write_pom(tmp_path / "a", "1.0"))
+    assert get_classpath_key(write_pom(tmp_path / "b", "2.0")) == key
+    assert get_classpath_key(write_pom(tmp_path / "c", "2.0", junit="4.12")) != key
+
+
+def test_get_test_classpath_is_cached(tmp_path):
+    base = MagicMock()
+    base.path = tmp_path / "base"
+    os.makedirs(base.path)
+    jar = tmp_path / "junit-4.13.2.jar"
+    jar.write_text("")
+    write_pom(tmp_path / "a", "1.0")
+    write_pom(tmp_path / "b", "2.0")
+
+    with patch("server.junit_runner.resolve_test_classpath", return_value=[str(jar)]) as resolve:
+        assert get_test_classpath(base, tmp_path / "a") == [str(jar)]
+        assert get_test_classpath(base, tmp_path / "b") == [str(jar)]
+        assert resolve.call_count == 1
+
+        # Entries that disappeared from the local repository are resolved again
+        os.remove(jar)
+        get_test_classpath(base, tmp_path / "a")
+        assert resolve.call_count == 2
+
+
+def test_get_test_classpath_rejects_testng(tmp_path):
+    base = MagicMock()
+    base.path = tmp_path
+    write_pom(tmp_path, "1.0")
+    with patch("server.junit_runner.resolve_test_classpath", return_value=["/m2/testng-7.5.jar"]):
+        with pytest.raises(DirectTestRunUnsupportedException):
+            get_test_classpath(base, tmp_path)
+
+
+def test_get_launcher_command(tmp_path):
+    target = tmp_path / "target"
+    command = get_launcher_command(Path("launcher.jar"), ["dep.jar"], target, tmp_path / "reports")
+    assert command[:4] == ["java", "-jar", "launcher.jar", "execute"]
+    assert os.pathsep.join([str(target / "test-classes"), str(target / "classes"), "dep.jar"]) in command
+    assert "--scan-class-path" in command
+
+    command = get_launcher_command(Path("launcher.jar"), [], target, tmp_path / "reports",
+                                   tests=["com.example.FooTest", "com.example.BarTest#testMul"],
+                                   excludes=["com.example.FooTest#testSub"])
+    assert "--scan-class-path" not in command
+    assert command[command.index("--select-class") + 1] == "com.example.FooTest"
+    assert command[command.index("--select-method") + 1] == "com.example.BarTest#testMul"
+    assert command[command.index("--exclude-methodname") + 1] == r"^(com\.example\.FooTest\#testSub\(.*\))$"
+
+
+def test_write_surefire_reports(tmp_path):
+    os.makedirs(tmp_path / "launcher")
+    (tmp_path / "launcher" / "TEST-junit-vintage.xml").write_text(LAUNCHER_REPORT)
+    write_surefire_reports(tmp_path / "launcher", tmp_path / "surefire-reports")
+
+    assert sorted(os.listdir(tmp_path / "surefire-reports")) == ["TEST-com.example.BarTest.xml",
+                                                                 "TEST-com.example.FooTest.xml"]
+    results = get_test_results_from_dir(tmp_path / "surefire-reports")
+    assert results == {"error": 0, "failure": 1, "pass": 2, "skipped": 0}
+    failures = get_test_failures_from_dir(tmp_path / "surefire-reports")
+    assert [(f.testcase_classname, f.testcase_name) for f in failures] == [("com.example.FooTest", "testSub")]
@@ -0,0 +1,197 @@
+import functools
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import pytest
+
+from server.app import app
+from server.maven_repository import DirectoryListingCache, UpstreamProxy, store_artifact
+
+JAR_PATH = "com/example/dep/1/dep-1.jar"
+
+
+@pytest.fixture
+def repository(tmp_path):
+    root = tmp_path / "maven_repository"
+    os.makedirs(root)
+    with patch('server.app.MAVEN_REPOSITORY', root), \
+            patch('server.app.listing_cache', DirectoryListingCache(root)):
+        yield root
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def test_store_artifact(tmp_path):
+    path = tmp_path / "a" / "dep-1.jar"
+    checksums = store_artifact(io.BytesIO(b"jar-1"), path)
+
+    assert path.read_bytes() == b"jar-1"
+    assert checksums['sha1'] == hashlib.sha1(b"jar-1").hexdigest()
+    assert (tmp_path / "a" / "dep-1.jar.sha1").read_text() == hashlib.sha1(b"jar-1").hexdigest()
+    assert (tmp_path / "a" / "dep-1.jar.md5").read_text() == hashlib.md5(b"jar-1").hexdigest()
+    assert sorted(os.listdir(tmp_path / "a")) == ["dep-1.jar", "dep-1.jar.md5", "dep-1.jar.sha1"]
+
+    # Checksums are not generated for checksum files
+    store_artifact(io.BytesIO(b"abc"), tmp_path / "a" / "dep-1.pom.sha1")
+    assert not os.path.isfile(tmp_path / "a" / "dep-1.pom.sha1.sha1")
+
+
+def test_upload_and_download(repository, client):
+    response = client.put(f"/maven/{JAR_PATH}", data=b"jar-1")
+    assert response.status_code == 201
+    assert (repository / JAR_PATH).read_bytes() == b"jar-1"
+
+    response = client.get(f"/maven/{JAR_PATH}.sha1")
+    assert response.data.decode() == hashlib.sha1(b"jar-1").hexdigest()
+
+    response = client.get(f"/maven/{JAR_PATH}")
+    assert response.data == b"jar-1"
+    etag = response.headers["ETag"]
+    assert "Last-Modified" in response.headers
+
+    response = client.get(f"/maven/{JAR_PATH}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    response = client.get(f"/maven/{JAR_PATH}", headers={"Range": "bytes=1-3"})
+    assert response.status_code == 206
+    assert response.data == b"ar-"
+
+
+def test_directory_listing_is_cached_and_invalidated(repository, client):
+    client.put(f"/maven/{JAR_PATH}", data=b"jar-1")
+
+    response = client.get("/maven/com/example/dep/")
+    assert b"/maven/com/example/dep/1" in response.data
+    etag = response.headers["ETag"]
+    assert client.get("/maven/com/example/dep/", headers={"If-None-Match": etag}).status_code == 304
+
+    with patch('server.maven_repository.os.listdir') as listdir:
+        client.get("/maven/com/example/dep/")
+        listdir.assert_not_called()
+
+    client.put("/maven/com/example/dep/2/dep-2.jar", data=b"jar-2")
+    response = client.get("/maven/com/example/dep/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert b"/maven/com/example/dep/2" in response.data
+
+
+def test_paths_outside_repository(repository, client):
+    assert client.put("/maven/../outside.jar", data=b"x").status_code in (400, 404)
+    assert not os.path.isfile(repository.parent / "outside.jar")
+    assert client.get("/maven/nonexistent").status_code == 404
+
+
+@pytest.fixture
+def upstream(tmp_path):
+    """Serves tmp_path/upstream over HTTP as a stand-in for an upstream Maven repository, counting GET requests."""
+    root = tmp_path / "upstream"
+    os.makedirs(root)
+    requests_per_path = Counter()
+
+    class CountingHandler(SimpleHTTPRequestHandler):
+        def do_GET(self):
+            requests_per_path[self.path] += 1
+            time.sleep(0.2)  # Slow enough for concurrent misses to overlap
+            super().do_GET()
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(CountingHandler, directory=str(root)))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield root, f"http://127.0.0.1:{httpd.server_address[1]}", requests_per_path
+    httpd.shutdown()
+
+
+def test_pull_through_proxy(repository, upstream, client):
+    upstream_root, upstream_url, requests_per_path = upstream
+    os.makedirs((upstream_root / JAR_PATH).parent)
+    (upstream_root / JAR_PATH).write_bytes(b"jar-1")
+
+    with patch('server.app.upstream_proxy', UpstreamProxy(repository, upstream_url, metadata_ttl=300)):
+        response = client.get(f"/maven/{JAR_PATH}")
+        assert response.status_code == 200
+        assert response.data == b"jar-1"
+        assert (repository / JAR_PATH).read_bytes() == b"jar-1"
+
+        # Served from the local repository from then on
+        assert client.get(f"/maven/{JAR_PATH}").data == b"jar-1"
+        assert requests_per_path[f"/{JAR_PATH}"] == 1
+
+        # Misses of the upstream are 404s
+        assert client.get("/maven/com/example/dep/2/dep-2.jar").status_code == 404
+
+
+def test_pull_through_proxy_coalesces_misses(repository, upstream):
+    upstream_root, upstream_url, requests_per_path = upstream
+    os.makedirs((upstream_root / JAR_PATH).parent)
+    (upstream_root / JAR_PATH).write_bytes(b"jar-1")
+    proxy = UpstreamProxy(repository, upstream_url, metadata_ttl=300)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        paths = list(executor.map(lambda _: proxy.fetch(JAR_PATH), range(8)))
+
+    assert all(path == repository / JAR_PATH for path in paths)
+    assert requests_per_path[f"/{JAR_PATH}"] == 1
+
+
+def test_pull_through_proxy_metadata_ttl(repository, upstream):
+    upstream_root, upstream_url, requests_per_path = upstream
+    metadata_path = "com/example/dep/maven-metadata.xml"
+    os.makedirs((upstream_root / metadata_path).parent)
+    (upstream_root / metadata_path).write_bytes(b"<metadata>1</metadata>")
+    proxy = UpstreamProxy(repository, upstream_url, metadata_ttl=300)
+
+    assert proxy.needs_fetch(metadata_path)
+    proxy.fetch(metadata_path)
+    assert not proxy.needs_fetch(metadata_path)
+
+    proxy.metadata_ttl = 0
+    time.sleep(0.01)
+    assert proxy.needs_fetch(metadata_path)
+    (upstream_root / metadata_path).write_bytes(b"<metadata>2</metadata>")
+    proxy.fetch(metadata_path)
+    assert (repository / metadata_path).read_bytes() == b"<metadata>2</metadata>"
+
+    # Locally deployed metadata is never replaced by the upstream's
+    store_artifact(io.BytesIO(b"<metadata>local</metadata>"), repository / "com/example/other/maven-metadata.xml")
+    assert not proxy.needs_fetch("com/example/other/maven-metadata.xml")
+
+
+def test_deployed_metadata_replaces_upstream_metadata(repository, upstream, client):
+    upstream_root, upstream_url, _ = upstream
+    metadata_path = "com/example/dep/maven-metadata.xml"
+    os.makedirs((upstream_root / metadata_path).parent)
+    (upstream_root / metadata_path).write_bytes(b"<metadata>upstream</metadata>")
+    proxy = UpstreamProxy(repository, upstream_url, metadata_ttl=0)
+    proxy.fetch(metadata_path)
+
+    assert client.put(f"/maven/{metadata_path}", data=b"<metadata>local</metadata>").status_code == 201
+    assert not os.path.exists(UpstreamProxy.marker_path(repository / metadata_path))
+    time.sleep(0.01)
+    assert not proxy.needs_fetch(metadata_path)
+
+
+def test_pull_through_proxy_releases_waiters_on_base_exceptions(repository):
+    proxy = UpstreamProxy(repository, "http://upstream", metadata_ttl=300)
+    futures = []
+
+    def interrupted_download(filename):
+        futures.append(proxy.in_flight[filename])  # Awaited by the threads coalesced into this download
+        raise KeyboardInterrupt
+    with patch.object(proxy, 'download', side_effect=interrupted_download):
+        with pytest.raises(KeyboardInterrupt):
+            proxy.fetch(JAR_PATH)
+    assert futures[0].result(timeout=1) is None
+    assert proxy.in_flight == {}
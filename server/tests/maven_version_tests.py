@@ -0,0 +1,37 @@
+from random import shuffle
+
+from server.maven_version import ComparableVersion, sort_versions, is_prerelease
+
+
+def test_qualifier_ordering():
+    ordered = ["1.0-alpha-1", "1.0-alpha-2", "1.0-beta-1", "1.0-milestone-1", "1.0-rc1", "1.0-SNAPSHOT", "1.0",
+               "1.0-sp", "1.0-unknown", "1.0.1", "1.1", "2"]
+    versions = ordered.copy()
+    shuffle(versions)
+    assert [str(v) for v in sort_versions(versions)] == ordered
+
+
+def test_numeric_ordering():
+    ordered = ["0.01", "1.0.3", "1.1.1", "2.2.2.2", "2.20.0", "10"]
+    versions = ordered.copy()
+    shuffle(versions)
+    assert [str(v) for v in sort_versions(versions)] == ordered
+
+
+def test_equivalent_versions():
+    assert ComparableVersion("1") == ComparableVersion("1.0.0")
+    assert ComparableVersion("1-ga") == ComparableVersion("1-final") == ComparableVersion("1")
+    assert ComparableVersion("1.0-cr1") == ComparableVersion("1.0-rc1")
+    assert ComparableVersion("1.0-a1") == ComparableVersion("1.0-alpha-1")
+    assert ComparableVersion("1.0-RC1") == ComparableVersion("1.0-rc1")
+    assert len(sort_versions(["1", "1.0", "1.0.0"])) == 1
+
+
+def test_qualifier_only_versions_are_lowest():
+    assert ComparableVersion("iamversion") < ComparableVersion("0.01")
+    assert ComparableVersion("1-1") < ComparableVersion("1.1")
+
+
+def test_is_prerelease():
+    assert all(is_prerelease(v) for v in ["1.0-SNAPSHOT", "2.0-M1", "2.0.0-rc1", "1.0-beta-2", "2.0a1", "1.0-CR1"])
+    assert not any(is_prerelease(v) for v in ["1.0", "31.0-jre", "1.0-sp1", "1.0.Final"])
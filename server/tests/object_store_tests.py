@@ -0,0 +1,80 @@
+import os
+from unittest.mock import MagicMock
+
+from git import Repo
+
+from server.config import clone_repo
+from server.object_store import (get_network_name, borrow_object_store, release_object_store, gc_object_stores,
+                                 read_borrowers, get_store_path, is_borrower)
+from server.repo_utils import git
+from tests.repo_utils_tests import make_remote
+
+
+def count_objects(path) -> int:
+    """Returns the number of objects stored in the repository itself, excluding borrowed objects."""
+    stats = dict(line.split(": ") for line in git(path, "count-objects", "-v").splitlines())
+    return int(stats["count"]) + int(stats["in-pack"])
+
+
+def test_get_network_name():
+    fork = MagicMock(full_name="someone/lib", fork=True)
+    fork.source.full_name = "origin/lib"
+    assert get_network_name(fork) == "origin/lib"
+    assert get_network_name(MagicMock(full_name="origin/lib", fork=False)) == "origin/lib"
+
+
+def test_clones_borrow_from_store(tmp_path):
+    url, shas = make_remote(tmp_path)
+    store_dir = tmp_path / "store"
+
+    clones = []
+    for name in ["clone", "fork"]:
+        store = borrow_object_store(store_dir, "origin/lib", f"{name}/lib", url, tmp_path / name)
+        clone_repo(url, tmp_path / name, strategy="full", reference=store)
+        clones.append(tmp_path / name)
+    assert store == get_store_path(store_dir, "origin/lib")
+    assert set(read_borrowers(store).values()) == {"clone__lib", "fork__lib"}
+
+    for clone in clones:
+        assert is_borrower(clone, store)
+        assert count_objects(clone) == 0  # All objects are borrowed from the store
+        assert (clone / "module" / "version.txt").read_text() == "2.0"
+        assert git(clone, "rev-list", "--all").split() == shas[::-1]
+    assert git(store, "tag").split() == []  # Tags are kept per remote
+    assert "refs/remotes/fork__lib/tags/v1.0" in git(store, "for-each-ref", "--format=%(refname)")
+
+
+def test_gc_object_stores(tmp_path):
+    url, shas = make_remote(tmp_path)
+    store_dir = tmp_path / "store"
+    store = borrow_object_store(store_dir, "origin/lib", "origin/lib", url, tmp_path / "clone")
+    clone_repo(url, tmp_path / "clone", strategy="full", reference=store)
+    # A commit only the clone has, made after the clone was deleted from the upstream
+    git(tmp_path / "clone", "-c", "user.name=test", "-c", "user.email=test@example.com", "commit", "-q",
+        "--allow-empty", "-m", "local")
+
+    assert gc_object_stores(store_dir) == 0  # The store was borrowed from too recently
+    assert gc_object_stores(store_dir, min_age=0) == 0
+    assert Repo(tmp_path / "clone").git.fsck("--connectivity-only") == ""
+    assert Repo(tmp_path / "clone").head.commit.parents[0].hexsha == shas[1]
+
+    assert release_object_store(store_dir, tmp_path / "clone")
+    assert gc_object_stores(store_dir, min_age=0) == 1
+    assert not os.path.isdir(store)
+
+
+def test_partial_clones_borrow_from_partial_store(tmp_path):
+    url, shas = make_remote(tmp_path)
+    store_dir = tmp_path / "store"
+    store = borrow_object_store(store_dir, "origin/lib", "origin/lib", url, tmp_path / "clone",
+                                object_filter="blob:none")
+    clone_repo(url, tmp_path / "clone", strategy="partial", reference=store)
+    assert git(store, "config", "remote.origin__lib.partialclonefilter").strip() == "blob:none"
+    blobs = git(store, "cat-file", "--batch-all-objects", "--batch-check=%(objecttype)").split()
+    assert "blob" not in blobs  # The store fetched no blobs, the clone fetches those it checks out
+    assert (tmp_path / "clone" / "module" / "version.txt").read_text() == "2.0"
+
+    git(tmp_path / "clone", "-c", "user.name=test", "-c", "user.email=test@example.com", "commit", "-q",
+        "--allow-empty", "-m", "local")
+    assert gc_object_stores(store_dir, min_age=0) == 0
+    assert Repo(tmp_path / "clone").head.commit.parents[0].hexsha == shas[1]
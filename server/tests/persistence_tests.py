@@ -0,0 +1,38 @@
+import os
+import threading
+
+import pytest
+
+from server.persistence import ThreadLocalConnection, atomic_write, write_atomically
+
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / "dir" / "file.json"
+    write_atomically(path, "old")
+    assert path.read_text() == "old"
+
+    with pytest.raises(RuntimeError):
+        with atomic_write(path) as f:
+            f.write("partial")
+            raise RuntimeError
+    assert path.read_text() == "old"  # Left as it was, without temporary files
+    assert os.listdir(path.parent) == ["file.json"]
+
+    write_atomically(path, b"new")
+    assert path.read_bytes() == b"new"
+
+
+def test_thread_local_connection(tmp_path):
+    connections = ThreadLocalConnection(tmp_path / "test.db", pragmas=["journal_mode=WAL"])
+    conn = connections.get()
+    assert connections.get() is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    others = []
+    thread = threading.Thread(target=lambda: others.append(connections.get()))
+    thread.start()
+    thread.join()
+    assert others[0] is not conn
+
+    connections.close()
+    assert connections.get() is not conn
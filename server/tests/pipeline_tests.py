@@ -0,0 +1,56 @@
+import threading
+import time
+
+from server.pipeline import CandidatePipeline
+
+
+def test_results_are_yielded_in_order():
+    def check(cv, build):
+        time.sleep(0.01 * (3 - int(cv)))  # Later candidates finish first
+        return f"{cv}:{build.result()}"
+    pipeline = CandidatePipeline(lambda cv: f"built-{cv}", check, build_workers=2, test_workers=3)
+    assert list(pipeline.run(["1", "2", "3"])) == [("1", "1:built-1"), ("2", "2:built-2"), ("3", "3:built-3")]
+
+
+def test_builds_overlap_with_tests():
+    first_tested = threading.Event()
+    built_during_test = []
+
+    def build(cv):
+        if cv == "2":
+            built_during_test.append(first_tested.wait(5))
+        return cv
+
+    def check(cv, future):
+        future.result()
+        if cv == "1":
+            first_tested.set()
+            time.sleep(0.05)
+        return cv
+    pipeline = CandidatePipeline(build, check, build_workers=1, test_workers=1)
+    assert [cv for cv, _ in pipeline.run(["1", "2"])] == ["1", "2"]
+    assert built_during_test == [True]
+
+
+def test_without_build_workers_checks_get_no_build():
+    pipeline = CandidatePipeline(lambda cv: cv, lambda cv, build: build, build_workers=0, test_workers=1)
+    assert list(pipeline.run(["1", "2"])) == [("1", None), ("2", None)]
+
+
+def test_closing_cancels_pending_builds():
+    release = threading.Event()
+    started, finished = [], []
+
+    def build(cv):
+        started.append(cv)
+        release.wait(5)
+        time.sleep(0.05)
+        finished.append(cv)
+        return cv
+    pipeline = CandidatePipeline(build, lambda cv, future: future.result(), build_workers=1, test_workers=1)
+    results = pipeline.run([str(i) for i in range(10)])
+    release.set()
+    assert next(results) == ("0", "0")
+    results.close()
+    assert len(started) <= 3  # Only the candidates submitted ahead of 0 may have started
+    assert finished == started  # and those that did are waited for
@@ -0,0 +1,60 @@
+from random import shuffle
+
+from server.ranges import RangeCache, create_range_spec
+
+
+def test_create_range_spec_basic():
+    assert create_range_spec(['1', '2', '3'], ['0', '1', '2', '3', '4']) == '[1,3]'
+
+
+def test_create_range_spec_restrictions():
+    assert create_range_spec(['1', '3'], ['0', '1', '2', '3', '4']) == '[1],[3]'
+    assert create_range_spec(['1', '3', '5'], ['0', '1', '2', '3', '4', '5']) == '[1],[3],[5]'
+    assert create_range_spec(['1'], ['0', '1', '2']) == '[1]'
+    assert create_range_spec([], ['0', '1', '2']) == '[]'
+
+
+def test_create_range_spec_weird():
+    versions = ['1.0.3', '2.20.0', '3.0-rc']
+    available = ['0.01', '1.1.1', '1.0.3', '2.20.0', '2.2.2.2', '3.0-rc', 'iamversion']
+    shuffle(versions)
+    shuffle(available)
+    assert create_range_spec(versions, available) == '[1.0.3],[2.20.0,3.0-rc]'
+
+
+def test_range_cache():
+    fetches = []
+    available = ['1', '2', '3', '4']
+
+    def fetch(g, a):
+        fetches.append((g, a))
+        return available
+
+    cache = RangeCache(fetch=fetch, ttl=3600)
+    assert cache.get_range("g", "a", ['1', '2']) == '[1,2]'
+    assert cache.get_range("g", "a", ['2', '1']) == '[1,2]'
+    assert cache.get_range("g", "a", []) is None
+    assert len(fetches) == 1  # Available versions are cached within the TTL
+    assert len(cache.ranges) == 1
+
+    # A change of the compatible versions is a different key
+    assert cache.get_range("g", "a", ['1', '2', '4']) == '[1,2],[4]'
+
+    # A change of the available versions is picked up after invalidation
+    available = ['1', '2', '3', '4', '5']
+    cache.invalidate("g", "a")
+    assert cache.get_range("g", "a", ['4', '5']) == '[4,5]'
+    assert len(fetches) == 2
+
+
+def test_range_cache_ttl():
+    fetches = []
+
+    def fetch(g, a):
+        fetches.append((g, a))
+        return ['1', '2']
+
+    cache = RangeCache(fetch=fetch, ttl=0)
+    cache.get_range("g", "a", ['1'])
+    cache.get_range("g", "a", ['1'])
+    assert len(fetches) == 2
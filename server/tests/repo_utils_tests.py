@@ -1,6 +1,17 @@
+import os
+import socket
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
 from core import get_github_session
-from server.repo_utils import repo_compiles, repo_has_tests
-from server.config import download_repo
+from server.exceptions import GithubTagNotFoundException
+from server.repo_utils import (repo_compiles, repo_has_tests, git, checkout_worktree, repo_lock,
+                               remove_stale_worktrees, get_worktree_owner, has_commit, ensure_commit)
+from server.config import download_repo, clone_repo, path_lock
 
 
 def test_repo_compiles():
@@ -30,3 +41,123 @@ def test_repo_has_tests_false_no_passing_tests():
     download_path = download_repo(repo)
     assert not repo_has_tests(download_path)
 
+
+
+def make_repo(path: Path) -> list[str]:
+    """Creates a git repository with a module directory and two commits, returning the commit shas."""
+    os.makedirs(path / "module")
+    git(path, "init", "-q")
+    shas = []
+    for version in ["1.0", "2.0"]:
+        (path / "module" / "version.txt").write_text(version)
+        git(path, "add", "-A")
+        git(path, "-c", "user.name=test", "-c", "user.email=test@example.com", "commit", "-q", "-m", version)
+        shas.append(git(path, "rev-parse", "HEAD").strip())
+    return shas
+
+
+def test_checkout_worktree(tmp_path):
+    shas = make_repo(tmp_path / "repo")
+    worktrees_dir = tmp_path / "worktrees"
+
+    def build(sha: str, started: threading.Barrier) -> str:
+        with checkout_worktree(tmp_path / "repo" / "module", sha, worktrees_dir=worktrees_dir) as work_dir:
+            started.wait(5)  # Both commits are checked out at the same time
+            return (work_dir / "version.txt").read_text()
+
+    started = threading.Barrier(2)
+    with ThreadPoolExecutor(2) as executor:
+        versions = list(executor.map(lambda sha: build(sha, started), shas))
+    assert versions == ["1.0", "2.0"]
+
+    # The worktrees are gone and the shared clone was not touched
+    assert os.listdir(worktrees_dir) == []
+    assert git(tmp_path / "repo", "worktree", "list").count("\n") == 1
+    assert (tmp_path / "repo" / "module" / "version.txt").read_text() == "2.0"
+
+    # A missing commit leaves no directory behind
+    with pytest.raises(GithubTagNotFoundException):
+        with checkout_worktree(tmp_path / "repo", "0" * 40, "v9.0", worktrees_dir=worktrees_dir):
+            pass
+    assert os.listdir(worktrees_dir) == []
+
+
+def test_stale_worktrees_are_removed(tmp_path):
+    shas = make_repo(tmp_path / "repo")
+    worktrees_dir = tmp_path / "worktrees"
+    os.makedirs(worktrees_dir)
+    dead = subprocess.Popen(["true"])
+    dead.wait()
+    git(tmp_path / "repo", "worktree", "add", "--detach", "--lock", "--reason", f"{socket.gethostname()}:{dead.pid}",
+        str(worktrees_dir / "crashed"), shas[0])
+    git(tmp_path / "repo", "worktree", "add", "--detach", "--lock", "--reason", get_worktree_owner(),
+        str(worktrees_dir / "in-use"), shas[0])
+
+    with repo_lock(tmp_path / "repo"):
+        assert remove_stale_worktrees(tmp_path / "repo", worktrees_dir) == 1
+    assert os.listdir(worktrees_dir) == ["in-use"]
+
+
+def make_remote(tmp_path: Path) -> tuple[str, list[str]]:
+    """Creates a bare repository with a tag per commit, served over file:// so that clones honour depth and filters."""
+    shas = make_repo(tmp_path / "src")
+    git(tmp_path / "src", "tag", "v1.0", shas[0])
+    git(tmp_path / "src", "tag", "v2.0", shas[1])
+    git(tmp_path, "clone", "-q", "--bare", str(tmp_path / "src"), str(tmp_path / "remote.git"))
+    git(tmp_path / "remote.git", "config", "uploadpack.allowFilter", "true")
+    return f"file://{tmp_path / 'remote.git'}", shas
+
+
+@pytest.mark.parametrize("strategy", ["full", "partial", "shallow"])
+def test_clone_repo_and_ensure_commit(tmp_path, strategy):
+    url, shas = make_remote(tmp_path)
+    clone_repo(url, tmp_path / "clone", strategy=strategy)
+    assert (tmp_path / "clone" / "module" / "version.txt").read_text() == "2.0"
+    shallow = git(tmp_path / "clone", "rev-parse", "--is-shallow-repository").strip() == "true"
+    assert shallow == (strategy == "shallow")
+    assert has_commit(tmp_path / "clone", shas[0]) != shallow
+    if strategy != "full":
+        assert git(tmp_path / "clone", "config", "remote.origin.promisor").strip() == "true"
+
+    with repo_lock(tmp_path / "clone"):
+        ensure_commit(tmp_path / "clone", shas[0], "v1.0")
+    assert has_commit(tmp_path / "clone", shas[0])
+    if shallow:
+        # Only the tag was fetched, the clone stays shallow
+        assert git(tmp_path / "clone", "tag").split() == ["v1.0"]
+        assert git(tmp_path / "clone", "rev-parse", "--is-shallow-repository").strip() == "true"
+
+    with checkout_worktree(tmp_path / "clone" / "module", shas[0], "v1.0", worktrees_dir=tmp_path / "wt") as work_dir:
+        assert (work_dir / "version.txt").read_text() == "1.0"
+
+
+def test_ensure_commit_fetches_new_tags(tmp_path):
+    url, shas = make_remote(tmp_path)
+    clone_repo(url, tmp_path / "clone", strategy="partial")
+
+    # A release tagged after the clone was made
+    (tmp_path / "src" / "module" / "version.txt").write_text("3.0")
+    git(tmp_path / "src", "-c", "user.name=test", "-c", "user.email=test@example.com", "commit", "-q", "-am", "3.0")
+    git(tmp_path / "src", "tag", "v3.0")
+    git(tmp_path / "src", "push", "-q", str(tmp_path / "remote.git"), "HEAD:refs/heads/release", "v3.0")
+    sha = git(tmp_path / "src", "rev-parse", "HEAD").strip()
+
+    with repo_lock(tmp_path / "clone"):
+        ensure_commit(tmp_path / "clone", sha, "v3.0")
+        assert has_commit(tmp_path / "clone", sha)
+        with pytest.raises(GithubTagNotFoundException):
+            ensure_commit(tmp_path / "clone", "0" * 40, "v4.0")
+
+
+def test_path_lock_is_dropped_once_released(tmp_path):
+    locks, held = {}, []
+
+    def hold(i):
+        with path_lock(locks, tmp_path / "repo"):
+            held.append(len(held))
+            assert len(locks) == 1
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(hold, range(8)))
+    assert held == list(range(8))
+    assert locks == {}
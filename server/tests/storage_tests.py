@@ -0,0 +1,131 @@
+import os
+import time
+
+from server.config import clone_repo
+from server.object_store import borrow_object_store
+from server.storage import StorageManager, get_size, parse_size, format_size
+from tests.repo_utils_tests import make_remote
+
+
+def make_manager(tmp_path, min_idle=0):
+    roots = {"base_templates": (tmp_path / "base_templates", 1), "jars": (tmp_path / "jars", 1),
+             "repos": (tmp_path / "repos", 2), "object_store": (tmp_path / "object_store", 2)}
+    for root, _ in roots.values():
+        os.makedirs(root)
+    return StorageManager(tmp_path / "storage.db", roots=roots, min_idle=min_idle, blob_store_dir=tmp_path / "blobs",
+                          object_store_dir=tmp_path / "object_store")
+
+
+def write_file(path, size):
+    os.makedirs(path.parent, exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size))
+
+
+def test_parse_and_format_size():
+    assert parse_size("512") == 512
+    assert parse_size("2K") == 2048
+    assert parse_size("1.5GB") == int(1.5 * 1024 ** 3)
+    assert format_size(2048) == "2.0K"
+    assert format_size(12) == "12B"
+
+
+def test_get_size_counts_hard_links_once(tmp_path):
+    write_file(tmp_path / "dir" / "a", 64 * 1024)
+    single = get_size(tmp_path / "dir")
+    os.link(tmp_path / "dir" / "a", tmp_path / "dir" / "b")
+    assert get_size(tmp_path / "dir") == single > 0
+
+
+def test_scan_and_touch(tmp_path):
+    manager = make_manager(tmp_path)
+    write_file(tmp_path / "jars" / "a-1.jar", 4096)
+    write_file(tmp_path / "base_templates" / "g:a:1" / "pom.xml", 4096)
+    write_file(tmp_path / "repos" / "owner" / "a" / "README", 4096)
+    manager.scan()
+    assert {kind: usage['entries'] for kind, usage in manager.usage().items()} == \
+           {"base_templates": 1, "jars": 1, "repos": 1}
+
+    manager.touch(tmp_path / "jars" / "a-1.jar")
+    manager.touch(tmp_path / "elsewhere.jar")  # Not managed
+    entries = {entry['path']: entry for entry in manager.entries()}
+    assert len(entries) == 3
+    assert entries[str((tmp_path / "jars" / "a-1.jar").resolve())]['hits'] == 1
+
+    os.remove(tmp_path / "jars" / "a-1.jar")
+    manager.scan()
+    assert "jars" not in manager.usage()
+
+
+def test_evict_lru_until_within_budget(tmp_path):
+    manager = make_manager(tmp_path)
+    for i in range(3):
+        write_file(tmp_path / "jars" / f"a-{i}.jar", 8192)
+    manager.scan()
+    for i in [1, 0, 2]:  # a-1 is the least recently used
+        manager.touch(tmp_path / "jars" / f"a-{i}.jar")
+        time.sleep(0.01)
+    size = manager.usage()["jars"]['size'] // 3
+
+    assert [os.path.basename(e['path']) for e in manager.evict(2 * size, dry_run=True)] == ["a-1.jar"]
+    assert os.path.isfile(tmp_path / "jars" / "a-1.jar")
+    evicted = manager.evict(size)
+    assert [os.path.basename(entry['path']) for entry in evicted] == ["a-1.jar", "a-0.jar"]
+    assert sorted(os.listdir(tmp_path / "jars")) == ["a-2.jar"]
+    assert manager.usage()["jars"]['entries'] == 1
+
+
+def test_evict_value_prefers_large_rarely_used_entries(tmp_path):
+    manager = make_manager(tmp_path)
+    write_file(tmp_path / "jars" / "small.jar", 4096)
+    write_file(tmp_path / "base_templates" / "g:a:1" / "big", 64 * 1024)
+    manager.scan()
+    for _ in range(3):
+        manager.touch(tmp_path / "jars" / "small.jar")
+    manager.touch(tmp_path / "base_templates" / "g:a:1")  # Used last, but larger and used less
+
+    evicted = manager.evict(8192, policy="value")
+    assert [os.path.basename(entry['path']) for entry in evicted] == ["g:a:1"]
+    assert not os.path.exists(tmp_path / "base_templates" / "g:a:1")
+
+
+def test_in_use_and_recently_used_entries_are_not_evicted(tmp_path):
+    manager = make_manager(tmp_path)
+    write_file(tmp_path / "jars" / "a.jar", 4096)
+    write_file(tmp_path / "repos" / "owner" / "a" / "README", 4096)
+    manager.scan()
+
+    with manager.in_use(tmp_path / "repos" / "owner" / "a"):
+        evicted = manager.evict(0)
+        assert [os.path.basename(entry['path']) for entry in evicted] == ["a.jar"]
+        assert os.path.isdir(tmp_path / "repos" / "owner" / "a")
+    assert [os.path.basename(entry['path']) for entry in manager.evict(0)] == ["a"]
+
+    idle_manager = make_manager(tmp_path / "idle", min_idle=3600)
+    write_file(tmp_path / "idle" / "jars" / "b.jar", 4096)
+    idle_manager.touch(tmp_path / "idle" / "jars" / "b.jar", 4096)
+    assert idle_manager.evict(0) == []
+    assert os.path.isfile(tmp_path / "idle" / "jars" / "b.jar")
+
+
+def test_enforce_budget_without_budget_is_noop(tmp_path):
+    manager = make_manager(tmp_path)
+    write_file(tmp_path / "jars" / "a.jar", 4096)
+    manager.scan()
+    assert manager.enforce_budget(None) == []
+    assert len(manager.enforce_budget(0)) == 1
+
+
+def test_object_stores_count_towards_budget_and_are_collected(tmp_path):
+    manager = make_manager(tmp_path)
+    url, _ = make_remote(tmp_path)
+    clone_path = tmp_path / "repos" / "origin" / "lib"
+    store = borrow_object_store(tmp_path / "object_store", "origin/lib", "origin/lib", url, clone_path)
+    clone_repo(url, clone_path, strategy="full", reference=store)
+    manager.scan()
+    assert set(manager.usage()) == {"repos", "object_store"}
+
+    evicted = manager.evict(0)
+    assert [entry['kind'] for entry in evicted] == ["repos"]  # The store itself is never evicted
+    assert not os.path.exists(store)  # but collected once its last borrower is gone
+    assert manager.usage() == {}
@@ -0,0 +1,76 @@
+import json
+import threading
+
+import pytest
+
+from server.store import (JsonCompatibilityStore, SqliteCompatibilityStore, get_compatibility_store,
+                          migrate_json_store)
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "json":
+        return JsonCompatibilityStore(tmp_path / "compatibilities.json")
+    return SqliteCompatibilityStore(tmp_path / "compatibilities.db")
+
+
+def test_store_get_missing(store):
+    assert store.get("g:a:1") == []
+    assert "g:a:1" not in store
+
+
+def test_store_add_is_incremental(store):
+    store.add("g:a:1", ["1", "2"])
+    store.add("g:a:1", ["2", "3"])
+    store.add("g:b:1", ["1"])
+
+    assert sorted(store.get("g:a:1")) == ["1", "2", "3"]
+    assert store.get("g:b:1") == ["1"]
+    assert "g:a:1" in store
+    assert {gav: sorted(versions) for gav, versions in store.items().items()} == \
+           {"g:a:1": ["1", "2", "3"], "g:b:1": ["1"]}
+
+
+def test_store_replace_overwrites(store):
+    store.update({"g:a:1": ["1", "2"], "g:b:1": ["1"]})
+    store.replace({"g:a:1": {"3"}})
+    assert store.items() == {"g:a:1": ["3"]}
+    assert "g:b:1" not in store
+
+
+def test_store_concurrent_writers(store):
+    def add_versions(i: int):
+        for j in range(20):
+            store.add("g:a:1", [f"{i}.{j}"])
+
+    threads = [threading.Thread(target=add_versions, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(store.get("g:a:1")) == 4 * 20
+
+
+def test_migrate_json_store(tmp_path):
+    json_path = tmp_path / "compatibilities.json"
+    with open(json_path, 'w') as f:
+        json.dump({"g:a:1": ["1", "2"], "g:b:2": ["2"]}, f)
+
+    store = SqliteCompatibilityStore(tmp_path / "compatibilities.db")
+    assert migrate_json_store(json_path, store) == 2
+    assert sorted(store.get("g:a:1")) == ["1", "2"]
+    assert store.get("g:b:2") == ["2"]
+
+
+def test_get_compatibility_store_migrates_once(tmp_path):
+    json_path = tmp_path / "compatibilities.json"
+    with open(json_path, 'w') as f:
+        json.dump({"g:a:1": ["1", "2"]}, f)
+
+    store = get_compatibility_store("sqlite", tmp_path / "compatibilities.db")
+    assert sorted(store.get("g:a:1")) == ["1", "2"]
+    assert get_compatibility_store("sqlite", tmp_path / "compatibilities.db") is store
+
+    with pytest.raises(ValueError):
+        get_compatibility_store("lmdb", tmp_path / "compatibilities.lmdb")
@@ -4,6 +4,7 @@ from unittest.mock import patch
 
 from tests.template import CAND_TEMPLATES_TEST_DIR, REPOS_TEST_DIR, cleanup_template, cleanup_repo
 
+from server.template import write_template_metadata, read_template_metadata, fingerprint_directory
 from server.template.candidate_template import CandidateTemplate
 
 
@@ -71,3 +72,21 @@ def test_candidate_template_prepare_template():
 
     cleanup_repo(template)
     cleanup_template(template)
+
+
+def test_candidate_template_classes_fingerprint(tmp_path):
+    template = CandidateTemplate.__new__(CandidateTemplate)
+    template.path = tmp_path
+    template.target_path = tmp_path / "target"
+    os.makedirs(template.target_path / "classes" / "com" / "example")
+    (template.target_path / "classes" / "com" / "example" / "Foo.class").write_bytes(b"foo")
+    write_template_metadata("repo", "v1", "abc", tmp_path)
+
+    fingerprint = template.get_classes_fingerprint()
+    assert read_template_metadata(tmp_path)['classes_fingerprint'] == fingerprint
+    assert read_template_metadata(tmp_path)['repo_name'] == "repo"
+
+    # Stored once, so later changes to the directory are not picked up
+    (template.target_path / "classes" / "com" / "example" / "Foo.class").write_bytes(b"bar")
+    assert template.get_classes_fingerprint() == fingerprint
+    assert fingerprint_directory(template.target_path / "classes") != fingerprint
@@ -0,0 +1,113 @@
+import io
+import json
+import os
+import shutil
+import tarfile
+from unittest.mock import patch
+
+from server.blob_store import deduplicate_directory, read_manifest, get_blob_path
+from server.template_registry import (export_template, import_template, read_bundle_info, get_template_hashes,
+                                      get_toolchain_fingerprint, SharedDirectoryRegistry, get_template_registry,
+                                      HttpRegistry, pull_template, push_template, get_bundle_name)
+
+
+def make_template(templates_dir, gav="g:a:1"):
+    template = templates_dir / gav
+    os.makedirs(template / "target" / "classes" / "org")
+    with open(template / "target" / "classes" / "org" / "A.class", 'wb') as f:
+        f.write(b"A")
+    with open(template / "pom.xml", 'w') as f:
+        f.write("<project/>")
+    with open(template / "_metadata.json", 'w') as f:
+        json.dump({'repo_name': "o/a", 'tag_name': "v1", 'commit_sha': "abc"}, f)
+    return template
+
+
+def rewrite_bundle_info(bundle_path, dest_path, info):
+    """Copies the bundle with its bundle.json replaced by info, as a tampered upload would be."""
+    with tarfile.open(bundle_path, "r:gz") as src, tarfile.open(dest_path, "w:gz") as dest:
+        for member in src.getmembers():
+            if member.name == "bundle.json":
+                data = json.dumps(info).encode()
+                member.size = len(data)
+                dest.addfile(member, io.BytesIO(data))
+            else:
+                dest.addfile(member, src.extractfile(member))
+
+
+@patch('server.template_registry.BLOB_STORE', True)
+def test_export_and_import_template(tmp_path):
+    template = make_template(tmp_path / "built" / "cand_templates")
+    deduplicate_directory(template / "target" / "classes", tmp_path / "blobs")
+    info = export_template(template, "cand_templates", tmp_path / "bundle.tar.gz", toolchain="tc")
+    assert read_bundle_info(tmp_path / "bundle.tar.gz") == info
+    assert info['gav'] == "g:a:1"
+    assert set(info['manifest']) == {"pom.xml", "_metadata.json", "target/classes/org/A.class",
+                                     "target/classes.manifest.json"}
+
+    # Import over the empty template dir created before building
+    templates_dir = tmp_path / "node" / "cand_templates"
+    os.makedirs(templates_dir / "g:a:1" / "target")
+    assert import_template(tmp_path / "bundle.tar.gz", templates_dir, toolchain="tc",
+                           blob_store_dir=tmp_path / "node" / "blobs")
+    imported = templates_dir / "g:a:1"
+    assert get_template_hashes(imported) == info['manifest']
+    assert read_manifest(imported / "target" / "classes") == \
+           {"org/A.class": info['manifest']["target/classes/org/A.class"]}
+    assert sorted(os.listdir(templates_dir)) == ["g:a:1"]
+    assert os.path.samefile(imported / "target" / "classes" / "org" / "A.class",
+                            get_blob_path(tmp_path / "node" / "blobs", info['manifest']["target/classes/org/A.class"]))
+
+
+def test_import_rejects_other_toolchains_and_tampered_bundles(tmp_path):
+    template = make_template(tmp_path / "base_templates")
+    export_template(template, "base_templates", tmp_path / "bundle.tar.gz", toolchain="tc")
+    assert not import_template(tmp_path / "bundle.tar.gz", tmp_path / "node", toolchain="other")
+    assert not os.path.exists(tmp_path / "node" / "g:a:1")
+
+    info = read_bundle_info(tmp_path / "bundle.tar.gz")
+    info['manifest']["pom.xml"] = "0" * 40
+    rewrite_bundle_info(tmp_path / "bundle.tar.gz", tmp_path / "tampered.tar.gz", info)
+    assert not import_template(tmp_path / "tampered.tar.gz", tmp_path / "node", toolchain="tc")
+    assert os.listdir(tmp_path / "node") == []
+
+
+def test_import_rejects_bundles_naming_other_directories(tmp_path):
+    template = make_template(tmp_path / "base_templates")
+    export_template(template, "base_templates", tmp_path / "bundle.tar.gz", toolchain="tc")
+    os.makedirs(tmp_path / "victim")
+    for gav in ["../victim", "..", "g:a:1/../../victim"]:
+        info = read_bundle_info(tmp_path / "bundle.tar.gz")
+        info['gav'] = gav
+        rewrite_bundle_info(tmp_path / "bundle.tar.gz", tmp_path / "evil.tar.gz", info)
+        assert not import_template(tmp_path / "evil.tar.gz", tmp_path / "node", toolchain="tc")
+    assert os.path.isdir(tmp_path / "victim")
+    assert not os.path.exists(tmp_path / "node")
+
+
+@patch('server.template_registry.BLOB_STORE', True)
+def test_push_and_pull_through_shared_directory(tmp_path):
+    registry = SharedDirectoryRegistry(tmp_path / "registry")
+    template = make_template(tmp_path / "base_templates")
+    push_template(template, "base_templates", registry)
+    assert os.path.isfile(tmp_path / "registry" / get_bundle_name(get_toolchain_fingerprint(), "base_templates",
+                                                                   "g:a:1"))
+
+    assert pull_template("base_templates", "g:a:1", registry, tmp_path / "node", blob_store_dir=tmp_path / "blobs")
+    assert os.path.isfile(tmp_path / "node" / "g:a:1" / "target" / "classes" / "org" / "A.class")
+    assert len(list((tmp_path / "blobs").glob("*/*"))) == 1
+    assert not pull_template("base_templates", "g:a:2", registry, tmp_path / "node", blob_store_dir=tmp_path / "blobs")
+
+    # A bundle stored under the name of another GAV is not imported
+    toolchain = get_toolchain_fingerprint()
+    shutil.copy(tmp_path / "registry" / get_bundle_name(toolchain, "base_templates", "g:a:1"),
+                tmp_path / "registry" / get_bundle_name(toolchain, "base_templates", "g:a:3"))
+    assert not pull_template("base_templates", "g:a:3", registry, tmp_path / "node", blob_store_dir=tmp_path / "blobs")
+    assert not os.path.exists(tmp_path / "node" / "g:a:3")
+
+
+def test_get_template_registry(tmp_path):
+    assert get_template_registry(None) is None
+    assert isinstance(get_template_registry("http://server:5000/templates/"), HttpRegistry)
+    assert get_template_registry("http://server:5000/templates/").url == "http://server:5000/templates"
+    assert isinstance(get_template_registry(str(tmp_path)), SharedDirectoryRegistry)
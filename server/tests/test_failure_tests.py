@@ -1,7 +1,12 @@
+import os
 import pathlib
+import shutil
+from collections import OrderedDict
+from unittest.mock import patch
 
 from server.test_failure import (TestFailure, get_test_failures_from_file, get_test_failures_from_dir,
-                                 at_least_one_passing_test, get_test_results_from_dir)
+                                 at_least_one_passing_test, get_test_results_from_dir, get_test_report_from_dir,
+                                 get_test_results_from_file)
 
 TEST_REPORTS = pathlib.Path(__file__).parent.parent.resolve() / "test_resources" / "test_reports"
 
@@ -78,3 +83,38 @@ def test_at_least_one_passing_test_fails_no_running():
 def test_at_least_one_passing_test_fails_no_passing():
     dir_path = TEST_REPORTS / "surefire-reports_no_passing"
     assert not at_least_one_passing_test(dir_path)
+
+
+def test_get_test_report_from_dir_parallel():
+    dir_path = TEST_REPORTS / "surefire-reports"
+    serial = get_test_report_from_dir(dir_path, workers=1)
+    with patch('server.test_failure.report_cache', OrderedDict()), \
+            patch('server.test_failure.REPORT_PARSE_PARALLEL_THRESHOLD', 1):
+        parallel = get_test_report_from_dir(dir_path, workers=2)
+    assert parallel.results == serial.results
+    assert parallel.failures == serial.failures
+    assert len(serial.failures) == 2 + 55
+
+
+def test_get_test_report_from_dir_is_cached(tmp_path):
+    shutil.copytree(TEST_REPORTS / "surefire-reports_skipped", tmp_path / "reports")
+    dir_path = tmp_path / "reports"
+    assert get_test_report_from_dir(dir_path).results['pass'] == 50
+
+    with patch('server.test_failure.parse_test_report') as parse_test_report:
+        assert get_test_report_from_dir(dir_path).results['pass'] == 50
+        parse_test_report.assert_not_called()
+
+    # Rewritten reports are parsed again
+    report = dir_path / sorted(os.listdir(dir_path))[0]
+    report.write_text('<testsuite name="s"><testcase name="t" classname="c"><failure/></testcase></testsuite>')
+    assert get_test_report_from_dir(dir_path).results['failure'] == 1
+    assert TestFailure("s", "t", "c", "failure") in get_test_failures_from_dir(dir_path)
+
+
+def test_get_test_results_from_malformed_file(tmp_path):
+    report = tmp_path / "TEST-malformed.xml"
+    report.write_text('<testsuite name="s"><testcase name="t" classname="c"/><testcase')
+    assert get_test_results_from_file(report) == {}
+    assert get_test_failures_from_file(report) == set()
+    assert get_test_results_from_dir(tmp_path)['pass'] == 0
@@ -0,0 +1,90 @@
+import os
+import struct
+from pathlib import Path
+from unittest.mock import MagicMock
+
+from server.dynamic import get_surefire_command
+from server.test_selection import get_class_references, get_changed_classes, get_affected_classes, select_tests
+
+
+def utf8(string: str) -> bytes:
+    return struct.pack(">BH", 1, len(string)) + string.encode()
+
+
+def write_class(classes_dir: Path, name: str, references: list[str], field_type: str = "", version: int = 1):
+    """Writes a minimal .class file whose constant pool references the given classes."""
+    entries = [utf8(name), struct.pack(">BH", 7, 1), struct.pack(">BQ", 5, version)]  # The long takes up two entries
+    for reference in references:
+        entries.append(utf8(reference))
+        entries.append(struct.pack(">BH", 7, len(entries) + 1))  # Index of the utf8 entry above
+    if field_type:
+        entries.append(utf8(f"Ljava/util/List<L{field_type};>;"))
+    constant_pool_count = len(entries) + 2
+    data = struct.pack(">IHHH", 0xCAFEBABE, 0, 52, constant_pool_count) + b"".join(entries)
+    data += struct.pack(">HHHHHHH", 0x21, 2, 0, 0, 0, 0, 0)
+    path = classes_dir / f"{name}.class"
+    os.makedirs(path.parent, exist_ok=True)
+    path.write_bytes(data)
+
+
+def template(tmp_path: Path, name: str) -> MagicMock:
+    mock = MagicMock()
+    mock.path = tmp_path / name
+    mock.target_path = tmp_path / name / "target"
+    os.makedirs(mock.target_path, exist_ok=True)
+    return mock
+
+
+def test_get_class_references(tmp_path):
+    write_class(tmp_path, "com/example/FooTest", ["com/example/Foo", "[Lcom/example/Bar;"], field_type="com/example/Baz")
+    assert get_class_references(tmp_path / "com/example/FooTest.class") == {
+        "com/example/FooTest", "com/example/Foo", "com/example/Bar", "com/example/Baz", "java/util/List"}
+
+
+def test_get_changed_classes(tmp_path):
+    write_class(tmp_path / "base", "com/example/Foo", [])
+    write_class(tmp_path / "base", "com/example/Bar", [])
+    write_class(tmp_path / "cand", "com/example/Foo", [], version=2)
+    write_class(tmp_path / "cand", "com/example/Bar", [])
+    write_class(tmp_path / "cand", "com/example/New", [])
+    assert get_changed_classes(tmp_path / "base", tmp_path / "cand") == {"com/example/Foo", "com/example/New"}
+
+    (tmp_path / "cand" / "config.properties").write_text("a=1")
+    assert get_changed_classes(tmp_path / "base", tmp_path / "cand") is None
+
+
+def test_get_affected_classes():
+    tests = {"FooTest": ["Foo"], "BarTest": ["Bar"], "AbstractTest": ["Util"], "UtilTest": ["AbstractTest"]}
+    main = {"Foo": ["Helper"], "Bar": [], "Helper": []}
+    assert get_affected_classes({"Helper"}, tests, main) == {"Helper", "Foo", "FooTest"}
+    assert get_affected_classes({"Util"}, tests, main) == {"Util", "AbstractTest", "UtilTest"}
+
+
+def test_select_tests(tmp_path):
+    base, baseline, candidate = (template(tmp_path, name) for name in ["base", "baseline", "candidate"])
+    os.makedirs(base.target_path / "surefire-reports_BASE")
+    for test_class in ["FooTest", "BarTest", "BazTest", "QuxTest"]:
+        write_class(base.target_path / "test-classes", f"com/example/{test_class}", [f"com/example/{test_class[:3]}"])
+        (base.target_path / "surefire-reports_BASE" / f"TEST-com.example.{test_class}.xml").write_text("")
+    write_class(base.target_path / "test-classes", "com/example/FooTest$Nested", ["com/example/Helper"])
+    for name in ["Foo", "Baz", "Qux", "Helper"]:
+        write_class(baseline.target_path / "classes", f"com/example/{name}", [])
+        write_class(candidate.target_path / "classes", f"com/example/{name}", [])
+    write_class(baseline.target_path / "classes", "com/example/Bar", ["com/example/Helper"])
+    write_class(candidate.target_path / "classes", "com/example/Bar", ["com/example/Helper"])
+
+    # Identical bytecode reaches no tests
+    assert select_tests(base, baseline, candidate) == []
+
+    write_class(candidate.target_path / "classes", "com/example/Helper", [], version=2)
+    assert select_tests(base, baseline, candidate) == ["com.example.BarTest", "com.example.FooTest"]
+    assert os.path.isfile(base.path / "_test_index.json")
+
+    assert select_tests(base, baseline, candidate, max_fraction=0.25) is None
+    assert select_tests(base, baseline, candidate, enabled=False) is None
+
+
+def test_get_surefire_command():
+    assert get_surefire_command() == ["mvn", "surefire:test"]
+    command = get_surefire_command(["com.example.FooTest", "com.example.BarTest"])
+    assert "-Dtest=com.example.FooTest,com.example.BarTest" in command
@@ -0,0 +1,36 @@
+import os
+from unittest.mock import MagicMock
+
+from server.test_sharding import get_test_durations, split_into_shards, get_shards
+
+
+def write_reports(reports_dir, durations: dict[str, str]):
+    os.makedirs(reports_dir, exist_ok=True)
+    for test_class, duration in durations.items():
+        (reports_dir / f"TEST-{test_class}.xml").write_text(f'<testsuite name="{test_class}" time="{duration}"/>')
+
+
+def test_get_test_durations(tmp_path):
+    write_reports(tmp_path, {"FooTest": "1,200.5", "FooTest$Nested": "0.5", "BarTest": "2", "BazTest": "oops"})
+    assert get_test_durations(tmp_path) == {"FooTest": 1201.0, "BarTest": 2.0, "BazTest": 0.0}
+
+
+def test_split_into_shards():
+    durations = {"A": 10, "B": 6, "C": 5, "D": 4, "E": 1}
+    assert split_into_shards(durations, 2) == [["A", "D"], ["B", "C", "E"]]
+
+    assert split_into_shards({"A": 1, "B": 1}, 8) == [["A"], ["B"]]
+
+
+def test_get_shards(tmp_path):
+    base = MagicMock()
+    base.target_path = tmp_path
+    assert get_shards(base, shards=2) is None  # No durations to balance the shards with
+
+    write_reports(tmp_path / "surefire-reports_BASE", {"FooTest": "9", "BarTest": "5", "BazTest": "4"})
+    assert get_shards(base, shards=1) is None
+    assert get_shards(base, shards=2) == [["FooTest"], ["BarTest", "BazTest"]]
+    # Selected classes without history count as an average class
+    assert get_shards(base, ["FooTest", "NewTest"], shards=2) == [["FooTest"], ["NewTest"]]
+    assert get_shards(base, ["FooTest"], shards=2) is None
+    assert get_shards(base, ["FooTest#testA", "BarTest#testB"], shards=2) is None
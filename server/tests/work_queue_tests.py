@@ -0,0 +1,104 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from server.exceptions import GithubTagNotFoundException, MavenCompileFailedException
+from server.work_queue import WorkQueue, run_worker, DONE, FAILED, LEASED, QUEUED, LEASE_EXPIRED
+
+
+@pytest.fixture
+def work_queue(tmp_path):
+    return WorkQueue(tmp_path / "work_queue.db", lease=60, max_attempts=2)
+
+
+def test_enqueue_is_idempotent(work_queue):
+    assert work_queue.enqueue("sweep", "g:a:1", {'g': "g", 'a': "a", 'v': "1"})
+    assert not work_queue.enqueue("sweep", "g:a:1")
+    assert work_queue.enqueue_many("sweep", {"g:a:1": None, "g:a:2": None}) == 1
+    assert work_queue.counts("sweep") == {QUEUED: 2}
+    assert work_queue.counts("other") == {}
+
+
+def test_claim_and_complete(work_queue):
+    work_queue.enqueue_many("sweep", {"g:a:1": [1], "g:a:2": [2]})
+
+    task = work_queue.claim("sweep", "worker-1")
+    assert task.key == "g:a:1" and task.payload == [1] and task.attempts == 1
+    assert work_queue.claim("sweep", "worker-2").key == "g:a:2"
+    assert work_queue.claim("sweep", "worker-3") is None
+
+    assert work_queue.heartbeat(task)
+    assert work_queue.complete(task, result=["1", "2"])
+    assert work_queue.get("sweep", "g:a:1")['status'] == DONE
+    assert work_queue.get("sweep", "g:a:1")['result'] == ["1", "2"]
+    assert work_queue.counts("sweep") == {DONE: 1, LEASED: 1}
+
+
+def test_expired_leases_are_requeued(work_queue):
+    work_queue.enqueue("sweep", "g:a:1")
+    work_queue.lease = -1  # Leases expire immediately, as if their workers died
+    task = work_queue.claim("sweep", "worker-1")
+
+    retried = work_queue.claim("sweep", "worker-2")
+    assert retried.key == "g:a:1" and retried.attempts == 2
+
+    # Both workers died on the task, so it is given up on once the lease of worker-2 expired
+    assert work_queue.claim("sweep", "worker-3") is None
+    assert work_queue.get("sweep", "g:a:1")['status'] == FAILED
+    assert work_queue.get("sweep", "g:a:1")['outcome'] == LEASE_EXPIRED
+
+    # The stale workers cannot report anymore
+    assert not work_queue.heartbeat(task)
+    assert not work_queue.complete(retried)
+
+
+def test_lost_lease_discards_outcome(work_queue):
+    work_queue.enqueue("sweep", "g:a:1")
+    work_queue.lease = -1
+    task = work_queue.claim("sweep", "worker-1")
+    work_queue.lease = 60
+    assert work_queue.requeue_expired("sweep") == 1
+
+    other = work_queue.claim("sweep", "worker-2")
+    assert other.attempts == 2
+    assert not work_queue.complete(task, outcome="NO_JAR")
+    assert work_queue.complete(other)
+    assert work_queue.get("sweep", "g:a:1")['status'] == DONE
+
+
+def test_run_worker_records_error_codes(work_queue):
+    work_queue.enqueue_many("sweep", {"g:a:1": None, "g:a:2": None, "g:a:3": None})
+
+    def handle(task):
+        if task.key == "g:a:2":
+            raise GithubTagNotFoundException("no tag for 2")
+        if task.key == "g:a:3":
+            raise MavenCompileFailedException("does not compile")
+        return [task.key]
+
+    assert run_worker(work_queue, "sweep", handle, worker="worker-1", heartbeat=0.01) == 3
+    assert work_queue.get("sweep", "g:a:1")['result'] == ["g:a:1"]
+    assert work_queue.get("sweep", "g:a:2")['message'] == "no tag for 2"
+    assert work_queue.outcomes("sweep") == {"NO_TAG": 1, "NO_COMPILE": 1}
+
+    assert work_queue.retry("sweep", ["NO_TAG"]) == 1
+    assert work_queue.counts("sweep") == {DONE: 1, FAILED: 1, QUEUED: 1}
+
+
+def test_concurrent_workers_claim_each_task_once(tmp_path):
+    WorkQueue(tmp_path / "work_queue.db").enqueue_many("sweep", {str(i): i for i in range(50)})
+    handled = []
+    lock = threading.Lock()
+
+    def handle(task):
+        with lock:
+            handled.append(task.payload)
+
+    def work(worker):
+        # Separate WorkQueue objects, as workers on different machines would have
+        return run_worker(WorkQueue(tmp_path / "work_queue.db"), "sweep", handle, worker=worker, poll=0.01)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert sum(executor.map(work, [f"worker-{i}" for i in range(4)])) == 50
+    assert sorted(handled) == list(range(50))